@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the ways batches of directory entries can travel from the listing to the
+workers: pickled through a multiprocessing queue, pickled to files (QUSEPICKLE)
+or through the shared memory ring. Producers send batches of entries shaped like
+read_directory results, consumers decode them and count the entries.
+
+    python bench-transport.py --batches 5000 --batch-size 100
+    python bench-transport.py --fields mode,path
+"""
+
+import argparse
+import multiprocessing
+import os
+import pickle
+import random
+import time
+
+from typing import Any, Dict, List, Optional, Sequence
+
+from qwalk_ring import BatchRing
+
+TRANSPORTS = ("queue", "pickle", "ring")
+
+
+def entry(n: int) -> Dict[str, Any]:
+    return {
+        "dir_id": "5160036463",
+        "type": "FS_FILE_TYPE_FILE",
+        "id": str(5158036745 + n),
+        "file_number": str(5158036745 + n),
+        "path": "/gravytrain-tommy/hosting-backup/map-tile/vet%020d.jpg" % n,
+        "name": "vet%020d.jpg" % n,
+        "change_time": "2018-03-31T22:04:48.877148926Z",
+        "creation_time": "2018-03-31T22:04:48.870469026Z",
+        "modification_time": "2015-11-25T07:15:51Z",
+        "child_count": 0,
+        "num_links": 1,
+        "datablocks": "1",
+        "blocks": "2",
+        "metablocks": "1",
+        "size": str(n * 17),
+        "owner": "12884901921",
+        "owner_details": {"id_type": "NFS_UID", "id_value": "33"},
+        "group": "17179869217",
+        "group_details": {"id_type": "NFS_GID", "id_value": "33"},
+        "mode": "0644",
+        "symlink_target_type": "FS_FILE_TYPE_UNKNOWN",
+    }
+
+
+def make_batch(size: int, fields: Optional[Sequence[str]]) -> List[Any]:
+    entries = [entry(n) for n in range(size)]
+    if fields is None:
+        return entries
+    return [tuple(map(dd.get, fields)) for dd in entries]
+
+
+def produce(
+    transport: str,
+    queue: Any,
+    ring: Optional[BatchRing],
+    batches: int,
+    batch: List[Any],
+) -> None:
+    for _ in range(batches):
+        item: Any = batch
+        if transport == "pickle":
+            item = "bench-%s-%s.pkl" % (time.time(), random.random())
+            with open(item, "wb") as fw:
+                pickle.dump(batch, fw)
+        elif transport == "ring":
+            ref = cast_ring(ring).put(batch)
+            while ref is None:
+                # ring is full, wait for the consumers
+                time.sleep(0.0001)
+                ref = cast_ring(ring).put(batch)
+            item = ref
+        queue.put(item)
+
+
+def consume(transport: str, queue: Any, ring: Optional[BatchRing], counts: Any) -> None:
+    count = 0
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        if transport == "pickle":
+            with open(item, "rb") as fr:
+                rows = pickle.load(fr)
+            os.remove(item)
+        elif transport == "ring":
+            rows = cast_ring(ring).get(item)
+            cast_ring(ring).free(item)
+        else:
+            rows = item
+        count += len(rows)
+    with counts.get_lock():
+        counts.value += count
+
+
+def cast_ring(ring: Optional[BatchRing]) -> BatchRing:
+    assert ring is not None
+    return ring
+
+
+def run(transport: str, args: argparse.Namespace, batch: List[Any]) -> float:
+    queue: Any = multiprocessing.Queue(args.queue_length)
+    ring = BatchRing(args.ring_bytes) if transport == "ring" else None
+    counts: Any = multiprocessing.Value("q", 0)
+    consumers = [
+        multiprocessing.Process(target=consume, args=(transport, queue, ring, counts))
+        for _ in range(args.consumers)
+    ]
+    producers = [
+        multiprocessing.Process(
+            target=produce,
+            args=(transport, queue, ring, args.batches // args.producers, batch),
+        )
+        for _ in range(args.producers)
+    ]
+    start = time.time()
+    for p in consumers + producers:
+        p.start()
+    for p in producers:
+        p.join()
+    for _ in consumers:
+        queue.put(None)
+    for p in consumers:
+        p.join()
+    seconds = time.time() - start
+    if ring is not None:
+        ring.close()
+    expected = (args.batches // args.producers) * args.producers * len(batch)
+    assert counts.value == expected, (counts.value, expected)
+    return seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--batches", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--producers", type=int, default=2)
+    parser.add_argument("--consumers", type=int, default=4)
+    parser.add_argument("--queue-length", type=int, default=1000)
+    parser.add_argument("--ring-bytes", type=int, default=32 * 1024 * 1024)
+    parser.add_argument(
+        "--fields", help="comma separated fields to keep, like a task's FIELDS"
+    )
+    parser.add_argument(
+        "--transports", default=",".join(TRANSPORTS), help="comma separated"
+    )
+    args = parser.parse_args()
+    fields = args.fields.split(",") if args.fields else None
+    batch = make_batch(args.batch_size, fields)
+    print(
+        "%s batches of %s entries, %s producers, %s consumers, %s bytes pickled"
+        % (
+            args.batches,
+            args.batch_size,
+            args.producers,
+            args.consumers,
+            len(pickle.dumps(batch)),
+        )
+    )
+    for transport in args.transports.split(","):
+        seconds = run(transport, args, batch)
+        print(
+            "%-8s %7.2fs %9d batches/s %11d entries/s"
+            % (
+                transport,
+                seconds,
+                args.batches / seconds,
+                args.batches * args.batch_size / seconds,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measure walk throughput against mock-qumulo.py: for every tree, task and engine
+start the mock with the tree, run qwalk.py over all of it in a scratch directory
+and report directories and files per second, the peak RSS of the biggest
+process and the CPU time of all of them.
+
+    python bench-walk.py
+    python bench-walk.py --trees wide,huge --tasks ModeBitsChecker --engines pool
+    python bench-walk.py --scale 10 --json results.json -- --autotune
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Any, Dict, List, Sequence
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# the REST port qwalk.py connects to
+PORT = 8000
+
+# mock-qumulo.py arguments for every tree, --scale multiplies the files
+TREES: Dict[str, Dict[str, Any]] = {
+    "wide": {"fanout": 20, "depth": 2, "files": 200},
+    "deep": {"fanout": 2, "depth": 10, "files": 50},
+    "huge": {
+        "fanout": 4,
+        "depth": 2,
+        "files": 20,
+        "huge-dirs": 1,
+        "huge-files": 100000,
+    },
+    "slow": {"fanout": 5, "depth": 4, "files": 40, "latency": 0.02, "jitter": 0.02},
+    "flaky": {"fanout": 5, "depth": 4, "files": 40, "error-rate": 0.01},
+}
+TASKS: Dict[str, List[str]] = {
+    "ModeBitsChecker": [],
+    "Search": ["--re", r"file-1\d*\.txt$"],
+    "SummarizeOwners": [],
+    "DataReductionTest": ["--perc", "0.01"],
+}
+ENGINES = ("pool", "async")
+
+
+def scaled(tree: Dict[str, Any], scale: float) -> Dict[str, Any]:
+    tree = dict(tree)
+    for key in ("files", "huge-files"):
+        if key in tree:
+            tree[key] = max(1, int(tree[key] * scale))
+    return tree
+
+
+def wait_for_port(port: int, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("mock-qumulo.py didn't start on port %s" % port)
+
+
+def run_walk(
+    task: str, engine: str, workdir: str, qwalk_args: Sequence[str]
+) -> Dict[str, Any]:
+    env = dict(os.environ, QOVERRIDEIPS="127.0.0.1", QWAITSECONDS="1")
+    command = [
+        sys.executable,
+        os.path.join(HERE, "qwalk.py"),
+        "-s",
+        "127.0.0.1",
+        "-d",
+        "/",
+        "-c",
+        task,
+        "--engine",
+        engine,
+    ]
+    command += TASKS[task] + list(qwalk_args)
+    start = time.time()
+    with open(os.path.join(workdir, "qwalk.log"), "w") as log:
+        proc = subprocess.Popen(  # pylint: disable=consider-using-with
+            command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        # the usage includes the pool workers, they're waited for by qwalk.py
+        _pid, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.time() - start
+    with open(os.path.join(workdir, "qwalk.log")) as log:
+        output = log.read()
+    done = re.search(r"Donestep-\s+(\d+) dir\|\s+(\d+) inod", output)
+    if status != 0 or done is None:
+        raise RuntimeError("qwalk.py failed:\n%s" % output[-2000:])
+    dirs, files = int(done.group(1)), int(done.group(2))
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "seconds": round(seconds, 2),
+        "dirs": dirs,
+        "files": files,
+        "dirs_per_second": round(dirs / seconds, 1),
+        "files_per_second": round(files / seconds, 1),
+        "peak_rss_mb": round(rss / 1024 / 1024, 1),
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        usage="%(prog)s [options] [-- qwalk.py arguments]",
+    )
+    parser.add_argument("--trees", default=",".join(TREES), help="comma separated")
+    parser.add_argument("--tasks", default=",".join(TASKS), help="comma separated")
+    parser.add_argument("--engines", default=",".join(ENGINES), help="comma separated")
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="multiply the files per directory"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args, qwalk_args = parser.parse_known_args()
+    qwalk_args = [a for a in qwalk_args if a != "--"]
+
+    results = []
+    print(
+        "%-6s %-18s %-6s %8s %9s %8s %10s %8s %8s"
+        % (
+            "tree",
+            "task",
+            "engine",
+            "dirs",
+            "files",
+            "dir/s",
+            "files/s",
+            "rss MB",
+            "cpu s",
+        )
+    )
+    for tree_name in args.trees.split(","):
+        tree = scaled(TREES[tree_name], args.scale)
+        mock_command = [sys.executable, os.path.join(HERE, "mock-qumulo.py")]
+        mock_command += ["--port", str(PORT)]
+        for key, value in tree.items():
+            mock_command += ["--" + key, str(value)]
+        mock = subprocess.Popen(  # pylint: disable=consider-using-with
+            mock_command, stdout=subprocess.DEVNULL
+        )
+        try:
+            wait_for_port(PORT, 30)
+            for task in args.tasks.split(","):
+                for engine in args.engines.split(","):
+                    workdir = tempfile.mkdtemp(prefix="bench-walk-")
+                    try:
+                        result = run_walk(task, engine, workdir, qwalk_args)
+                    finally:
+                        shutil.rmtree(workdir, ignore_errors=True)
+                    result.update({"tree": tree_name, "task": task, "engine": engine})
+                    results.append(result)
+                    print(
+                        "%-6s %-18s %-6s %8d %9d %8.1f %10.1f %8.1f %8.2f"
+                        % (
+                            tree_name,
+                            task,
+                            engine,
+                            result["dirs"],
+                            result["files"],
+                            result["dirs_per_second"],
+                            result["files_per_second"],
+                            result["peak_rss_mb"],
+                            result["cpu_seconds"],
+                        )
+                    )
+                    sys.stdout.flush()
+        finally:
+            mock.terminate()
+            mock.wait()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "scale": args.scale,
+                    "qwalk_args": qwalk_args,
+                    "cpu_count": os.cpu_count(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,614 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A stand-in for the parts of the Qumulo REST API that qwalk.py and the qtasks
+use, serving a synthetic tree, so walks can be run and measured without a
+cluster. The tree is computed, not stored, so it can have millions of entries.
+
+    python mock-qumulo.py --fanout 10 --depth 4 --files 100 --latency 0.002
+    QOVERRIDEIPS=127.0.0.1 python qwalk.py -s 127.0.0.1 -d / -c ModeBitsChecker
+
+Directories are named dir-ID and have ID as their file id, the root is 1. Every
+directory has --files files, except the first --huge-dirs directories below
+the root, which have --huge-files. GET /mock/stats returns request counts.
+Every snapshot id serves the same tree; the changes between any two snapshots
+are every --diff-every'th file modified, the next one created and the one after
+that deleted.
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+# File ids have this bit set, the directory id above the low 32 bits
+FILE_BIT = 1 << 62
+BLOCK = 4096
+TIME = "2020-01-01T00:00:00.123456789Z"
+ACL = {
+    "control": ["PRESENT"],
+    "posix_special_permissions": [],
+    "aces": [
+        {
+            "type": "ALLOWED",
+            "flags": [],
+            "trustee": {"domain": "POSIX_USER", "auth_id": "500", "uid": 500},
+            "rights": ["READ", "WRITE_ATTR", "EXECUTE"],
+        }
+    ],
+}
+
+
+class SyntheticTree:
+    """
+    A tree where directory n has children fanout*(n-1)+2 .. fanout*n+1 down to
+    the given depth, like a heap. Entries, pages, aggregates and file contents
+    are all computed from the ids.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        fanout: int,
+        depth: int,
+        files: int,
+        huge_dirs: int = 0,
+        huge_files: int = 0,
+        symlink_every: int = 0,
+    ):
+        self.fanout = max(1, fanout)
+        self.depth = depth
+        self.files = files
+        self.huge_dirs = min(huge_dirs, self.fanout if depth > 0 else 0)
+        self.huge_files = huge_files
+        self.symlink_every = symlink_every
+        # directories at each level and below it
+        self.below = [0] * (depth + 2)
+        for level in range(depth - 1, -1, -1):
+            self.below[level] = self.fanout * (1 + self.below[level + 1])
+        self.dir_count = 1 + self.below[0]
+
+    def total(self) -> Tuple[int, int]:
+        dirs, files = self.subtree(1)
+        return dirs + 1, files
+
+    def level(self, n: int) -> int:
+        level = 0
+        while n != 1:
+            n = (n - 2) // self.fanout + 1
+            level += 1
+        return level
+
+    def children(self, n: int) -> List[int]:
+        if self.level(n) >= self.depth:
+            return []
+        first = self.fanout * (n - 1) + 2
+        return list(range(first, first + self.fanout))
+
+    def file_count(self, n: int) -> int:
+        if 2 <= n < 2 + self.huge_dirs:
+            return self.huge_files
+        return self.files
+
+    def path(self, n: int) -> str:
+        parts = []
+        while n != 1:
+            parts.append("dir-%d" % n)
+            n = (n - 2) // self.fanout + 1
+        return "/" + "".join(p + "/" for p in reversed(parts))
+
+    def subtree(self, n: int) -> Tuple[int, int]:
+        # directories and files below n
+        dirs = self.below[self.level(n)]
+        files = (dirs + 1) * self.files
+        if n == 1:
+            files += self.huge_dirs * (self.huge_files - self.files)
+        elif 2 <= n < 2 + self.huge_dirs:
+            files += self.huge_files - self.files
+        return dirs, files
+
+    def resolve(self, ref: str) -> Optional[int]:
+        ref = unquote(ref)
+        if not ref.startswith("/"):
+            if not ref.isdigit():
+                return None
+            file_id = int(ref)
+            if file_id & FILE_BIT:
+                n, j = (file_id ^ FILE_BIT) >> 32, file_id & 0xFFFFFFFF
+                return file_id if self.exists(n) and j < self.file_count(n) else None
+            return file_id if self.exists(file_id) else None
+        n = 1
+        for part in [p for p in ref.split("/") if p]:
+            name, _, number = part.partition("-")
+            number = number.split(".")[0]
+            if not number.isdigit():
+                return None
+            if name == "dir" and int(number) in self.children(n):
+                n = int(number)
+            elif name == "file" and int(number) < self.file_count(n):
+                return self.file_id(n, int(number))
+            else:
+                return None
+        return n
+
+    def exists(self, n: int) -> bool:
+        return 1 <= n <= self.dir_count
+
+    def file_id(self, n: int, j: int) -> int:
+        return FILE_BIT | (n << 32) | j
+
+    def dir_entry(self, n: int) -> Dict[str, Any]:
+        dirs, files = len(self.children(n)), self.file_count(n)
+        return self.entry(
+            n,
+            "FS_FILE_TYPE_DIRECTORY",
+            self.path(n),
+            "dir-%d" % n,
+            0,
+            {"child_count": dirs + files, "num_links": 2, "mode": "0755"},
+        )
+
+    def file_entry(self, n: int, j: int) -> Dict[str, Any]:
+        symlink = self.symlink_every > 0 and j % self.symlink_every == (
+            self.symlink_every - 1
+        )
+        name = "file-%d.txt" % j
+        return self.entry(
+            self.file_id(n, j),
+            "FS_FILE_TYPE_SYMLINK" if symlink else "FS_FILE_TYPE_FILE",
+            self.path(n) + name,
+            name,
+            len(self.link_target(j)) if symlink else BLOCK * (1 + j % 64),
+            {
+                "child_count": 0,
+                "num_links": 1,
+                "mode": "0640" if j % 7 == 0 else "0644",
+                "owner": str(500 + j % 3),
+            },
+        )
+
+    @staticmethod
+    def link_target(j: int) -> str:
+        return "file-%d.txt" % (j // 2)
+
+    @staticmethod
+    def entry(  # pylint: disable=too-many-arguments
+        file_id: int,
+        file_type: str,
+        path: str,
+        name: str,
+        size: int,
+        extra: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        owner = extra.pop("owner", "500")
+        entry = {
+            "type": file_type,
+            "id": str(file_id),
+            "file_number": str(file_id),
+            "path": path,
+            "name": name,
+            "change_time": TIME,
+            "creation_time": TIME,
+            "modification_time": TIME,
+            "access_time": TIME,
+            "datablocks": str((size + BLOCK - 1) // BLOCK),
+            "blocks": str((size + BLOCK - 1) // BLOCK + 1),
+            "metablocks": "1",
+            "size": str(size),
+            "owner": owner,
+            "owner_details": {"id_type": "NFS_UID", "id_value": owner},
+            "group": "501",
+            "group_details": {"id_type": "NFS_GID", "id_value": "501"},
+            "symlink_target_type": "FS_FILE_TYPE_UNKNOWN",
+        }
+        entry.update(extra)
+        return entry
+
+    def attributes(self, file_id: int) -> Dict[str, Any]:
+        if file_id & FILE_BIT:
+            return self.file_entry((file_id ^ FILE_BIT) >> 32, file_id & 0xFFFFFFFF)
+        return self.dir_entry(file_id)
+
+    def page(self, n: int, after: int, limit: int) -> List[Dict[str, Any]]:
+        children = self.children(n)
+        total = len(children) + self.file_count(n)
+        end = min(after + limit, total)
+        page = [self.dir_entry(c) for c in children[after:end]]
+        for j in range(max(0, after - len(children)), max(0, end - len(children))):
+            page.append(self.file_entry(n, j))
+        return page
+
+    def page_count(self, n: int) -> int:
+        return len(self.children(n)) + self.file_count(n)
+
+    def changes(
+        self, every: int, after: Tuple[int, int], limit: int
+    ) -> Tuple[List[Dict[str, str]], Optional[Tuple[int, int]]]:
+        # a page of the snapshot diff and where the next one starts
+        ops = {0: "MODIFY", 1: "CREATE", 2: "DELETE"}
+        entries: List[Dict[str, str]] = []
+        n, start = after
+        while every > 0 and n <= self.dir_count:
+            for j in range(start, self.file_count(n)):
+                op = ops.get(j % every)
+                if op is None:
+                    continue
+                if len(entries) == limit:
+                    return entries, (n, j)
+                entries.append({"op": op, "path": self.path(n) + "file-%d.txt" % j})
+            n, start = n + 1, 0
+        return entries, None
+
+    def aggregates(self, n: int, max_entries: Optional[int]) -> Dict[str, Any]:
+        dirs, files = self.subtree(n)
+        entries = []
+        for c in self.children(n)[:max_entries]:
+            child_dirs, child_files = self.subtree(c)
+            entries.append(
+                {
+                    "name": "dir-%d" % c,
+                    "type": "FS_FILE_TYPE_DIRECTORY",
+                    "id": str(c),
+                    "num_files": str(child_files),
+                    "num_directories": str(child_dirs + 1),
+                    "capacity_usage": "0",
+                    "data_usage": "0",
+                }
+            )
+        return {
+            "id": str(n),
+            "path": self.path(n),
+            "total_files": str(files),
+            "total_directories": str(dirs),
+            "total_other_objects": "0",
+            "total_capacity": "0",
+            "total_data": "0",
+            "files": entries,
+        }
+
+    def data(self, file_id: int, offset: int, length: Optional[int]) -> bytes:
+        n, j = (file_id ^ FILE_BIT) >> 32, file_id & 0xFFFFFFFF
+        if self.file_entry(n, j)["type"] == "FS_FILE_TYPE_SYMLINK":
+            content = self.link_target(j).encode("utf8")
+            return content[offset : None if length is None else offset + length]
+        size = BLOCK * (1 + j % 64)
+        end = size if length is None else min(size, offset + length)
+        blocks = []
+        for block in range(offset // BLOCK, (end + BLOCK - 1) // BLOCK):
+            # a mix of blocks that compress well and blocks that don't
+            rnd = random.Random(file_id * 1000003 + block)
+            if block % 3 == 0:
+                blocks.append(rnd.getrandbits(8 * BLOCK).to_bytes(BLOCK, "little"))
+            else:
+                blocks.append(((b"%d-%d " % (j, block)) * BLOCK)[:BLOCK])
+        data = b"".join(blocks)
+        start = offset % BLOCK
+        return data[start : start + end - offset]
+
+
+class MockSettings:  # pylint: disable=too-few-public-methods
+    def __init__(self, args: argparse.Namespace):
+        self.latency = args.latency
+        self.jitter = args.jitter
+        self.error_rate = args.error_rate
+        self.token_seconds = args.token_seconds
+        self.nodes = ["127.0.0.%d" % (i + 1) for i in range(args.nodes)]
+        self.slow_nodes = set(args.slow_node or [])
+        self.slow_latency = args.slow_latency
+        self.down_nodes = set(args.down_node or [])
+        self.diff_every = args.diff_every
+        self.lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+
+def make_handler(tree: SyntheticTree, settings: MockSettings) -> Any:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self) -> None:
+            super().setup()
+            # headers and body go out in separate writes, without this every
+            # response waits for the client's delayed ACK
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def send_body(
+            self, body: bytes, code: int = 200, content_type: str = "application/json"
+        ) -> None:
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", '"1"')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, obj: Any, code: int = 200) -> None:
+            self.send_body(json.dumps(obj).encode("utf8"), code)
+
+        def send_error_json(self, code: int, error_class: str) -> None:
+            settings.count("http_%d" % code)
+            self.send_json(
+                {"error_class": error_class, "description": error_class}, code
+            )
+
+        def read_body(self) -> Any:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            return json.loads(body) if body else {}
+
+        def before(self) -> bool:
+            # latency, injected errors and expired tokens, False if turned away
+            node = self.connection.getsockname()[0]
+            delay = settings.latency + random.uniform(0, settings.jitter)
+            if node in settings.slow_nodes:
+                delay += settings.slow_latency
+            if delay:
+                time.sleep(delay)
+            if node in settings.down_nodes:
+                self.send_error_json(503, "service_unavailable")
+                return False
+            if settings.error_rate and random.random() < settings.error_rate:
+                self.send_error_json(503, "service_unavailable")
+                return False
+            auth = self.headers.get("Authorization", "")
+            if not auth.startswith("Bearer mock-"):
+                self.send_error_json(401, "unauthorized")
+                return False
+            if (
+                settings.token_seconds
+                and time.time() - float(auth[len("Bearer mock-") :])
+                > settings.token_seconds
+            ):
+                self.send_error_json(401, "unauthorized")
+                return False
+            return True
+
+        def route(self, method: str) -> None:
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parts = url.path.strip("/").split("/")
+            body = self.read_body()
+            if method == "POST" and url.path.rstrip("/") == "/v1/session/login":
+                settings.count("login")
+                self.send_json({"bearer_token": "mock-%s" % time.time()})
+                return
+            if url.path.rstrip("/") == "/mock/stats":
+                self.send_json(settings.stats)
+                return
+            if not self.before():
+                return
+            if method == "POST" and url.path.rstrip("/") == "/v1/identity/find":
+                # every auth id is a POSIX user named after it
+                settings.count("identity")
+                auth_id = str(body.get("auth_id", ""))
+                if not auth_id.isdigit():
+                    self.send_error_json(404, "identity_not_found_error")
+                    return
+                self.send_json(
+                    {
+                        "domain": "POSIX_USER",
+                        "auth_id": auth_id,
+                        "uid": int(auth_id),
+                        "gid": None,
+                        "sid": None,
+                        "name": "user%s" % auth_id,
+                    }
+                )
+                return
+            if url.path.startswith("/v2/network/interfaces/"):
+                settings.count("network")
+                self.send_json(
+                    [
+                        {"node_id": i + 1, "network_statuses": [{"address": address}]}
+                        for i, address in enumerate(settings.nodes)
+                    ]
+                )
+                return
+            if len(parts) == 5 and parts[1:4:2] == ["snapshots", "changes-since"]:
+                settings.count("GET changes-since")
+                limit = int(query.get("limit", ["1000"])[0])
+                n, _, j = query.get("after", ["1-0"])[0].partition("-")
+                entries, resume = tree.changes(
+                    settings.diff_every, (int(n), int(j)), limit
+                )
+                next_uri = ""
+                if resume is not None:
+                    next_uri = "%s?after=%d-%d&limit=%d" % (
+                        (url.path,) + resume + (limit,)
+                    )
+                self.send_json({"entries": entries, "paging": {"next": next_uri}})
+                return
+            if len(parts) < 3 or parts[1] != "files":
+                self.send_error_json(404, "api_not_found_error")
+                return
+            file_id = tree.resolve(parts[2])
+            if file_id is None:
+                self.send_error_json(404, "fs_no_such_entry_error")
+                return
+            what = "/".join(parts[3:])
+            is_dir = not file_id & FILE_BIT
+            settings.count("%s %s" % (method, what or "file"))
+            if method == "GET" and what == "entries" and is_dir:
+                limit = int(query.get("limit", ["1000"])[0])
+                after = int(query.get("after", ["0"])[0])
+                next_uri = ""
+                if after + limit < tree.page_count(file_id):
+                    next_uri = "/v1/files/%d/entries/?after=%d&limit=%d" % (
+                        file_id,
+                        after + limit,
+                        limit,
+                    )
+                self.send_json(
+                    {
+                        "files": tree.page(file_id, after, limit),
+                        "paging": {"next": next_uri, "prev": ""},
+                    }
+                )
+            elif method == "GET" and what in ("aggregates", "recursive-aggregates"):
+                max_entries = query.get("max-entries", [None])[0]
+                self.send_json(
+                    tree.aggregates(
+                        file_id, None if max_entries is None else int(max_entries)
+                    )
+                )
+            elif method == "GET" and what == "info/attributes":
+                self.send_json(tree.attributes(file_id))
+            elif method == "PATCH" and what == "info/attributes":
+                self.send_json(dict(tree.attributes(file_id), **body))
+            elif method == "GET" and what == "info/acl":
+                self.send_json(ACL)
+            elif method == "PUT" and what == "info/acl":
+                self.send_json(body)
+            elif method == "GET" and what == "data" and not is_dir:
+                length = query.get("length", [None])[0]
+                self.send_body(
+                    tree.data(
+                        file_id,
+                        int(query.get("offset", ["0"])[0]),
+                        None if length is None else int(length),
+                    ),
+                    content_type="application/octet-stream",
+                )
+            elif method == "POST" and what == "entries" and is_dir:
+                # renames only, the tree doesn't change
+                if body.get("action") != "RENAME":
+                    self.send_error_json(501, "not_implemented")
+                    return
+                source = tree.resolve(body["old_path"])
+                if source is None:
+                    self.send_error_json(404, "fs_no_such_entry_error")
+                    return
+                self.send_json(dict(tree.attributes(source), name=body["name"]))
+            else:
+                self.send_error_json(501, "not_implemented")
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            self.route("GET")
+
+        def do_POST(self) -> None:  # pylint: disable=invalid-name
+            self.route("POST")
+
+        def do_PUT(self) -> None:  # pylint: disable=invalid-name
+            self.route("PUT")
+
+        def do_PATCH(self) -> None:  # pylint: disable=invalid-name
+            self.route("PATCH")
+
+    return Handler
+
+
+def certificate(path: Optional[str]) -> str:
+    # A self-signed certificate, the walk doesn't verify it
+    if path:
+        return path
+    path = os.path.join(tempfile.gettempdir(), "mock-qumulo.pem")
+    if not os.path.exists(path):
+        subprocess.check_call(
+            [
+                "openssl",
+                "req",
+                "-x509",
+                "-newkey",
+                "rsa:2048",
+                "-nodes",
+                "-keyout",
+                path,
+                "-out",
+                path,
+                "-days",
+                "365",
+                "-subj",
+                "/CN=localhost",
+            ],
+            stderr=subprocess.DEVNULL,
+        )
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fanout", type=int, default=5, help="subdirectories")
+    parser.add_argument("--depth", type=int, default=5, help="levels of directories")
+    parser.add_argument("--files", type=int, default=40, help="files per directory")
+    parser.add_argument("--huge-dirs", type=int, default=0)
+    parser.add_argument("--huge-files", type=int, default=1000000)
+    parser.add_argument(
+        "--symlink-every", type=int, default=0, help="every Nth file is a symlink"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every request"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="random extra seconds, up to"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of requests to fail"
+    )
+    parser.add_argument(
+        "--token-seconds", type=float, default=0.0, help="bearer tokens expire"
+    )
+    parser.add_argument(
+        "--nodes", type=int, default=1, help="cluster nodes, 127.0.0.1 and up"
+    )
+    parser.add_argument("--slow-node", action="append", metavar="ADDRESS")
+    parser.add_argument("--slow-latency", type=float, default=0.05)
+    parser.add_argument("--down-node", action="append", metavar="ADDRESS")
+    parser.add_argument(
+        "--diff-every", type=int, default=0, help="files changed between snapshots"
+    )
+    parser.add_argument("--cert", help="PEM file with the key and certificate")
+    args = parser.parse_args()
+
+    tree = SyntheticTree(
+        args.fanout,
+        args.depth,
+        args.files,
+        args.huge_dirs,
+        args.huge_files,
+        args.symlink_every,
+    )
+    server = ThreadingHTTPServer(
+        (args.host, args.port), make_handler(tree, MockSettings(args))
+    )
+    server.daemon_threads = True
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certificate(args.cert))
+    # the handshake happens on the connection's own thread
+    server.socket = context.wrap_socket(
+        server.socket, server_side=True, do_handshake_on_connect=False
+    )
+    dirs, files = tree.total()
+    print(
+        "Serving %s directories and %s files on %s:%s"
+        % (dirs, files, args.host, args.port)
+    )
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import argparse
+import bisect
+import datetime
+import json
+import os
+import posixpath
+
+from typing import Any, Callable, cast, Dict, List, Mapping, Sequence, Tuple
+
+from . import FileInfo, Worker
+
+# Groups a worker keeps in memory before it writes them out
+MAX_GROUPS = 100000
+
+SIZE_BUCKETS = [1, 4096, 65536, 1 << 20, 16 << 20, 256 << 20, 1 << 32, 1 << 36]
+SIZE_LABELS = [
+    "0",
+    "<4KiB",
+    "<64KiB",
+    "<1MiB",
+    "<16MiB",
+    "<256MiB",
+    "<4GiB",
+    "<64GiB",
+    ">=64GiB",
+]
+MTIME_DAYS = [1, 7, 30, 90, 365, 730, 1825]
+MTIME_LABELS = ["<1d", "<7d", "<30d", "<90d", "<1y", "<2y", "<5y", ">=5y"]
+
+# Entry fields each way of grouping reads
+DIMENSIONS = {
+    "owner": ("owner", "owner_details"),
+    "group": ("group", "group_details"),
+    "type": ("type",),
+    "extension": ("name", "type"),
+    "depth": ("path",),
+    "top": ("path",),
+    "mtime": ("modification_time",),
+    "size": ("size",),
+}
+SUMS = ("count", "size", "datablocks")
+
+
+class Aggregate:
+    """
+    Count, size and datablocks summed by any combination of owner, group, type,
+    extension, depth, top level directory and modification time and size
+    buckets. Every worker process sums into its own dict and only writes its
+    groups to the result file when it has too many, before a checkpoint and when
+    it's done, so the file has about one line per group per worker and the
+    merge at the end is quick.
+    """
+
+    FILE_NAME = "aggregate.txt"
+
+    def __init__(self, in_args: Sequence[str]):
+        parser = argparse.ArgumentParser(description="")
+        parser.add_argument(
+            "--by",
+            default="owner",
+            help="comma separated, any of: %s" % ", ".join(DIMENSIONS),
+        )
+        parser.add_argument("--top", type=int, help="only print the N biggest groups")
+        parser.add_argument(
+            "--no-names",
+            action="store_true",
+            help="print owner and group ids without looking up their names",
+        )
+        args = parser.parse_args(in_args)
+        self.by = args.by.split(",")
+        for name in self.by:
+            if name not in DIMENSIONS:
+                parser.error("can't group by %s" % name)
+        self.top = args.top
+        self.resolve_names = not args.no_names
+        # auth id: name of the owners and groups in the report
+        self.names: Dict[str, str] = {}
+        self.FIELDS = sorted(
+            {"size", "datablocks"}.union(*(DIMENSIONS[name] for name in self.by))
+        )
+        # modification times newer than these are in the bucket, ISO 8601
+        # strings compare like the times
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.mtime_cutoffs = [
+            (now - datetime.timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%S")
+            for days in reversed(MTIME_DAYS)
+        ]
+        self.start_depth = 0
+        self.keys: List[Callable[[Mapping[str, Any]], Any]] = []
+        self.groups: Dict[Tuple[Any, ...], List[int]] = {}
+
+    @staticmethod
+    def depth(path: str) -> int:
+        return len([part for part in path.split("/") if part])
+
+    def key_function(self, name: str) -> Callable[[Mapping[str, Any]], Any]:
+        if name in ("owner", "group"):
+            details = name + "_details"
+            return lambda dd: (
+                dd[name],
+                dd[details]["id_type"],
+                dd[details]["id_value"],
+            )
+        if name == "type":
+            return lambda dd: dd["type"]
+        if name == "extension":
+            return lambda dd: (
+                ""
+                if dd["type"] == "FS_FILE_TYPE_DIRECTORY"
+                else posixpath.splitext(dd["name"])[1].lower()
+            )
+        if name == "depth":
+            return lambda dd: self.depth(dd["path"]) - self.start_depth
+        if name == "top":
+            # the directory right below the start directory, "" for the files
+            # directly in it
+            def top(dd: Mapping[str, Any]) -> str:
+                parts = [part for part in dd["path"].split("/") if part]
+                if len(parts) <= self.start_depth:
+                    return ""
+                if len(parts) == self.start_depth + 1 and not dd["path"].endswith("/"):
+                    return ""
+                return str(parts[self.start_depth])
+
+            return top
+        if name == "mtime":
+            return lambda dd: len(MTIME_DAYS) - bisect.bisect_right(
+                self.mtime_cutoffs, dd["modification_time"]
+            )
+        return lambda dd: bisect.bisect_right(SIZE_BUCKETS, int(dd["size"]))
+
+    def every_batch(self, file_list: Sequence[FileInfo], work_obj: Worker) -> None:
+        if not self.keys:
+            self.start_depth = self.depth(work_obj.start_path)
+            self.keys = [self.key_function(name) for name in self.by]
+        keys = self.keys
+        groups = self.groups
+        for file_obj in cast(Sequence[Mapping[str, Any]], file_list):
+            key = tuple(k(file_obj) for k in keys)
+            size = int(file_obj["size"])
+            datablocks = int(file_obj["datablocks"])
+            sums = groups.get(key)
+            if sums is None:
+                groups[key] = [1, size, datablocks]
+            else:
+                sums[0] += 1
+                sums[1] += size
+                sums[2] += datablocks
+        if len(groups) >= MAX_GROUPS:
+            self.worker_flush(work_obj)
+        work_obj.add_actions(1)
+
+    def worker_flush(self, work_obj: Worker) -> None:
+        work_obj.write_results(
+            self.FILE_NAME,
+            [json.dumps([key, sums]) for key, sums in self.groups.items()],
+        )
+        self.groups = {}
+
+    def merge(self, work_obj: Worker) -> Dict[Tuple[Any, ...], List[int]]:
+        totals: Dict[Tuple[Any, ...], List[int]] = {}
+        for line in work_obj.read_results(self.FILE_NAME):
+            key_raw, sums = json.loads(line)
+            key = tuple(tuple(v) if isinstance(v, list) else v for v in key_raw)
+            if key not in totals:
+                totals[key] = sums
+            else:
+                totals[key] = [a + b for a, b in zip(totals[key], sums)]
+        work_obj.remove_results(self.FILE_NAME)
+        return totals
+
+    def resolve(
+        self, totals: Dict[Tuple[Any, ...], List[int]], work_obj: Worker
+    ) -> None:
+        # every owner and group once, however many entries and workers had it
+        ids = [
+            (value[0], {"id_type": value[1], "id_value": value[2]})
+            for key in totals
+            for name, value in zip(self.by, key)
+            if name in ("owner", "group")
+        ]
+        if ids:
+            self.names = work_obj.identities.resolve(ids)
+
+    def label(self, name: str, value: Any) -> str:
+        if name in ("owner", "group"):
+            auth_id, id_type, id_value = value
+            return "%s (%s/%s)" % (self.names.get(auth_id, auth_id), id_type, id_value)
+        if name == "mtime":
+            return MTIME_LABELS[int(value)]
+        if name == "size":
+            return SIZE_LABELS[int(value)]
+        if name == "top":
+            return value or "."
+        return str(value)
+
+    def report(self, totals: Dict[Tuple[Any, ...], List[int]]) -> None:
+        rows = sorted(totals.items(), key=lambda group: -group[1][1])
+        if self.top is not None:
+            rows = rows[: self.top]
+        print("-" * 80)
+        print("|".join(self.by + list(SUMS)))
+        for key, sums in rows:
+            print(
+                "|".join(
+                    [self.label(name, v) for name, v in zip(self.by, key)]
+                    + [str(s) for s in sums]
+                )
+            )
+        print("-" * 80)
+
+    @staticmethod
+    def minimum_queue_length() -> int:
+        return 10
+
+    def work_start(self, _work_obj: Worker) -> None:
+        if os.path.exists(self.FILE_NAME):
+            os.remove(self.FILE_NAME)
+
+    def work_done(self, work_obj: Worker) -> None:
+        totals = self.merge(work_obj)
+        if self.resolve_names:
+            self.resolve(totals, work_obj)
+        self.report(totals)
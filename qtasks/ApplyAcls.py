@@ -1,5 +1,4 @@
 import argparse
-import io
 import json
 import os
 
@@ -13,6 +12,8 @@ from . import FileInfo, Worker
 
 
 class ApplyAcls:
+    FIELDS = ("type", "id", "path")
+
     def __init__(self, in_args: Sequence[str]):
         parser = argparse.ArgumentParser(description="")
         parser.add_argument("--replace_acls", help="")
@@ -67,16 +68,12 @@ class ApplyAcls:
                 print(e)
             results.append("%s|%s|%s" % (status, file_obj["id"], file_obj["path"]))
             if action_count >= 100:
-                with work_obj.result_file_lock:
-                    work_obj.action_count.value += action_count
+                work_obj.add_actions(action_count)
                 action_count = 0
 
         if len(results) > 0:
-            with work_obj.result_file_lock:
-                with io.open(work_obj.LOG_FILE_NAME, "a", encoding="utf8") as f:
-                    for d in results:
-                        f.write("%s\n" % d)
-                work_obj.action_count.value += action_count
+            work_obj.write_results(work_obj.LOG_FILE_NAME, results)
+            work_obj.add_actions(action_count)
 
     @staticmethod
     def minimum_queue_length() -> int:
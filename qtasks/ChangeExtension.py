@@ -1,5 +1,4 @@
 import argparse
-import io
 import os
 
 from typing import Optional, Sequence
@@ -8,6 +7,8 @@ from . import FileInfo, Worker
 
 
 class ChangeExtension:
+    FIELDS = ("dir_id", "path")
+
     def __init__(self, args: Sequence[str]):
         parser = argparse.ArgumentParser(description="")
         parser.add_argument("--from", help="", required=True, dest="ext_from")
@@ -37,11 +38,8 @@ class ChangeExtension:
                 results.append(result)
 
         if len(results) > 0:
-            with work_obj.result_file_lock:
-                with io.open(work_obj.LOG_FILE_NAME, "a", encoding="utf8") as f:
-                    for d in results:
-                        f.write("%s\n" % d)
-                work_obj.action_count.value += len(results)
+            work_obj.write_results(work_obj.LOG_FILE_NAME, results)
+            work_obj.add_actions(len(results))
 
     @staticmethod
     def minimum_queue_length() -> int:
@@ -293,16 +293,13 @@ class CopyDirectory:
 
         try:
             if len(results) > 0:
-                with work_obj.result_file_lock:
-                    with io.open(work_obj.LOG_FILE_NAME, "a", encoding="utf8") as f:
-                        for d in results:
-                            f.write("%s\n" % d)
-                    work_obj.action_count.value += len(results)
+                work_obj.write_results(work_obj.LOG_FILE_NAME, results)
+                work_obj.add_actions(len(results))
         except:
             log_it("Unable to save results exception: %s" % str(sys.exc_info()))
 
         if len(requeue) > 0:
-            if work_obj.queue_len.value < 50:
+            if work_obj.queue_length() < 50:
                 # Add a slight delay so workers have time to add the necessary children
                 time.sleep(0.1)
             work_obj.add_to_queue({"type": "process_list", "list": requeue})
@@ -1,116 +1,129 @@
 import argparse
 import codecs
-import hashlib
-import io
-import math
 import os
 import random
-import zlib
 
-from typing import Sequence, Union
+from typing import List, Optional, Sequence, Tuple
 
-from typing_extensions import TypedDict
+from qwalk_sample import RangeSampler
+from qwalk_sketch import HyperLogLog
 
 from . import FileInfo, Worker
 
 
-class Result(TypedDict):
-    cf: Union[int, str]
-    md5: str
-
-
 class DataReductionTest:
     FILE_NAME = "data-reduction-test-results.txt"
+    # every worker's block count and sketch, written by worker_flush
+    SKETCH_FILE_NAME = "data-reduction-test-sketch.txt"
+    FILE_NAMES = (SKETCH_FILE_NAME,)
+    FIELDS = ("type", "id", "name", "size")
 
     def __init__(self, in_args: Sequence[str]):
         parser = argparse.ArgumentParser(description="")
         parser.add_argument("--perc", help="", dest="perc")
+        parser.add_argument(
+            "--sample-size", type=int, default=4096, help="bytes read per sample"
+        )
+        parser.add_argument(
+            "--offsets",
+            default="0,1,0.5",
+            help="where the samples are, as fractions of the file size, in the "
+            "order they're taken",
+        )
+        parser.add_argument(
+            "--block-size",
+            type=int,
+            default=4096,
+            help="bytes per block when estimating deduplication",
+        )
+        parser.add_argument(
+            "--codecs",
+            help="comma separated, any of zlib:LEVEL, lzma:PRESET, zstd:LEVEL, "
+            "adds the sampled and compressed bytes of each to every line",
+        )
         args = parser.parse_args(in_args)
         self.sample_perc = 0.05
         if args.perc:
             self.sample_perc = float(args.perc)
+        self.sample_size = args.sample_size
+        offsets = [float(offset) for offset in args.offsets.split(",")]
+        # the compression factor columns are for the first codec
+        self.byte_columns = args.codecs is not None
+        self.codecs = args.codecs.split(",") if args.codecs else ["zlib:4"]
+        try:
+            self.sampler = RangeSampler(
+                self.sample_size, offsets, self.codecs, args.block_size
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        # columns from the start of the file to its end
+        self.columns = sorted(range(len(offsets)), key=lambda n: offsets[n])
+        # the distinct blocks of this worker's samples, and all of them
+        self.sketch = HyperLogLog()
+        self.blocks = 0
 
-    @staticmethod
-    def process_it(
-        work_obj: Worker,
-        file_id: str,
-        offset: int,
-        md5: "hashlib._Hash",
-    ) -> Result:
-        fw = io.BytesIO()
-        work_obj.rc.fs.read_file(file_=fw, id_=file_id, offset=offset, length=4096)
-        fw.seek(0)
-        c_len = len(zlib.compress(fw.read(), 4))
-        fw.seek(0)
-        md5.update(fw.read())
-        b64 = codecs.encode(md5.digest(), "base64").decode()
-        c_level = int(round(10 * c_len / 4096.0, 0))
-        if c_level == 10:
-            c_level = 9
-        return {"cf": c_level, "md5": b64[0:10]}
+    def compression_factor(self, compressed: Optional[int]) -> str:
+        # tenths of the sample size, 0 to 9
+        if compressed is None:
+            return "X"
+        return str(min(9, int(round(10 * compressed / float(self.sample_size), 0))))
 
     def every_batch(self, file_list: Sequence[FileInfo], work_obj: Worker) -> None:
-        res = []
-        action_count = 0
-        md5 = hashlib.md5()
+        sampled: List[Tuple[str, int]] = []
+        names = {}
         for file_obj in file_list:
             if file_obj["type"] == "FS_FILE_TYPE_FILE":
                 # sample 5% of files
                 if random.random() < (1 - self.sample_perc):
                     continue
-                action_count += 1
-                file_size = int(file_obj["size"])
-                md5 = hashlib.md5()
-                try:
-                    c_start = self.process_it(work_obj, file_obj["id"], 0, md5)
-                except:
-                    continue
-                c_end: Result = {"cf": "X", "md5": "X"}
-                c_middle: Result = {"cf": "X", "md5": "X"}
-                if file_size > 4096 * 2:
-                    try:
-                        c_end = self.process_it(
-                            work_obj, file_obj["id"], file_size - 4096, md5
-                        )
-                    except:
-                        continue
-                if file_size > 4096 * 3:
-                    try:
-                        c_middle = self.process_it(
-                            work_obj,
-                            file_obj["id"],
-                            int(math.floor((file_size / 2.0) / 4096) * 4096),
-                            md5,
-                        )
-                    except:
-                        continue
-                ext = file_obj["name"].rpartition(".")[-1]
-                ext = ext.encode("ascii", "ignore").decode("ascii")
-                if len(ext) > 6:
-                    ext = ext[0:6]
-                res.append(
-                    "%s|%s|%s|%s|%s|%s|%s|%s"
-                    % (
-                        c_start["cf"],
-                        c_middle["cf"],
-                        c_end["cf"],
-                        c_start["md5"],
-                        c_middle["md5"],
-                        c_end["md5"],
-                        ext,
-                        file_obj["size"],
-                    )
-                )
-                if action_count >= 100:
-                    with work_obj.result_file_lock:
-                        work_obj.action_count.value += action_count
-                    action_count = 0
+                sampled.append((file_obj["id"], int(file_obj["size"])))
+                names[file_obj["id"]] = file_obj["name"]
+        res = []
+        action_count = 0
+        for (file_id, file_size), sample in self.sampler.run(
+            sampled, work_obj.thread_client
+        ):
+            action_count += 1
+            if sample is None:
+                continue
+            for block in sample.blocks:
+                self.sketch.add(block)
+            self.blocks += len(sample.blocks)
+            ext = names[file_id].rpartition(".")[-1]
+            ext = ext.encode("ascii", "ignore").decode("ascii")
+            if len(ext) > 6:
+                ext = ext[0:6]
+            md5s = [
+                "X" if md5 is None else codecs.encode(md5, "base64").decode()[0:10]
+                for md5 in sample.md5
+            ]
+            fields = (
+                [self.compression_factor(sample.compressed[0][n]) for n in self.columns]
+                + [md5s[n] for n in self.columns]
+                + [ext, str(file_size)]
+            )
+            if self.byte_columns:
+                fields.append(str(sample.sampled))
+                fields += [
+                    str(sum(n for n in compressed if n is not None))
+                    for compressed in sample.compressed
+                ]
+            res.append("|".join(fields))
+            if action_count >= 100:
+                work_obj.add_actions(action_count)
+                action_count = 0
+
+        work_obj.write_results(DataReductionTest.FILE_NAME, res)
+        work_obj.add_actions(action_count)
 
-        with work_obj.result_file_lock:
-            with io.open(DataReductionTest.FILE_NAME, "a+", encoding="utf8") as f:
-                for line in res:
-                    f.write(line + "\n")
-            work_obj.action_count.value += action_count
+    def worker_flush(self, work_obj: Worker) -> None:
+        if self.blocks:
+            work_obj.write_results(
+                DataReductionTest.SKETCH_FILE_NAME,
+                ["%s|%s" % (self.blocks, self.sketch.dumps())],
+            )
+        self.sketch = HyperLogLog()
+        self.blocks = 0
 
     @staticmethod
     def minimum_queue_length() -> int:
@@ -118,9 +131,65 @@ class DataReductionTest:
 
     @staticmethod
     def work_start(_work_obj: Worker) -> None:
-        if os.path.exists(DataReductionTest.FILE_NAME):
-            os.remove(DataReductionTest.FILE_NAME)
+        for name in (DataReductionTest.FILE_NAME, DataReductionTest.SKETCH_FILE_NAME):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def work_done(self, work_obj: Worker) -> None:
+        self.report_dedupe(work_obj)
+        if self.byte_columns:
+            self.report_codecs(work_obj)
 
     @staticmethod
-    def work_done(_work_obj: Worker) -> None:
-        return
+    def report_dedupe(work_obj: Worker) -> None:
+        # the sketches of all the workers are the sketch of all the blocks
+        sketch = HyperLogLog()
+        blocks = 0
+        try:
+            for line in work_obj.read_results(DataReductionTest.SKETCH_FILE_NAME):
+                count, _, text = line.partition("|")
+                blocks += int(count)
+                sketch.merge(HyperLogLog.loads(text))
+        except FileNotFoundError:
+            # no file was sampled
+            pass
+        work_obj.remove_results(DataReductionTest.SKETCH_FILE_NAME)
+        distinct = min(float(blocks), sketch.count())
+        print("-" * 80)
+        print(
+            "%s sampled blocks, about %.0f distinct, %.1f%% duplicates"
+            % (blocks, distinct, 100.0 * (1 - distinct / blocks) if blocks else 0)
+        )
+        print("-" * 80)
+
+    def report_codecs(self, work_obj: Worker) -> None:
+        # how much smaller the sampled bytes get, and the files if they
+        # compress like their samples
+        files = 0
+        sampled = 0
+        file_bytes = 0
+        compressed = [0] * len(self.codecs)
+        estimated = [0.0] * len(self.codecs)
+        first = 2 * len(self.columns) + 1
+        for line in work_obj.read_results(DataReductionTest.FILE_NAME):
+            fields = line.split("|")
+            size, sample = int(fields[first]), int(fields[first + 1])
+            files += 1
+            sampled += sample
+            file_bytes += size
+            for n, value in enumerate(fields[first + 2 :]):
+                compressed[n] += int(value)
+                if sample:
+                    estimated[n] += size * int(value) / sample
+        print("-" * 80)
+        print("%s files, %s bytes sampled of %s" % (files, sampled, file_bytes))
+        for spec, total, estimate in zip(self.codecs, compressed, estimated):
+            print(
+                "%-10s samples %6.1f%%  files %6.1f%%"
+                % (
+                    spec,
+                    100.0 * total / sampled if sampled else 0,
+                    100.0 * estimate / file_bytes if file_bytes else 0,
+                )
+            )
+        print("-" * 80)
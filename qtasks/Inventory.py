@@ -0,0 +1,252 @@
+import argparse
+import datetime
+import glob
+import os
+import socket
+
+from typing import Any, Callable, cast, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from . import FileInfo, Worker
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EPOCH_DAY = datetime.date(1970, 1, 1).toordinal()
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow"}
+# Every complete shard, a result file in the --out directory, see work_done
+SHARD_LIST_NAME = "_shards.txt"
+
+
+def parse_int(value: Optional[str]) -> Optional[int]:
+    return None if value is None else int(value)
+
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    # "2018-03-31T22:04:48.877148926Z" to nanoseconds since the epoch, None if
+    # it doesn't fit a 64 bit timestamp
+    if not value:
+        return None
+    days = (
+        datetime.date(int(value[0:4]), int(value[5:7]), int(value[8:10])).toordinal()
+        - EPOCH_DAY
+    )
+    seconds = (
+        days * 86400
+        + int(value[11:13]) * 3600
+        + int(value[14:16]) * 60
+        + int(value[17:19])
+    )
+    fraction = value[20:].rstrip("Z") if value[19:20] == "." else ""
+    nanoseconds = seconds * 1000000000 + int((fraction + "000000000")[:9])
+    return nanoseconds if -(2 ** 63) < nanoseconds < 2 ** 63 else None
+
+
+# Every column: the entry field, how to read it and its Arrow type. Strings
+# typed "dictionary" have few distinct values and are dictionary encoded.
+COLUMNS: Dict[str, Tuple[Callable[[Any], Any], str]] = {
+    "path": (str, "string"),
+    "name": (str, "string"),
+    "type": (str, "dictionary"),
+    "id": (parse_int, "uint64"),
+    "dir_id": (parse_int, "uint64"),
+    "size": (parse_int, "int64"),
+    "datablocks": (parse_int, "int64"),
+    "metablocks": (parse_int, "int64"),
+    "child_count": (int, "int64"),
+    "num_links": (int, "int32"),
+    "owner": (str, "dictionary"),
+    "group": (str, "dictionary"),
+    "mode": (str, "dictionary"),
+    "creation_time": (parse_time, "timestamp"),
+    "modification_time": (parse_time, "timestamp"),
+    "change_time": (parse_time, "timestamp"),
+    "change": (str, "dictionary"),
+}
+
+
+def arrow_type(name: str) -> Any:
+    if name == "dictionary":
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    if name == "timestamp":
+        return pyarrow.timestamp("ns", tz="UTC")
+    return getattr(pyarrow, name)()
+
+
+class Inventory:
+    """
+    Every entry as a row of typed columns, in Parquet or Arrow IPC files. Each
+    worker process writes its own shard, a row group or record batch at a time,
+    and keeps one dictionary per dictionary encoded column for its whole shard
+    so the Arrow files only carry what's new in every batch.
+
+    A shard has a temporary name until it's closed, before every checkpoint,
+    and its name goes into a result file then. A resumed walk truncates that
+    back to the checkpoint like every result file, so the shards that aren't
+    in it when the walk is done are the unfinished ones and the ones written
+    again after resuming, and are removed.
+    """
+
+    FIELDS = tuple(COLUMNS)
+    # in --diff walks the change column says what happened to the entry
+    CHANGES = ("CREATE", "MODIFY", "DELETE")
+
+    def __init__(self, in_args: Sequence[str]):
+        parser = argparse.ArgumentParser(description="")
+        parser.add_argument("--out", default="inventory", help="directory")
+        parser.add_argument("--format", choices=sorted(EXTENSIONS), default="parquet")
+        parser.add_argument("--compression", default="zstd")
+        parser.add_argument("--rows-per-group", type=int, default=100000)
+        args = parser.parse_args(in_args)
+        if pyarrow is None:
+            parser.error("Inventory needs the pyarrow package")
+        self.out = args.out
+        self.format = args.format
+        self.compression = args.compression
+        self.rows_per_group = args.rows_per_group
+        self.shard_list = os.path.join(self.out, SHARD_LIST_NAME)
+        self.FILE_NAMES = (self.shard_list,)
+        self.schema = pyarrow.schema(
+            [(name, arrow_type(kind)) for name, (_parse, kind) in COLUMNS.items()]
+        )
+        self.parsers: List[Callable[[Any], Any]] = [
+            parse for parse, _kind in COLUMNS.values()
+        ]
+        # column values of the rows not written yet
+        self.pending: List[List[Any]] = [[] for _ in COLUMNS]
+        self.dictionaries: Dict[str, Dict[str, int]] = {
+            name: {} for name, (_parse, kind) in COLUMNS.items() if kind == "dictionary"
+        }
+        self.writer: Any = None
+        self.path = ""
+        # a shard is closed before every checkpoint, the next one is new
+        self.shard_number = 0
+
+    def every_batch(self, file_list: Sequence[FileInfo], work_obj: Worker) -> None:
+        entries = cast(Sequence[Mapping[str, Any]], file_list)
+        for column, field, parse in zip(self.pending, COLUMNS, self.parsers):
+            for entry in entries:
+                value = entry.get(field)
+                column.append(None if value is None else parse(value))
+        if len(self.pending[0]) >= self.rows_per_group:
+            self.flush()
+        work_obj.add_actions(len(file_list))
+
+    def column(self, name: str, values: List[Any], kind: Any) -> Any:
+        if name not in self.dictionaries:
+            return pyarrow.array(values, type=kind)
+        # the shard's dictionary only grows, so every batch's is a delta
+        dictionary = self.dictionaries[name]
+        indices = [
+            None if v is None else dictionary.setdefault(v, len(dictionary))
+            for v in values
+        ]
+        return pyarrow.DictionaryArray.from_arrays(
+            pyarrow.array(indices, type=pyarrow.int32()),
+            pyarrow.array(list(dictionary), type=pyarrow.string()),
+        )
+
+    def shard_path(self) -> str:
+        return os.path.join(
+            self.out,
+            "part-%s-%s-%03d%s"
+            % (
+                socket.gethostname(),
+                os.getpid(),
+                self.shard_number,
+                EXTENSIONS[self.format],
+            ),
+        )
+
+    def open_writer(self) -> Any:
+        # a worker of a resumed walk can have the pid of one before it
+        while os.path.exists(self.shard_path()):
+            self.shard_number += 1
+        self.path = self.shard_path()
+        self.shard_number += 1
+        if self.format == "arrow":
+            options = pyarrow.ipc.IpcWriteOptions(
+                compression=self.compression, emit_dictionary_deltas=True
+            )
+            return pyarrow.ipc.new_file(
+                self.path + ".tmp", self.schema, options=options
+            )
+        return pyarrow.parquet.ParquetWriter(
+            self.path + ".tmp", self.schema, compression=self.compression
+        )
+
+    def flush(self) -> None:
+        if not self.pending[0]:
+            return
+        batch = pyarrow.record_batch(
+            [
+                self.column(f.name, values, f.type)
+                for f, values in zip(self.schema, self.pending)
+            ],
+            schema=self.schema,
+        )
+        if self.writer is None:
+            self.writer = self.open_writer()
+        if self.format == "arrow":
+            self.writer.write_batch(batch)
+        else:
+            self.writer.write_table(pyarrow.Table.from_batches([batch]))
+        self.pending = [[] for _ in COLUMNS]
+
+    def worker_flush(self, work_obj: Worker) -> None:
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            os.replace(self.path + ".tmp", self.path)
+            work_obj.write_results(self.shard_list, [os.path.basename(self.path)])
+
+    @staticmethod
+    def minimum_queue_length() -> int:
+        return 10
+
+    def work_start(self, _work_obj: Worker) -> None:
+        os.makedirs(self.out, exist_ok=True)
+        for path in glob.glob(os.path.join(self.out, "part-*")) + [self.shard_list]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def work_done(self, work_obj: Worker) -> None:
+        try:
+            complete = {line.strip() for line in work_obj.read_results(self.shard_list)}
+        except FileNotFoundError:
+            # no entries
+            complete = set()
+        work_obj.remove_results(self.shard_list)
+        shards = []
+        for path in sorted(glob.glob(os.path.join(self.out, "part-*"))):
+            if os.path.basename(path) in complete:
+                shards.append(path)
+            else:
+                os.remove(path)
+        rows = 0
+        for path in shards:
+            if self.format == "arrow":
+                with pyarrow.memory_map(path) as source:
+                    reader = pyarrow.ipc.open_file(source)
+                    rows += sum(
+                        reader.get_batch(i).num_rows
+                        for i in range(reader.num_record_batches)
+                    )
+            else:
+                rows += pyarrow.parquet.read_metadata(path).num_rows
+        print("-" * 80)
+        print(
+            "%s rows in %s %s shards in %s, %s bytes"
+            % (
+                rows,
+                len(shards),
+                self.format,
+                self.out,
+                sum(os.path.getsize(path) for path in shards),
+            )
+        )
+        print("-" * 80)
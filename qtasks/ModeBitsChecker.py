@@ -1,5 +1,4 @@
 import argparse
-import io
 import os
 
 from typing import Sequence
@@ -9,6 +8,8 @@ from . import FileInfo, Worker
 
 class ModeBitsChecker:
     FILE_NAME = "mode-bits-log.txt"
+    # the only entry fields every_batch reads
+    FIELDS = ("mode", "path")
 
     def __init__(self, in_args: Sequence[str]):
         parser = argparse.ArgumentParser(description="")
@@ -23,11 +24,8 @@ class ModeBitsChecker:
             if file_obj["mode"][-1] == "0":
                 mb_res.append("%(mode)s - %(path)s" % file_obj)
 
-        with work_obj.result_file_lock:
-            with io.open(ModeBitsChecker.FILE_NAME, "a", encoding="utf8") as f:
-                for line in mb_res:
-                    f.write(line + "\n")
-            work_obj.action_count.value += action_count
+        work_obj.write_results(ModeBitsChecker.FILE_NAME, mb_res)
+        work_obj.add_actions(action_count)
 
     @staticmethod
     def minimum_queue_length() -> int:
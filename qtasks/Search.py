@@ -3,37 +3,66 @@ import io
 import os
 import re
 
-from typing import Sequence
+from typing import Any, cast, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from qwalk_match import PatternSet
 
 from . import FileInfo, Worker
 
+# Columns with names looked up by the identity API: the id and details fields
+NAME_COLS = {
+    "owner_name": ("owner", "owner_details"),
+    "group_name": ("group", "group_details"),
+}
+
 
 class Search:
+    # in --diff walks deleted entries can be found too, see --cols change
+    CHANGES = ("CREATE", "MODIFY", "DELETE")
+
     def __init__(self, in_args: Sequence[str]):
         parser = argparse.ArgumentParser(description="")
         parser.add_argument("--re", help="", dest="search_re")
         parser.add_argument("--str", help="", dest="search_str")
+        parser.add_argument(
+            "--patterns",
+            help="file with one string per line, or a regex after 're:', "
+            "the 'pattern' column has the line numbers of the ones that matched",
+        )
         parser.add_argument("--itemtype", help="")
         parser.add_argument("--cols", help="")
         args = parser.parse_args(in_args)
         self.itemtype = None
         self.search_str = None
         self.search_re = None
+        self.patterns: Optional[PatternSet] = None
         self.cols = ["path"]
         if args.search_re:
             self.search_re = re.compile(args.search_re, re.IGNORECASE)
         if args.search_str:
             self.search_str = args.search_str
+        if args.patterns:
+            self.patterns = PatternSet.from_file(args.patterns)
+            self.cols = ["path", "pattern"]
         if args.cols:
             self.cols = args.cols.split(",")
         if args.itemtype:
             self.itemtype = args.itemtype
+        self.name_cols = [NAME_COLS[col] for col in self.cols if col in NAME_COLS]
+        self.FIELDS = sorted(
+            {"id", "link_target", "name", "path", "type"}.union(*self.name_cols)
+            | set(self.cols) - {"pattern"} - set(NAME_COLS)
+        )
 
     def every_batch(self, file_list: Sequence[FileInfo], work_obj: Worker) -> None:
-        results = []
+        rows: List[Tuple[FileInfo, List[int]]] = []
         for file_obj in file_list:
             found = False
-            if self.search_str:
+            matched: List[int] = []
+            if self.patterns is not None:
+                matched = self.patterns.match(file_obj["path"])
+                found = len(matched) > 0
+            elif self.search_str:
                 if self.search_str in file_obj["path"]:
                     found = True
             elif self.search_re:
@@ -64,21 +93,37 @@ class Search:
                     except:
                         pass
                 if self.itemtype is None or self.itemtype in file_obj["type"].lower():
-                    line = "|".join(
-                        [
-                            # mypy insists "TypedDict key must be a string literal"
-                            str(file_obj[col]) if col in file_obj else col  # type: ignore[misc]
-                            for col in self.cols
-                        ]
-                    )
-                    results.append(line)
+                    rows.append((file_obj, matched))
+
+        names: Dict[str, str] = {}
+        if self.name_cols and rows:
+            # one lookup per owner or group this worker hasn't seen yet
+            names = work_obj.identities.resolve(
+                (entry[col], entry[details])
+                for entry in cast(List[Mapping[str, Any]], [row[0] for row in rows])
+                for col, details in self.name_cols
+            )
+        results = []
+        for file_obj, matched in rows:
+            entry = cast(Mapping[str, Any], file_obj)
+            line = "|".join(
+                [self.column(entry, col, matched, names) for col in self.cols]
+            )
+            results.append(line)
 
         if len(results) > 0:
-            with work_obj.result_file_lock:
-                with io.open(work_obj.LOG_FILE_NAME, "a", encoding="utf8") as f_txt:
-                    for d in results:
-                        f_txt.write("%s\n" % d)
-                work_obj.action_count.value += len(results)
+            work_obj.write_results(work_obj.LOG_FILE_NAME, results)
+            work_obj.add_actions(len(results))
+
+    @staticmethod
+    def column(
+        entry: Mapping[str, Any], col: str, matched: List[int], names: Dict[str, str]
+    ) -> str:
+        if col == "pattern":
+            return ",".join(map(str, matched))
+        if col in NAME_COLS:
+            return names[entry[NAME_COLS[col][0]]]
+        return str(entry[col]) if col in entry else col
 
     @staticmethod
     def minimum_queue_length() -> int:
@@ -1,14 +1,11 @@
-from multiprocessing.synchronize import Lock
-from typing import Generic, Mapping, Optional, Sequence, TYPE_CHECKING
+from typing import Any, Iterator, Mapping, Optional, Sequence, TYPE_CHECKING
 
 from typing_extensions import Protocol, TypedDict
 
 from qumulo.rest_client import RestClient
 
 if TYPE_CHECKING:
-    from multiprocessing.sharedctypes import (  # pylint: disable=no-name-in-module,ungrouped-imports
-        _Value,
-    )
+    from qwalk_identity import IdentityResolver
 
 
 class FileInfo(TypedDict):
@@ -30,8 +27,11 @@ class FileInfo(TypedDict):
     owner: str
     owner_details: Mapping[str, str]
     group: str
+    group_details: Mapping[str, str]
     mode: str
     link_target: str
+    # CREATE, MODIFY or DELETE, only in --diff walks
+    change: str
 
 
 class Worker(Protocol):  # pylint: disable=too-few-public-methods
@@ -39,14 +39,41 @@ class Worker(Protocol):  # pylint: disable=too-few-public-methods
     MAKE_CHANGES: bool
 
     rc: RestClient
-    result_file_lock: Lock
-    # https://github.com/python/typeshed/issues/4266
-    action_count: "_Value"
+    # owner and group names, see qwalk_identity
+    identities: "IdentityResolver"
     start_path: str
     snap: Optional[str]
 
+    def add_to_queue(self, d: Any) -> None:
+        ...
+
+    def add_actions(self, count: int) -> None:
+        ...
+
+    def write_results(self, name: str, lines: Sequence[str]) -> None:
+        ...
+
+    def read_results(self, name: str) -> Iterator[str]:
+        ...
+
+    def remove_results(self, name: str) -> None:
+        ...
+
+    def thread_client(self) -> RestClient:
+        ...
+
+    def queue_length(self) -> int:
+        ...
+
 
 class Task(Protocol):  # pylint: disable=super-init-not-called
+    # Optional, looked up with getattr: FIELDS, the entry fields every_batch
+    # reads, CHANGES, the --diff changes it gets, should_descend(entry), False
+    # for directories the walk shouldn't list, worker_flush(work_obj), run
+    # in every worker process before a checkpoint and after its last
+    # every_batch to write out what it holds, and FILE_NAMES, result files
+    # besides FILE_NAME.
+
     def __init__(self, in_args: Sequence[str]):  # pylint: disable=super-init-not-called
         ...
 
@@ -57,10 +84,9 @@ class Task(Protocol):  # pylint: disable=super-init-not-called
     def minimum_queue_length() -> int:
         ...
 
-    @staticmethod
-    def work_start(_work_obj: Worker) -> None:
+    # static in most tasks, Inventory needs its arguments
+    def work_start(self, _work_obj: Worker) -> None:
         ...
 
-    @staticmethod
-    def work_done(_work_obj: Worker) -> None:
+    def work_done(self, _work_obj: Worker) -> None:
         ...
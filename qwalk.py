@@ -4,12 +4,13 @@ import argparse
 import os
 import sys
 
-from qwalk_worker import QTASKS, QWalkWorker
+from qwalk_worker import ENGINES, QTASKS, QWalkWorker
 
 
 def main() -> None:
+    # No abbreviations, task arguments like Search's --re fall through to the task
     parser = argparse.ArgumentParser(
-        description="Walk Qumulo filesystem and do that thing."
+        description="Walk Qumulo filesystem and do that thing.", allow_abbrev=False
     )
     parser.add_argument("-s", help="Qumulo hostname", required=True)
     parser.add_argument(
@@ -28,6 +29,84 @@ def main() -> None:
         required=True,
     )
     parser.add_argument("--snap", help="Snapshot id")
+    parser.add_argument(
+        "--engine",
+        help="Directory listing engine. 'async' keeps many read_directory "
+        "requests in flight from the main process (see QASYNCCONCURRENCY).",
+        choices=ENGINES,
+        default="pool",
+    )
+    parser.add_argument(
+        "--autotune",
+        help="Adjust page size, batch size, queue length and worker count "
+        "while walking (see QMAXWORKERS).",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--resume",
+        help="Continue from the last checkpoint of an interrupted walk with "
+        "the same -c, -d and --snap (see QCHECKPOINTSECONDS).",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--plan",
+        help="Split the tree into subtrees of similar size using directory "
+        "aggregates and walk the biggest ones first (see QPLANPIECES).",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--serve",
+        metavar="[HOST:]PORT",
+        help="Coordinate a walk across hosts: hand out work to qwalk.py "
+        "instances started with --connect (see QAUTHKEY).",
+    )
+    parser.add_argument(
+        "--connect",
+        metavar="HOST[:PORT]",
+        help="Work for the coordinator at HOST instead of walking on our own. "
+        "Use the same -c, -d and --snap as the coordinator.",
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        metavar="[HOST:]PORT",
+        help="Serve the walk's metrics in the Prometheus text format on "
+        "http://HOST:PORT/metrics (default host: 127.0.0.1).",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="FILE",
+        help="Append the walk's metrics to FILE as a JSON line with every "
+        "status update (see QWAITSECONDS).",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile the main process and every worker with cProfile and "
+        "write merged pstats files and a report to DIR (see QPROFILETOP).",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="Don't walk directories that match GLOB: its path if GLOB has a "
+        "'/', else its name. Can be given more than once.",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        metavar="N",
+        help="Only list directories down to N levels below -d, 0 lists just -d.",
+    )
+    parser.add_argument(
+        "--diff",
+        metavar="OLDER_SNAP",
+        help="Only walk what changed between snapshot OLDER_SNAP and the newer "
+        "one in --snap, from the snapshot tree diff (see QDIFFPAGESIZE).",
+    )
 
     try:
         # Will fail with missing args, but unknown args will all fall through.
@@ -38,6 +117,21 @@ def main() -> None:
         print("-" * 80)
         sys.exit(0)
 
+    if args.serve and args.connect:
+        parser.error("--serve and --connect can't be used together")
+    if args.diff is not None:
+        if args.snap is None:
+            parser.error("--diff needs the newer snapshot in --snap")
+        for used, name in (
+            (args.plan, "--plan"),
+            (args.resume, "--resume"),
+            (args.serve or args.connect, "--serve and --connect"),
+            (args.engine == "async", "--engine async"),
+            (args.exclude or args.max_depth is not None, "--exclude or --max-depth"),
+        ):
+            if used:
+                parser.error("--diff can't be used with %s" % name)
+
     QWalkWorker.run_all(
         args.s,
         args.u,
@@ -48,6 +142,18 @@ def main() -> None:
         args.c,
         args.snap,
         other_args,
+        args.engine,
+        args.autotune,
+        args.resume,
+        args.plan,
+        args.serve,
+        args.connect,
+        args.metrics_port,
+        args.metrics_file,
+        args.profile,
+        args.diff,
+        args.exclude,
+        args.max_depth,
     )
 
 
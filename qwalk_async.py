@@ -0,0 +1,213 @@
+import asyncio
+import concurrent.futures
+import http.client
+import itertools
+import re
+import threading
+import time
+
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, TYPE_CHECKING
+
+from qumulo.lib.request import RequestError
+from qwalk_batcher import Batcher
+from qwalk_log import log_exception, log_it
+from qwalk_router import RoutedClient
+
+if TYPE_CHECKING:
+    from qwalk_worker import ListDirArgs, QWalkWorker
+
+# Keep this many directory ids in memory before pulling more from the source
+FRONTIER_REFILL = 10000
+# Retry a page this many times after connection errors before giving up on it
+CONNECTION_RETRIES = 5
+
+
+class AsyncDirLister:  # pylint: disable=too-many-instance-attributes
+    """
+    List directories from the main process with many read_directory requests in
+    flight at once. Each request runs on a thread with its own RoutedClient, which
+    sends it to the best cluster node at the time. Entries are batched and handed
+    to the pool workers as regular process_list items.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        ww: "QWalkWorker",
+        concurrency: int,
+        wait_seconds: int,
+    ):
+        self.ww = ww
+        self.wait_seconds = wait_seconds
+        self.concurrency = max(1, concurrency)
+        # Don't let the listing run too far ahead of the workers doing every_batch
+        self.max_pending_batches = max(ww.maximum_queue_length, 4 * concurrency)
+        # Directory ids beyond this go to the on-disk queue, like the pool engine
+        self.max_frontier = max(ww.maximum_queue_length, FRONTIER_REFILL * 10)
+        self.frontier: Deque[str] = deque()
+        self.running: Set["asyncio.Future[None]"] = set()
+        # subdirectories of planned directories that are scheduled on their own
+        self.skip: Dict[str, List[str]] = {}
+        self.batcher = Batcher(ww.queue_files, lambda: ww.tuner.batch_size)
+        self.local = threading.local()
+        self.last_status = time.time()
+
+    def client(self) -> RoutedClient:
+        rc = getattr(self.local, "rc", None)
+        if rc is None:
+            rc = RoutedClient(self.ww.router, self.ww.session, self.ww.metrics)
+            self.local.rc = rc
+        return rc
+
+    def read_page(self, path_id: str, snapshot: Optional[str], next_uri: str) -> Any:
+        rc = self.client()
+        page_size = self.ww.tuner.page_size
+        if next_uri == "first":
+            if snapshot is not None:
+                return rc.fs.read_directory(
+                    id_=path_id, snapshot=snapshot, page_size=page_size
+                )
+            return rc.fs.read_directory(id_=path_id, page_size=page_size)
+        return rc.request("GET", next_uri)
+
+    def path_ids(self, items: Iterator["ListDirArgs"]) -> Iterator[str]:
+        for item in items:
+            if "skip" in item:
+                self.skip[item["path_id"]] = item["skip"]
+            yield item["path_id"]
+
+    def run(self, items: Iterator["ListDirArgs"], held: bool = False) -> None:
+        # Hold a queue slot while listing so idle pool workers don't exit
+        # early, or take over the caller's hold
+        if not held:
+            self.ww.scheduler.hold()
+        try:
+            asyncio.run(self.main(self.path_ids(items)))
+        finally:
+            self.flush()
+            self.ww.scheduler.done()
+
+    async def main(self, path_ids: Iterator[str]) -> None:
+        loop = asyncio.get_event_loop()
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="qwalk-list"
+        ) as executor:
+            loop.set_default_executor(executor)
+            while True:
+                if len(self.frontier) < FRONTIER_REFILL:
+                    self.frontier.extend(itertools.islice(path_ids, FRONTIER_REFILL))
+                if not self.frontier and self.ww.disk_queue.backlog() > 0:
+                    self.ww.disk_queue.seal()
+                    claimed = self.ww.disk_queue.claim()
+                    self.frontier.extend(claimed)
+                    self.ww.scheduler.done(len(claimed))
+                # Let the listings in flight finish before taking a checkpoint,
+                # a half listed directory can't be saved
+                checkpoint = self.ww.checkpoint_due()
+                while (
+                    self.frontier
+                    and len(self.running) < self.concurrency
+                    and not checkpoint
+                ):
+                    path_id = self.frontier.popleft()
+                    self.running.add(asyncio.ensure_future(self.list_dir(path_id)))
+                if not self.running:
+                    if checkpoint and self.frontier:
+                        self.ww.checkpoint(self.checkpoint_items(), held=1)
+                        continue
+                    break
+                _done, pending = await asyncio.wait(
+                    self.running, timeout=1, return_when=asyncio.FIRST_COMPLETED
+                )
+                self.running = set(pending)
+                self.batcher.flush_if_old()
+                self.status()
+
+    def status(self) -> None:
+        if time.time() - self.last_status >= self.wait_seconds:
+            self.ww.print_status()
+            self.last_status = time.time()
+
+    def checkpoint_items(self) -> List[Any]:
+        items: List[Any] = []
+        for path_id in self.frontier:
+            item: Dict[str, Any] = {
+                "type": "list_dir",
+                "path_id": path_id,
+                "snapshot": self.ww.snap,
+            }
+            if path_id in self.skip:
+                item["skip"] = self.skip[path_id]
+            items.append(item)
+        if len(self.batcher) > 0:
+            items.append({"type": "process_list", "list": list(self.batcher.rows)})
+        return items
+
+    async def list_dir(self, path_id: str) -> None:
+        loop = asyncio.get_event_loop()
+        snapshot = self.ww.snap
+        next_uri = "first"
+        file_count = 0
+        retries = 0
+        api_errors = 0
+        pruner = self.ww.pruner
+        pruned = 0
+        skip = set(self.skip.pop(path_id, []))
+        while next_uri != "":
+            try:
+                request_start = time.time()
+                res = await loop.run_in_executor(
+                    None, self.read_page, path_id, snapshot, next_uri
+                )
+                self.ww.tuner.record_request(
+                    self.ww.scheduler.slot, time.time() - request_start
+                )
+            except RequestError as e:
+                # expired tokens are handled by the client, usually it's directory deleted.
+                if "404" in str(e):
+                    break
+                log_it("HTTP API error: %s" % re.sub(r"[\r\n]+", " ", str(e))[:100])
+                log_it("id: %s - next_uri: %s" % (path_id, next_uri))
+                api_errors += 1
+                await asyncio.sleep(min(5, 0.1 * 2 ** api_errors))
+                continue
+            except (OSError, http.client.HTTPException):
+                # With hundreds of connections open some will get reset, try again
+                retries += 1
+                if retries <= CONNECTION_RETRIES:
+                    await asyncio.sleep(0.1 * 2 ** retries)
+                    continue
+                log_exception("Connection failed - Stop reading directory")
+                break
+            except Exception:  # pylint: disable=broad-except
+                log_exception("UNHANDLED EXCEPTION! - Stop reading directory")
+                break
+            leftovers = []
+            for dd in res["files"]:
+                dd["dir_id"] = path_id
+                if dd["type"] == "FS_FILE_TYPE_DIRECTORY" and dd["id"] not in skip:
+                    if pruner.active and not pruner.descend(dd):
+                        pruned += 1
+                    elif len(self.frontier) > self.max_frontier:
+                        leftovers.append(dd["id"])
+                    else:
+                        self.frontier.append(dd["id"])
+            self.ww.spill(leftovers)
+            visible = pruner.visible(res["files"])
+            file_count += len(visible)
+            # wait for the workers to catch up before adding more batches
+            await self.backoff()
+            self.batcher.add(self.ww.project(visible))
+            next_uri = res["paging"]["next"]
+        self.ww.metrics.add("dirs")
+        self.ww.metrics.add("files", file_count)
+        if pruned:
+            self.ww.metrics.add("pruned", pruned)
+
+    async def backoff(self) -> None:
+        while self.ww.memory_queue_length() > self.max_pending_batches:
+            await asyncio.sleep(0.05)
+            self.status()
+
+    def flush(self) -> None:
+        self.batcher.flush()
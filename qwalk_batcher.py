@@ -0,0 +1,89 @@
+import os
+import time
+
+from typing import Any, Callable, List
+
+# Flush a batch early once its entries add up to about this many bytes
+BATCH_BYTES = 4 * 1024 * 1024
+# or once its oldest entry has waited this long
+BATCH_SECONDS = 1.0
+# A lister runs batches itself while more than this many per worker are waiting
+BATCH_BACKLOG = 4
+
+_QBATCHBYTES = os.getenv("QBATCHBYTES")
+if _QBATCHBYTES:
+    BATCH_BYTES = int(_QBATCHBYTES)
+_QBATCHSECONDS = os.getenv("QBATCHSECONDS")
+if _QBATCHSECONDS:
+    BATCH_SECONDS = float(_QBATCHSECONDS)
+_QBATCHBACKLOG = os.getenv("QBATCHBACKLOG")
+if _QBATCHBACKLOG:
+    BATCH_BACKLOG = int(_QBATCHBACKLOG)
+
+
+class Batcher:
+    """
+    Collects entries from directory pages as they arrive and hands them to emit
+    in batches of batch_size() entries, fewer if the batch would be bigger than
+    max_bytes or its first entry is older than max_age. Entries from several
+    small directories share a batch, a huge directory streams out one batch at
+    a time.
+
+    The size of an entry is estimated from the first entry of each page, the
+    entries of one directory tend to look alike.
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[List[Any]], Any],
+        batch_size: Callable[[], int],
+        max_bytes: int = BATCH_BYTES,
+        max_age: float = BATCH_SECONDS,
+    ):
+        self.emit = emit
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.rows: List[Any] = []
+        self.row_bytes = 1
+        self.first_time = 0.0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def limit(self) -> int:
+        return max(1, min(self.batch_size(), self.max_bytes // self.row_bytes))
+
+    def add(self, rows: List[Any]) -> None:
+        if not rows:
+            return
+        if not self.rows:
+            self.first_time = time.time()
+        self.row_bytes = max(1, len(repr(rows[0])))
+        self.rows += rows
+        limit = self.limit()
+        if len(self.rows) < limit:
+            return
+        start = 0
+        while len(self.rows) - start >= limit:
+            self.emit(self.rows[start : start + limit])
+            start += limit
+        # one del for the whole page, not one per batch
+        del self.rows[:start]
+        self.first_time = time.time()
+
+    def flush(self) -> None:
+        if self.rows:
+            rows = self.rows
+            self.rows = []
+            self.emit(rows)
+
+    def flush_if_old(self) -> None:
+        if self.rows and time.time() - self.first_time >= self.max_age:
+            self.flush()
+
+    def wait_time(self, timeout: float) -> float:
+        # How long a consumer can block before the batch has to go out
+        if not self.rows:
+            return timeout
+        return max(0.0, min(timeout, self.first_time + self.max_age - time.time()))
@@ -0,0 +1,96 @@
+import os
+import pickle
+import shutil
+import time
+
+from typing import Any, Dict, List, Optional
+
+CHECKPOINT_DIR = "qwalk-checkpoint"
+CHECKPOINT_SECONDS = 600
+# Give up on a checkpoint if the workers don't all pause within this long
+PAUSE_TIMEOUT = 60
+
+_QCHECKPOINTDIR = os.getenv("QCHECKPOINTDIR")
+if _QCHECKPOINTDIR:
+    CHECKPOINT_DIR = _QCHECKPOINTDIR
+_QCHECKPOINTSECONDS = os.getenv("QCHECKPOINTSECONDS")
+if _QCHECKPOINTSECONDS:
+    CHECKPOINT_SECONDS = int(_QCHECKPOINTSECONDS)
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class CheckpointStore:
+    """
+    Checkpoints of a walk in progress. Each checkpoint is a directory holding a
+    pickled state (counters, queued work items and the sizes of the result files)
+    plus hard links to the on-disk queue segments and pickled batches it refers
+    to, so they survive being consumed after the checkpoint was taken. The
+    "latest" file is replaced atomically once a checkpoint is complete, older
+    checkpoints are removed after that.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.seq = 0
+
+    def latest(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.directory, "latest"), "r") as f:
+                return os.path.join(self.directory, f.read().strip())
+        except FileNotFoundError:
+            return None
+
+    def save(
+        self, state: Dict[str, Any], segments: List[str], batch_files: List[str]
+    ) -> str:
+        self.seq += 1
+        name = "checkpoint-%015d-%04d" % (int(time.time() * 1000), self.seq)
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.join(path, "segments"))
+        os.makedirs(os.path.join(path, "batches"))
+        for segment in segments:
+            link_or_copy(
+                segment, os.path.join(path, "segments", os.path.basename(segment))
+            )
+        for batch_file in batch_files:
+            link_or_copy(
+                batch_file, os.path.join(path, "batches", os.path.basename(batch_file))
+            )
+        with open(os.path.join(path, "state.pkl"), "wb") as fw:
+            pickle.dump(state, fw)
+            fw.flush()
+            os.fsync(fw.fileno())
+        latest = os.path.join(self.directory, "latest")
+        with open(latest + ".tmp", "w") as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(latest + ".tmp", latest)
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and entry.name != name:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        return path
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        path = self.latest()
+        if path is None:
+            return None
+        with open(os.path.join(path, "state.pkl"), "rb") as fr:
+            state: Dict[str, Any] = pickle.load(fr)
+        state["path"] = path
+        state["segments"] = sorted(
+            entry.path for entry in os.scandir(os.path.join(path, "segments"))
+        )
+        for entry in os.scandir(os.path.join(path, "batches")):
+            if not os.path.exists(entry.name):
+                link_or_copy(entry.path, entry.name)
+        return state
+
+    def remove(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,143 @@
+import os
+import posixpath
+import re
+import threading
+import time
+
+from typing import Any, Dict, List, Optional, Sequence, TYPE_CHECKING
+
+from qumulo.lib.request import RequestError
+from qwalk_log import log_exception, log_it
+
+if TYPE_CHECKING:
+    from qwalk_worker import QWalkWorker
+
+# Changes per page of the snapshot tree diff and per work item
+DIFF_PAGE_SIZE = 1000
+# Changes a task gets unless it lists its own in a CHANGES attribute
+DEFAULT_CHANGES = ("CREATE", "MODIFY")
+
+_QDIFFPAGESIZE = os.getenv("QDIFFPAGESIZE")
+if _QDIFFPAGESIZE:
+    DIFF_PAGE_SIZE = int(_QDIFFPAGESIZE)
+
+
+class SnapshotDiff:
+    """
+    Incremental walks: instead of listing every directory, page through the
+    changes between an older and a newer snapshot with the snapshot tree diff
+    API and hand every page under the start path to the workers. A worker looks
+    up the attributes of each changed entry, in the newer snapshot or, for a
+    deleted one, the older one, and the entries go through the batcher to
+    every_batch like listed ones, with a "change" field of CREATE, MODIFY or
+    DELETE.
+
+    The diff is one cursor, so it's paged on a thread of the main process,
+    which holds one pending item on the scheduler until it's done so the walk
+    doesn't finish early.
+    """
+
+    def __init__(
+        self,
+        ww: "QWalkWorker",
+        rc: Any,
+        newer: str,
+        older: str,
+        page_size: int = DIFF_PAGE_SIZE,
+    ):
+        self.ww = ww
+        self.rc = rc
+        self.newer = int(newer)
+        self.older = int(older)
+        self.page_size = page_size
+        self.start_path = ww.start_path.rstrip("/") + "/"
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.ww.scheduler.hold()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def wanted(self, path: str) -> bool:
+        return path.startswith(self.start_path) and path != self.start_path
+
+    def run(self) -> None:
+        pages = 0
+        changes = 0
+        try:
+            next_uri = None
+            while True:
+                try:
+                    if next_uri is None:
+                        res = self.rc.snapshot.get_snapshot_tree_diff(
+                            newer_snap=self.newer,
+                            older_snap=self.older,
+                            limit=self.page_size,
+                        )
+                    else:
+                        res = self.rc.request("GET", next_uri)
+                except RequestError as e:
+                    log_it("HTTP API error: %s" % re.sub(r"[\r\n]+", " ", str(e))[:100])
+                    if e.status_code is not None and 400 <= e.status_code < 500:
+                        # wrong snapshot ids, trying again won't help
+                        break
+                    time.sleep(1)
+                    continue
+                entries = [
+                    {"op": e["op"], "path": e["path"]}
+                    for e in res["entries"]
+                    if self.wanted(e["path"])
+                ]
+                pages += 1
+                changes += len(entries)
+                if entries:
+                    # don't run ahead of the workers
+                    while self.ww.memory_queue_length() > self.ww.maximum_queue_length:
+                        time.sleep(0.1)
+                    self.ww.add_to_queue({"type": "diff_list", "entries": entries})
+                next_uri = res["paging"]["next"]
+                if not next_uri:
+                    break
+        except Exception:  # pylint: disable=broad-except
+            log_exception("UNHANDLED EXCEPTION reading the snapshot diff")
+        finally:
+            log_it(
+                "Diff    - %s changes under %s in %s pages"
+                % (changes, self.start_path, pages)
+            )
+            self.ww.scheduler.done()
+
+    @staticmethod
+    def resolve(
+        ww: "QWalkWorker", entries: Sequence[Dict[str, str]], changes: Sequence[str]
+    ) -> List[Dict[str, Any]]:
+        # The attributes of the changed entries the task wants, like a listing
+        older = str(ww.diff_older)
+        parents: Dict[str, Optional[str]] = {}
+        need_dir_id = ww.fields is None or "dir_id" in ww.fields
+        rows = []
+        for entry in entries:
+            if entry["op"] not in changes:
+                continue
+            snapshot = older if entry["op"] == "DELETE" else ww.snap
+            try:
+                dd = ww.rc.fs.get_file_attr(path=entry["path"], snapshot=snapshot)
+            except RequestError as e:
+                if e.status_code != 404:
+                    log_it("HTTP API error: %s" % re.sub(r"[\r\n]+", " ", str(e))[:100])
+                # gone in the snapshot, like a file created and deleted again
+                continue
+            dd["change"] = entry["op"]
+            if need_dir_id:
+                parent = posixpath.dirname(entry["path"].rstrip("/"))
+                parent = parent if parent.endswith("/") else parent + "/"
+                if parent not in parents:
+                    try:
+                        parents[parent] = ww.rc.fs.get_file_attr(
+                            path=parent, snapshot=snapshot
+                        )["id"]
+                    except RequestError:
+                        parents[parent] = None
+                dd["dir_id"] = parents[parent]
+            rows.append(dd)
+        return rows
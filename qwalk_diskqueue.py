@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import shutil
+import time
+
+from typing import IO, List, Optional
+
+QUEUE_DIR = "qwalk-queue"
+SEGMENT_SIZE = 10000
+# Seal a partly filled segment after this long so idle workers can refill from it
+SEGMENT_MAX_AGE = 2.0
+
+_QQUEUEDIR = os.getenv("QQUEUEDIR")
+if _QQUEUEDIR:
+    QUEUE_DIR = _QQUEUEDIR
+_QSEGMENTSIZE = os.getenv("QSEGMENTSIZE")
+if _QSEGMENTSIZE:
+    SEGMENT_SIZE = int(_QSEGMENTSIZE)
+
+
+class SegmentedQueue:  # pylint: disable=too-many-instance-attributes
+    """
+    Append-only on-disk queue of directory ids for when the in-memory queue is
+    full. Every process appends to its own open segment file, so writers never
+    share a lock. A segment is fsync'd and renamed to .ready once it holds
+    SEGMENT_SIZE ids, gets older than SEGMENT_MAX_AGE or its writer runs out of
+    work. Readers claim a ready segment by renaming it, which only one of them
+    can win.
+
+    The number of ids on disk is tracked with per-slot spilled/refilled counters
+    like the scheduler, with the same slots for the main process and the broker.
+    """
+
+    def __init__(self, directory: str, slots: int):
+        self.directory = directory
+        self.spilled = multiprocessing.RawArray("q", slots + 2)
+        self.refilled = multiprocessing.RawArray("q", slots + 2)
+        self.slot = slots
+        self.seq = 0
+        self.segment: Optional[IO[str]] = None
+        self.segment_name = ""
+        self.segment_count = 0
+        self.segment_start = 0.0
+
+    def reset(self) -> None:
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+
+    def remove(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def set_slot(self, slot: int) -> None:
+        self.slot = slot
+        self.segment = None
+
+    def backlog(self) -> int:
+        refilled = int(sum(self.refilled))
+        return int(sum(self.spilled)) - refilled
+
+    def spill(self, path_ids: List[str]) -> None:
+        if len(path_ids) == 0:
+            return
+        if self.segment is None:
+            self.segment_name = os.path.join(
+                self.directory,
+                "%015d-%04d-%08d" % (int(time.time() * 1000), self.slot, self.seq),
+            )
+            self.seq += 1
+            # pylint: disable=consider-using-with
+            self.segment = open(self.segment_name + ".open", "w")
+            self.segment_count = 0
+            self.segment_start = time.time()
+        self.segment.write("\n".join(path_ids))
+        self.segment.write("\n")
+        self.segment_count += len(path_ids)
+        self.spilled[self.slot] += len(path_ids)
+        if self.segment_count >= SEGMENT_SIZE:
+            self.seal()
+
+    def seal(self) -> None:
+        if self.segment is None:
+            return
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+        self.segment.close()
+        self.segment = None
+        os.rename(self.segment_name + ".open", self.segment_name + ".ready")
+
+    def seal_if_old(self) -> None:
+        if self.segment is not None and (
+            time.time() - self.segment_start >= SEGMENT_MAX_AGE
+        ):
+            self.seal()
+
+    def ready_segments(self) -> List[str]:
+        return sorted(
+            entry.path
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(".ready")
+        )
+
+    def restore(self, segments: List[str]) -> int:
+        # Put segments saved by a checkpoint back on the queue
+        count = 0
+        for segment in segments:
+            name = os.path.join(self.directory, os.path.basename(segment))
+            shutil.copyfile(segment, name + ".tmp")
+            with open(name + ".tmp", "r") as f:
+                count += sum(1 for line in f if line.strip())
+            os.rename(name + ".tmp", name)
+        self.spilled[self.slot] += count
+        return count
+
+    def claim(self, slot: Optional[int] = None) -> List[str]:
+        slot = self.slot if slot is None else slot
+        ready = sorted(
+            entry.name
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(".ready")
+        )
+        for name in ready:
+            claimed = os.path.join(
+                self.directory, "%s.claimed-%s" % (name[: -len(".ready")], slot)
+            )
+            try:
+                os.rename(os.path.join(self.directory, name), claimed)
+            except FileNotFoundError:
+                # somebody else got there first
+                continue
+            with open(claimed, "r") as f:
+                path_ids = [line.strip() for line in f if line.strip()]
+            os.remove(claimed)
+            self.refilled[slot] += len(path_ids)
+            return path_ids
+        return []
@@ -0,0 +1,245 @@
+import os
+import socket
+import threading
+import time
+
+from multiprocessing.managers import BaseManager
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from qwalk_log import log_it
+
+if TYPE_CHECKING:
+    from qwalk_worker import QWalkWorker
+
+DEFAULT_PORT = 7700
+# Work items handed to a remote host per request
+REMOTE_BATCH = 100
+# How often a remote host checks in with the coordinator
+REMOTE_POLL = 0.5
+# Give up on a remote host that hasn't checked in for this long
+REMOTE_TIMEOUT = 60
+
+_QREMOTEBATCH = os.getenv("QREMOTEBATCH")
+if _QREMOTEBATCH:
+    REMOTE_BATCH = int(_QREMOTEBATCH)
+_QREMOTETIMEOUT = os.getenv("QREMOTETIMEOUT")
+if _QREMOTETIMEOUT:
+    REMOTE_TIMEOUT = int(_QREMOTETIMEOUT)
+
+
+def parse_address(address: str, default_host: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return (host or default_host, int(port or DEFAULT_PORT))
+
+
+def authkey(password: str) -> bytes:
+    return (os.getenv("QAUTHKEY") or password).encode("utf8")
+
+
+class BrokerManager(BaseManager):
+    pass
+
+
+class WorkBroker:
+    """
+    Runs in the coordinator and hands work items from its shared queues to remote
+    hosts. Every call from a host reports how much work the host still has,
+    including anything that grew out of the items it was given, and that amount
+    stays counted as pending in the coordinator's scheduler under the broker
+    slot. So the coordinator's workers don't exit and the walk doesn't finish
+    while a remote host is still busy.
+
+    Remote hosts also report their counters here and can hand work back when
+    other hosts are hungry.
+
+    The coordinator doesn't know which directories a host's pending work is, so
+    the work of a host that times out can't be handed to another one. It's kept
+    in lost until the host checks in again, and if it never does the walk ends
+    as incomplete.
+    """
+
+    def __init__(self, ww: "QWalkWorker"):
+        self.ww = ww
+        self.lock = threading.Lock()
+        self.hosts: Dict[str, int] = {}
+        self.last_seen: Dict[str, float] = {}
+        self.hungry: Dict[str, bool] = {}
+        self.finished = False
+        self.told_finished: Dict[str, bool] = {}
+        self.lost: Dict[str, int] = {}
+
+    def hello(self, host: str, task: str, start_path: str, snap: Optional[str]) -> str:
+        mine = (type(self.ww.run_task).__name__, self.ww.start_path, self.ww.snap)
+        if (task, start_path, snap) != mine:
+            return "coordinator is running -c %s -d %s --snap %s" % mine
+        with self.lock:
+            self.hosts[host] = 0
+            self.last_seen[host] = time.time()
+        log_it("Remote  - %s joined" % host)
+        return ""
+
+    def steal(
+        self, host: str, pending: int, counters: Dict[str, int], max_items: int
+    ) -> Dict[str, Any]:
+        with self.lock:
+            if host not in self.hosts:
+                # timed out earlier, what it had is pending again below
+                log_it("Remote  - %s is back" % host)
+                self.hosts[host] = 0
+                self.lost.pop(host, None)
+            self.add_counters(counters)
+            items: List[Any] = []
+            if not self.finished and max_items > 0:
+                items = self.ww.portable(self.ww.scheduler.take_shared(max_items))
+                if len(items) < max_items and self.ww.disk_queue.backlog() > 0:
+                    items += [
+                        {
+                            "type": "list_dir",
+                            "path_id": path_id,
+                            "snapshot": self.ww.snap,
+                        }
+                        for path_id in self.ww.disk_queue.claim(
+                            self.ww.scheduler.broker_slot
+                        )
+                    ]
+            old = self.hosts[host]
+            self.hosts[host] = pending + len(items)
+            self.last_seen[host] = time.time()
+            self.hungry[host] = max_items > 0 and len(items) == 0
+            # hold before done so pending never drops to zero in between
+            self.ww.scheduler.hold(self.hosts[host], self.ww.scheduler.broker_slot)
+            self.ww.scheduler.done(old + len(items), self.ww.scheduler.broker_slot)
+            if self.finished:
+                self.told_finished[host] = True
+            hungry = sum(1 for h, v in self.hungry.items() if v and h != host)
+        return {"items": items, "hungry": hungry, "finished": self.finished}
+
+    def submit(self, host: str, items: List[Any]) -> None:
+        # Work handed back by a busy host. The host still counts it until its next
+        # steal() call, so this over-counts for a moment but never under-counts.
+        with self.lock:
+            self.ww.scheduler.requeue(items)
+            self.ww.scheduler.hold(len(items), self.ww.scheduler.broker_slot)
+            self.last_seen[host] = time.time()
+
+    def add_counters(self, counters: Dict[str, int]) -> None:
+        self.ww.metrics.add("dirs", counters["dir_count"])
+        self.ww.metrics.add("files", counters["file_count"])
+        self.ww.metrics.add("actions", counters["action_count"])
+
+    def remote_pending(self) -> int:
+        with self.lock:
+            return sum(self.hosts.values())
+
+    def expire(self) -> None:
+        with self.lock:
+            for host, seen in list(self.last_seen.items()):
+                if host in self.hosts and time.time() - seen > REMOTE_TIMEOUT:
+                    lost = self.hosts.pop(host)
+                    self.hungry.pop(host, None)
+                    self.ww.scheduler.done(lost, self.ww.scheduler.broker_slot)
+                    if lost > 0:
+                        self.lost[host] = lost
+                    log_it(
+                        "Remote  - %s timed out, %s work items are lost" % (host, lost)
+                    )
+
+    def lost_items(self) -> int:
+        with self.lock:
+            return sum(self.lost.values())
+
+    def finish(self, timeout: float) -> None:
+        # Tell the remote hosts the walk is over the next time they check in
+        self.finished = True
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                waiting = [h for h in self.hosts if not self.told_finished.get(h)]
+            if not waiting:
+                break
+            time.sleep(REMOTE_POLL)
+
+
+def serve(ww: "QWalkWorker", address: Tuple[str, int], key: bytes) -> Any:
+    broker = WorkBroker(ww)
+    BrokerManager.register("broker", callable=lambda: broker)
+    manager = BrokerManager(address=address, authkey=key)
+    server = manager.get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log_it("Serving - work to remote hosts on %s:%s" % address)
+    return broker, server
+
+
+class RemoteWorker:
+    """
+    Runs in a qwalk.py started with --connect. Asks the coordinator for work when
+    the local queue runs low, processes it with the local pool like any other
+    work, and reports the counters back. Local workers are kept alive with a
+    hold on the scheduler until the coordinator says the walk is finished.
+    """
+
+    def __init__(
+        self,
+        ww: "QWalkWorker",
+        address: Tuple[str, int],
+        key: bytes,
+        wait_seconds: int,
+    ):
+        self.ww = ww
+        self.address = address
+        self.key = key
+        self.wait_seconds = wait_seconds
+        self.host = "%s-%s" % (socket.gethostname(), os.getpid())
+        self.reported = {"dir_count": 0, "file_count": 0, "action_count": 0}
+
+    def counters(self) -> Dict[str, int]:
+        current = {
+            "dir_count": self.ww.metrics.value("dirs"),
+            "file_count": self.ww.metrics.value("files"),
+            "action_count": self.ww.metrics.value("actions"),
+        }
+        delta = {k: v - self.reported[k] for k, v in current.items()}
+        self.reported = current
+        return delta
+
+    def run(self) -> None:
+        BrokerManager.register("broker")
+        manager = BrokerManager(address=self.address, authkey=self.key)
+        manager.connect()
+        broker = manager.broker()  # type: ignore # pylint: disable=no-member
+        error = broker.hello(
+            self.host,
+            type(self.ww.run_task).__name__,
+            self.ww.start_path,
+            self.ww.snap,
+        )
+        if error:
+            log_it("Remote  - %s" % error)
+            return
+        log_it("Remote  - connected to %s:%s as %s" % (self.address + (self.host,)))
+        self.ww.scheduler.hold()
+        last_status = time.time()
+        try:
+            while True:
+                # our own hold doesn't count as work
+                pending = self.ww.queue_length() - 1
+                want = REMOTE_BATCH if pending < 2 * self.ww.pool_size else 0
+                reply = broker.steal(self.host, pending, self.counters(), want)
+                for item in reply["items"]:
+                    self.ww.add_to_queue(item)
+                if reply["finished"]:
+                    break
+                if reply["hungry"] > 0 and pending > 2 * REMOTE_BATCH:
+                    items = self.ww.scheduler.take_shared(REMOTE_BATCH)
+                    if items:
+                        broker.submit(self.host, self.ww.portable(items))
+                        self.ww.scheduler.done(len(items))
+                if time.time() - last_status >= self.wait_seconds:
+                    self.ww.print_status()
+                    last_status = time.time()
+                if not reply["items"]:
+                    time.sleep(REMOTE_POLL)
+        except (EOFError, OSError) as e:
+            log_it("Remote  - lost the coordinator: %s" % e)
+        finally:
+            self.ww.scheduler.done()
@@ -0,0 +1,159 @@
+import http.server
+import json
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from qwalk_log import log_it
+from qwalk_metrics import COUNTERS, HISTOGRAMS, Metrics
+
+GAUGES = {
+    "queue": "Work items waiting, in memory and on disk",
+    "disk_queue": "Directories waiting in the on-disk queue",
+    "active_workers": "Workers busy with a work item",
+    "worker_limit": "Workers allowed to take work",
+    "elapsed_seconds": "Seconds since the walk started",
+}
+# counters that the metrics file also has as a rate since the last line
+RATES = ("dirs", "files", "actions", "batches")
+
+
+def prometheus_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels.items()
+    )
+
+
+class MetricsExporter:
+    """
+    Makes the walk's metrics available outside the process: in the Prometheus
+    text format on a local HTTP endpoint, and as a JSON line appended to a file
+    with every status update. Both read the shared counters of all workers and
+    the gauges the walk reports, so neither adds work to the workers.
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        gauges: Callable[[], Dict[str, float]],
+        info: Dict[str, str],
+    ):
+        self.metrics = metrics
+        self.gauges = gauges
+        self.info = info
+        self.server: Optional[http.server.ThreadingHTTPServer] = None
+        self.last_time = time.time()
+        self.last: Dict[str, int] = {name: metrics.value(name) for name in RATES}
+        self.last_entries = 0.0
+
+    def serve(self, address: Tuple[str, int]) -> None:
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # pylint: disable=invalid-name
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = exporter.prometheus().encode("utf8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(address, Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        log_it("Metrics - serving on http://%s:%s/metrics" % address)
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def prometheus(self) -> str:
+        lines: List[str] = []
+        lines.append("# HELP qwalk_info The walk's task and settings")
+        lines.append("# TYPE qwalk_info gauge")
+        lines.append("qwalk_info%s 1" % prometheus_labels(self.info))
+        for name, description in COUNTERS.items():
+            lines.append("# HELP qwalk_%s_total %s" % (name, description))
+            lines.append("# TYPE qwalk_%s_total counter" % name)
+            lines.append("qwalk_%s_total %s" % (name, self.metrics.value(name)))
+        gauges = self.gauges()
+        for name, description in GAUGES.items():
+            lines.append("# HELP qwalk_%s %s" % (name, description))
+            lines.append("# TYPE qwalk_%s gauge" % name)
+            lines.append("qwalk_%s %s" % (name, gauges.get(name, 0)))
+        for name, (description, _buckets, _per_node) in HISTOGRAMS.items():
+            histogram = self.metrics.histograms[name]
+            lines.append("# HELP qwalk_%s %s" % (name, description))
+            lines.append("# TYPE qwalk_%s histogram" % name)
+            for label, node in enumerate(self.metrics.label_names(name)):
+                labels = {} if node is None else {"node": node}
+                counts, total = histogram.totals(label if node is not None else None)
+                seen = 0
+                for bound, count in zip(
+                    [str(b) for b in histogram.buckets] + ["+Inf"], counts
+                ):
+                    seen += count
+                    lines.append(
+                        "qwalk_%s_bucket%s %s"
+                        % (name, prometheus_labels(dict(labels, le=bound)), seen)
+                    )
+                lines.append(
+                    "qwalk_%s_sum%s %s" % (name, prometheus_labels(labels), total)
+                )
+                lines.append(
+                    "qwalk_%s_count%s %s" % (name, prometheus_labels(labels), seen)
+                )
+        return "\n".join(lines) + "\n"
+
+    def record(self) -> Dict[str, Any]:
+        now = time.time()
+        seconds = max(now - self.last_time, 0.001)
+        record: Dict[str, Any] = {"time": round(now, 3)}
+        record.update(self.info)
+        for name in COUNTERS:
+            record[name] = self.metrics.value(name)
+        record.update(self.gauges())
+        for name in RATES:
+            record[name + "_per_second"] = round(
+                (record[name] - self.last[name]) / seconds, 1
+            )
+            self.last[name] = record[name]
+        # entries the task got through, from the sum of the batch sizes
+        _counts, entries = self.metrics.histograms["batch_entries"].totals()
+        record["entries_per_second"] = round((entries - self.last_entries) / seconds, 1)
+        self.last_entries = entries
+        self.last_time = now
+        batch = self.metrics.histograms["batch_seconds"]
+        record["batch_p50_seconds"] = batch.quantile(0.5)
+        record["batch_p99_seconds"] = batch.quantile(0.99)
+        rest = self.metrics.histograms["rest_seconds"]
+        nodes = {}
+        for label, node in enumerate(self.metrics.label_names("rest_seconds")):
+            label_or_all = label if node is not None else None
+            counts, _total = rest.totals(label_or_all)
+            nodes[node or "all"] = {
+                "requests": sum(counts),
+                "p50_seconds": rest.quantile(0.5, label_or_all),
+                "p99_seconds": rest.quantile(0.99, label_or_all),
+            }
+        record["nodes"] = nodes
+        return record
+
+    def write(self, path: str) -> None:
+        try:
+            with open(path, "a", encoding="utf8") as f:
+                f.write(json.dumps(self.record()) + "\n")
+        except OSError as e:
+            log_it("Metrics - can't write %s: %s" % (path, e))
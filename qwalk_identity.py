@@ -0,0 +1,344 @@
+import collections
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, TYPE_CHECKING
+
+from qumulo.lib.request import RequestError
+from qwalk_log import log_it
+from qwalk_router import NodeRouter, RoutedClient
+
+if TYPE_CHECKING:
+    from qwalk_metrics import Metrics
+    from qwalk_session import SessionManager
+
+# Names every process keeps in memory
+IDENTITY_CACHE_SIZE = 100000
+# A file to keep the names in between walks, by default one in the temp
+# directory for this walk only
+IDENTITY_CACHE: Optional[str] = None
+# Names from the file are looked up again after this long
+IDENTITY_CACHE_DAYS = 7.0
+# Ids that couldn't be looked up aren't tried again for this long
+IDENTITY_RETRY_SECONDS = 300.0
+# Identities looked up at the same time
+IDENTITY_THREADS = 8
+# How long a process waits for an id another one is looking up, after that
+# the claim is taken to be left behind by a killed process
+IDENTITY_CLAIM_SECONDS = 60.0
+# How often a waiting process checks whether the name is there
+IDENTITY_WAIT = 0.05
+
+_QIDENTITYCACHESIZE = os.getenv("QIDENTITYCACHESIZE")
+if _QIDENTITYCACHESIZE:
+    IDENTITY_CACHE_SIZE = int(_QIDENTITYCACHESIZE)
+
+_QIDENTITYCACHE = os.getenv("QIDENTITYCACHE")
+if _QIDENTITYCACHE:
+    IDENTITY_CACHE = _QIDENTITYCACHE
+
+_QIDENTITYCACHEDAYS = os.getenv("QIDENTITYCACHEDAYS")
+if _QIDENTITYCACHEDAYS:
+    IDENTITY_CACHE_DAYS = float(_QIDENTITYCACHEDAYS)
+
+_QIDENTITYRETRYSECONDS = os.getenv("QIDENTITYRETRYSECONDS")
+if _QIDENTITYRETRYSECONDS:
+    IDENTITY_RETRY_SECONDS = float(_QIDENTITYRETRYSECONDS)
+
+_QIDENTITYTHREADS = os.getenv("QIDENTITYTHREADS")
+if _QIDENTITYTHREADS:
+    IDENTITY_THREADS = int(_QIDENTITYTHREADS)
+
+_QIDENTITYCLAIMSECONDS = os.getenv("QIDENTITYCLAIMSECONDS")
+if _QIDENTITYCLAIMSECONDS:
+    IDENTITY_CLAIM_SECONDS = float(_QIDENTITYCLAIMSECONDS)
+
+
+def fallback_name(auth_id: str, details: Optional[Mapping[str, str]]) -> str:
+    # What's shown for an identity without a name, like "NFS_UID:33"
+    if details and details.get("id_value"):
+        return "%s:%s" % (details["id_type"], details["id_value"])
+    return auth_id
+
+
+class IdentityResolver:
+    """
+    Owner and group names for the auth ids in file attributes. Every id is
+    looked up with the identity API once: each process keeps the names in an
+    LRU cache, and all of them in a sqlite file the workers share with each
+    other and the main process. That's a file in the temp directory that
+    close() removes, or QIDENTITYCACHE, which the next walks use too. Ids
+    nobody knows yet are looked up on a few threads at once, so a report with
+    thousands of owners doesn't wait for them one by one.
+
+    An id that couldn't be looked up is shown like one without a name, and is
+    kept in the file without a name so no process tries it again for
+    IDENTITY_RETRY_SECONDS.
+
+    Before a process looks ids up it claims them in the file, so when two
+    workers come across the same owners at once only one of them asks and the
+    other waits for the names.
+
+    The main process and the workers each set up their own client and sqlite
+    connection the first time they need one.
+    """
+
+    def __init__(
+        self,
+        router: NodeRouter,
+        session: "SessionManager",
+        metrics: Optional["Metrics"] = None,
+        cache_path: Optional[str] = IDENTITY_CACHE,
+        cache_size: int = IDENTITY_CACHE_SIZE,
+    ):
+        self.router = router
+        self.session = session
+        self.metrics = metrics
+        self.temporary = cache_path is None
+        self.cache_path = cache_path or os.path.join(
+            tempfile.gettempdir(), "qwalk-identities-%s.db" % os.getpid()
+        )
+        self.cache_size = cache_size
+        self.names: "collections.OrderedDict[str, str]" = collections.OrderedDict()
+        # when ids that couldn't be looked up were tried
+        self.failed: Dict[str, float] = {}
+        self.db: Optional[sqlite3.Connection] = None
+        self.pid = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.clients: List[RoutedClient] = []
+        self.rc: Optional[RoutedClient] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # nothing that belongs to this process goes to another one
+        state = self.__dict__.copy()
+        state.update(
+            names=collections.OrderedDict(),
+            failed={},
+            db=None,
+            pid=0,
+            local=None,
+            lock=None,
+            clients=[],
+            rc=None,
+        )
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        if self.db is None or self.pid != os.getpid():
+            # a forked worker doesn't use the connection of its parent
+            self.db = sqlite3.connect(self.cache_path, timeout=60)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS identities"
+                " (auth_id TEXT PRIMARY KEY, name TEXT, resolved REAL)"
+            )
+            # ids a process is looking up right now
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS claims (auth_id TEXT PRIMARY KEY, claimed REAL)"
+            )
+            self.db.commit()
+            self.pid = os.getpid()
+        return self.db
+
+    def close(self) -> None:
+        # In the main process once everything has been resolved
+        if self.db is not None and self.pid == os.getpid():
+            self.db.close()
+        self.db = None
+        self.pid = 0
+        if self.temporary:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.cache_path + suffix):
+                    os.remove(self.cache_path + suffix)
+
+    def remember(self, auth_id: str, name: str) -> None:
+        self.names[auth_id] = name
+        self.names.move_to_end(auth_id)
+        while len(self.names) > self.cache_size:
+            self.names.popitem(last=False)
+
+    def lookup(self, auth_id: str, rc: Optional[RoutedClient] = None) -> Optional[str]:
+        # The name from the identity API, "" if the id has none and None if
+        # it couldn't be looked up right now
+        if rc is None:
+            # on a thread of the pool, which gets its own client
+            rc = getattr(self.local, "rc", None)
+            if rc is None:
+                rc = RoutedClient(self.router, self.session, self.metrics)
+                self.local.rc = rc
+                with self.lock:
+                    self.clients.append(rc)
+        try:
+            identity = rc.auth.find_identity(auth_id=auth_id)
+        except RequestError as e:
+            if e.status_code == 404:
+                return ""
+            log_it("HTTP API error: %s" % re.sub(r"[\r\n]+", " ", str(e))[:100])
+            return None
+        if self.metrics is not None:
+            self.metrics.add("identities")
+        return str(identity.get("name") or "")
+
+    def cached(
+        self,
+        db: sqlite3.Connection,
+        auth_id: str,
+        details: Optional[Mapping[str, str]],
+        found: Dict[str, str],
+    ) -> bool:
+        # Whether the file has a name for the id, or a failure that's too
+        # recent to try again
+        now = time.time()
+        row = db.execute(
+            "SELECT name, resolved FROM identities WHERE auth_id = ?", (auth_id,)
+        ).fetchone()
+        if row is not None and row[0] is not None:
+            if row[1] > now - IDENTITY_CACHE_DAYS * 86400:
+                found[auth_id] = row[0]
+                self.remember(auth_id, row[0])
+                return True
+        elif row is not None and now - row[1] < IDENTITY_RETRY_SECONDS:
+            # another process couldn't look it up a moment ago
+            self.failed[auth_id] = row[1]
+            found[auth_id] = fallback_name(auth_id, details)
+            return True
+        return False
+
+    @staticmethod
+    def claim(db: sqlite3.Connection, auth_id: str) -> bool:
+        # In a write transaction: True if this process is to look the id up
+        now = time.time()
+        cursor = db.execute(
+            "INSERT OR IGNORE INTO claims VALUES (?, ?)", (auth_id, now)
+        )
+        if cursor.rowcount == 1:
+            return True
+        # a claim left behind by a process that was killed
+        cursor = db.execute(
+            "UPDATE claims SET claimed = ? WHERE auth_id = ? AND claimed < ?",
+            (now, auth_id, now - IDENTITY_CLAIM_SECONDS),
+        )
+        return cursor.rowcount == 1
+
+    @staticmethod
+    def release(db: sqlite3.Connection, auth_ids: List[str]) -> None:
+        db.executemany(
+            "DELETE FROM claims WHERE auth_id = ?", [(auth_id,) for auth_id in auth_ids]
+        )
+
+    def wait_for(
+        self, db: sqlite3.Connection, auth_id: str, details: Optional[Mapping[str, str]]
+    ) -> str:
+        # The name of an id another process claimed, once it has written it
+        deadline = time.time() + IDENTITY_CLAIM_SECONDS
+        while time.time() < deadline:
+            claimed = db.execute(
+                "SELECT 1 FROM claims WHERE auth_id = ?", (auth_id,)
+            ).fetchone()
+            if claimed is None:
+                break
+            time.sleep(IDENTITY_WAIT)
+        found: Dict[str, str] = {}
+        if self.cached(db, auth_id, details, found):
+            return found[auth_id]
+        # the other process gave up on it or was killed, claim it again
+        return self.resolve([(auth_id, details)])[auth_id]
+
+    def lookup_all(self, auth_ids: List[str]) -> List[Optional[str]]:
+        if len(auth_ids) == 1:
+            if self.rc is None:
+                self.rc = RoutedClient(self.router, self.session, self.metrics)
+            return [self.lookup(auth_ids[0], self.rc)]
+        with ThreadPoolExecutor(min(IDENTITY_THREADS, len(auth_ids))) as pool:
+            looked_up = list(pool.map(self.lookup, auth_ids))
+        # the clients belonged to the pool's threads
+        for rc in self.clients:
+            rc.close()
+        self.clients = []
+        return looked_up
+
+    def resolve(
+        self, ids: Iterable[Tuple[str, Optional[Mapping[str, str]]]]
+    ) -> Dict[str, str]:
+        # Names of many (auth_id, details) at once, by auth_id
+        wanted: Dict[str, Optional[Mapping[str, str]]] = {}
+        for auth_id, details in ids:
+            if auth_id not in wanted or not wanted[auth_id]:
+                wanted[auth_id] = details
+        found: Dict[str, str] = {}
+        missing = []
+        now = time.time()
+        for auth_id in wanted:
+            name = self.names.get(auth_id)
+            if name is not None:
+                self.names.move_to_end(auth_id)
+                found[auth_id] = name
+            elif now - self.failed.get(auth_id, 0) < IDENTITY_RETRY_SECONDS:
+                found[auth_id] = fallback_name(auth_id, wanted[auth_id])
+            else:
+                missing.append(auth_id)
+        if not missing:
+            return found
+        db = self.connect()
+        missing = [
+            auth_id
+            for auth_id in missing
+            if not self.cached(db, auth_id, wanted[auth_id], found)
+        ]
+        if not missing:
+            return found
+        # Check again and claim what's still missing while holding the write
+        # lock, another process may have claimed or written it since
+        mine = []
+        waiting = []
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for auth_id in missing:
+                if self.cached(db, auth_id, wanted[auth_id], found):
+                    continue
+                if self.claim(db, auth_id):
+                    mine.append(auth_id)
+                else:
+                    waiting.append(auth_id)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        if mine:
+            try:
+                looked_up = self.lookup_all(mine)
+            except BaseException:
+                self.release(db, mine)
+                db.commit()
+                raise
+            rows: List[Tuple[str, Optional[str], float]] = []
+            now = time.time()
+            for auth_id, name in zip(mine, looked_up):
+                label = name or fallback_name(auth_id, wanted[auth_id])
+                found[auth_id] = label
+                if name is None:
+                    self.failed[auth_id] = now
+                    rows.append((auth_id, None, now))
+                else:
+                    self.remember(auth_id, label)
+                    rows.append((auth_id, label, now))
+            db.executemany("INSERT OR REPLACE INTO identities VALUES (?, ?, ?)", rows)
+            self.release(db, mine)
+            db.commit()
+        for auth_id in waiting:
+            found[auth_id] = self.wait_for(db, auth_id, wanted[auth_id])
+        return found
+
+    def name(self, auth_id: str, details: Optional[Mapping[str, str]] = None) -> str:
+        return self.resolve([(auth_id, details)])[auth_id]
@@ -0,0 +1,28 @@
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+DEBUG = False
+if os.getenv("QDEBUG"):
+    DEBUG = True
+
+
+LOG_LOCK = multiprocessing.Lock()
+
+
+def log_it(msg: str) -> None:
+    print("%s: %s" % (time.strftime("%Y-%m-%d %H:%M:%S"), msg))
+    sys.stdout.flush()
+
+
+def log_exception(msg: str) -> None:
+    global LOG_LOCK  # pylint: disable=global-statement
+    if DEBUG:
+        with LOG_LOCK:
+            log_it(msg.replace("\n", ""))
+            log_it(str(sys.exc_info()[0]).replace("\n", ""))
+            s = traceback.format_exc()
+            for line in s.split("\n"):
+                log_it(line)
@@ -0,0 +1,162 @@
+import collections
+import re
+
+from typing import Dict, Iterable, List, Optional, Pattern, Sequence, Set, Tuple
+
+try:
+    from re import _parser as sre_parse  # type: ignore[attr-defined]
+except ImportError:  # before Python 3.11
+    import sre_parse  # pylint: disable=deprecated-module
+
+# Shortest literal worth looking for before running a regex
+MIN_LITERAL = 3
+
+
+class AhoCorasick:
+    """
+    Finds which of many literal strings occur in a text in one pass over it,
+    however many of them there are.
+    """
+
+    def __init__(self, words: Iterable[Tuple[str, int]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.out: List[List[int]] = [[]]
+        for word, key in words:
+            state = 0
+            for ch in word:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.out.append([])
+                state = nxt
+            self.out[state].append(key)
+        # breadth first, so a state's fallback is always done before the state
+        self.fail = [0] * len(self.goto)
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def __len__(self) -> int:
+        return len(self.goto) - 1
+
+    def search(self, text: str) -> Set[int]:
+        goto, fail, out = self.goto, self.fail, self.out
+        found: Set[int] = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+def required_literal(pattern: str) -> Optional[str]:
+    # The longest run of plain characters that every match of the pattern has,
+    # case folded, or None if there's no usable one
+    runs = [""]
+    for op, av in sre_parse.parse(pattern, re.IGNORECASE):
+        if op is sre_parse.LITERAL:
+            runs[-1] += chr(av)
+        else:
+            runs.append("")
+    literal = max(runs, key=len)
+    if len(literal) < MIN_LITERAL or not literal.isascii():
+        return None
+    return literal.casefold()
+
+
+class PatternSet:
+    """
+    Matches a path against many patterns at once, like Search does with one:
+    literals anywhere in the path, case sensitive, and regexes from the start
+    of the path, ignoring case. The literals are all found with one pass of an
+    Aho-Corasick automaton. A regex with a literal that it can't match without
+    only runs when a second automaton finds that literal, the other regexes are
+    merged into one alternation, so paths that match nothing cost about one
+    pass each.
+
+    Patterns are numbered by the caller, match returns the numbers of all the
+    patterns that matched.
+    """
+
+    def __init__(
+        self, literals: Sequence[Tuple[int, str]], regexes: Sequence[Tuple[int, str]]
+    ):
+        self.count = len(literals) + len(regexes)
+        self.literals = AhoCorasick((text, key) for key, text in literals)
+        self.regexes: Dict[int, Pattern[str]] = {}
+        prefiltered: List[Tuple[str, int]] = []
+        # regexes with groups could refer to them by number, and flags like (?x)
+        # would apply to the whole alternation, those run alone
+        self.alone: List[int] = []
+        self.merged: List[int] = []
+        plain = re.compile("", re.IGNORECASE).flags
+        for key, text in regexes:
+            compiled = re.compile(text, re.IGNORECASE)
+            self.regexes[key] = compiled
+            literal = required_literal(text)
+            if literal is not None:
+                prefiltered.append((literal, key))
+            elif compiled.groups or compiled.flags != plain:
+                self.alone.append(key)
+            else:
+                self.merged.append(key)
+        self.prefilter = AhoCorasick(prefiltered)
+        self.combined: Optional[Pattern[str]] = None
+        if self.merged:
+            self.combined = re.compile(
+                "|".join(
+                    "(?P<p%d>%s)" % (i, self.regexes[key].pattern)
+                    for i, key in enumerate(self.merged)
+                ),
+                re.IGNORECASE,
+            )
+
+    @classmethod
+    def from_file(cls, path: str) -> "PatternSet":
+        # One pattern per line, numbered by line. "re:" starts a regex, "str:"
+        # a literal that would otherwise look like a regex or a comment, blank
+        # lines and lines starting with # are skipped.
+        literals = []
+        regexes = []
+        with open(path, encoding="utf8") as f:
+            for number, line in enumerate(f, 1):
+                line = line.rstrip("\r\n")
+                if line.startswith("re:"):
+                    regexes.append((number, line[3:]))
+                elif line.startswith("str:"):
+                    literals.append((number, line[4:]))
+                elif line.strip() and not line.startswith("#"):
+                    literals.append((number, line))
+        return cls(literals, regexes)
+
+    def match(self, text: str) -> List[int]:
+        found = self.literals.search(text)
+        if len(self.prefilter) > 0:
+            for key in self.prefilter.search(text.casefold()):
+                if self.regexes[key].match(text):
+                    found.add(key)
+        if self.combined is not None:
+            m = self.combined.match(text)
+            if m is not None:
+                # the first one that matched, the ones after it might too
+                first = int(str(m.lastgroup)[1:])
+                found.add(self.merged[first])
+                for key in self.merged[first + 1 :]:
+                    if self.regexes[key].match(text):
+                        found.add(key)
+        for key in self.alone:
+            if self.regexes[key].match(text):
+                found.add(key)
+        return sorted(found)
@@ -0,0 +1,131 @@
+import bisect
+import os
+import threading
+
+from multiprocessing import RawArray
+from typing import List, Optional, Sequence, Tuple
+
+# Log REST and batch latency percentiles with every status update
+METRICS_LOG = False
+
+if os.getenv("QMETRICSLOG"):
+    METRICS_LOG = True
+
+# Upper bounds of the histogram buckets, anything bigger goes in a last bucket
+SECONDS_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+ENTRIES_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+COUNTERS = {
+    "dirs": "Directories listed",
+    "files": "Directory entries listed",
+    "pruned": "Directories not listed because of --exclude, --max-depth or the task",
+    "actions": "Actions taken by the task",
+    "batches": "Batches run by the task",
+    "rest_errors": "REST requests that failed",
+    "rest_retries": "REST requests retried on another node",
+    "rest_logins": "Logins after a REST request was turned away with a 401",
+    "identities": "Owners and groups looked up with the identity API",
+}
+# name: description, buckets, whether it's kept per cluster node
+HISTOGRAMS = {
+    "rest_seconds": ("REST request latency", SECONDS_BUCKETS, True),
+    "batch_seconds": ("every_batch duration", SECONDS_BUCKETS, False),
+    "batch_entries": ("Entries per batch", ENTRIES_BUCKETS, False),
+}
+
+
+class Histogram:
+    # Bucket counts and sums for every slot and label (a cluster node, or just
+    # one label)
+    def __init__(self, buckets: Sequence[float], slots: int, labels: int = 1):
+        self.buckets = tuple(buckets)
+        self.width = len(self.buckets) + 1
+        self.labels = labels
+        self.counts = RawArray("q", slots * labels * self.width)
+        self.sums = RawArray("d", slots * labels)
+
+    def observe(self, slot: int, value: float, label: int = 0) -> None:
+        row = slot * self.labels + label
+        self.counts[row * self.width + bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[row] += value
+
+    def totals(self, label: Optional[int] = None) -> Tuple[List[int], float]:
+        counts = [0] * self.width
+        for i, count in enumerate(self.counts):
+            if label is None or (i // self.width) % self.labels == label:
+                counts[i % self.width] += count
+        total = sum(
+            v
+            for i, v in enumerate(self.sums)
+            if label is None or i % self.labels == label
+        )
+        return counts, float(total)
+
+    def quantile(self, q: float, label: Optional[int] = None) -> float:
+        # upper bound of the bucket the q-th observation falls in, the last
+        # bound for the overflow bucket, which has none (and JSON has no inf)
+        counts, _total = self.totals(label)
+        rank = q * sum(counts)
+        seen = 0
+        for i, count in enumerate(counts):
+            seen += count
+            if count and seen >= rank:
+                return self.buckets[min(i, len(self.buckets) - 1)]
+        return 0.0
+
+
+class Metrics:
+    """
+    Counters and histograms of the walk in shared memory, with a slot per
+    process (the workers, the main process in the last one). A process only
+    writes to its own slot, so nothing takes a lock across processes, and
+    readers sum the slots. A thread lock covers the threads of one process.
+    Everything is registered before the pool starts.
+    """
+
+    def __init__(self, slots: int, nodes: Sequence[str] = ()):
+        self.slots = slots
+        self.slot = slots - 1
+        self.nodes = list(nodes)
+        self.lock = threading.Lock()
+        self.counters = {name: RawArray("q", slots) for name in COUNTERS}
+        self.histograms = {
+            name: Histogram(buckets, slots, max(1, len(self.nodes)) if per_node else 1)
+            for name, (_help, buckets, per_node) in HISTOGRAMS.items()
+        }
+
+    def set_slot(self, slot: int) -> None:
+        self.slot = slot
+        self.lock = threading.Lock()
+
+    def add(self, name: str, count: int = 1) -> None:
+        with self.lock:
+            self.counters[name][self.slot] += count
+
+    def observe(self, name: str, value: float, label: int = 0) -> None:
+        with self.lock:
+            self.histograms[name].observe(self.slot, value, label)
+
+    def value(self, name: str) -> int:
+        return int(sum(self.counters[name]))
+
+    def label_names(self, name: str) -> List[Optional[str]]:
+        # the node of every label of a histogram, None if it isn't per node
+        if HISTOGRAMS[name][2] and self.nodes:
+            return list(self.nodes)
+        return [None]
@@ -0,0 +1,126 @@
+import heapq
+import os
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from qumulo.rest_client import RestClient
+from qwalk_log import DEBUG, log_it
+from qwalk_prune import DirPruner
+
+# Aim for this many subtrees per worker
+PLAN_PIECES_PER_WORKER = 4
+# Stop planning after this many read_dir_aggregates calls
+PLAN_REQUESTS = 1000
+# Children returned per read_dir_aggregates call. Directories past this aren't
+# split out and get found by the listing as usual.
+PLAN_FANOUT = 1000
+
+_QPLANPIECES = os.getenv("QPLANPIECES")
+if _QPLANPIECES:
+    PLAN_PIECES_PER_WORKER = int(_QPLANPIECES)
+_QPLANREQUESTS = os.getenv("QPLANREQUESTS")
+if _QPLANREQUESTS:
+    PLAN_REQUESTS = int(_QPLANREQUESTS)
+
+
+class TreePlanner:
+    """
+    Cut the tree into subtrees of roughly equal cost before the walk starts, using
+    the directory aggregates instead of listing anything. The most expensive
+    subtree is split into its child subtrees plus the directory's own entries
+    until every subtree is under total cost / pieces or the request budget runs
+    out. The cost of a subtree is the number of files and directories in it.
+
+    Each piece is a list_dir item. A split directory's item carries the ids of
+    the children that were scheduled separately in "skip", so the listing of the
+    directory doesn't queue them a second time. Children the pruner wouldn't
+    descend into aren't scheduled, the listing of their parent prunes them.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        rc: RestClient,
+        snapshot: Optional[str],
+        pieces: int,
+        requests: int,
+        pruner: Optional[DirPruner] = None,
+    ):
+        self.rc = rc
+        self.snapshot = snapshot
+        self.pieces = max(1, pieces)
+        self.requests = requests
+        self.pruner = pruner
+        self.paths: Dict[str, str] = {}
+
+    def children(self, path_id: str) -> List[Tuple[int, str]]:
+        if self.snapshot:
+            res = self.rc.fs.read_dir_aggregates(
+                id_=path_id, snapshot=self.snapshot, max_entries=PLAN_FANOUT
+            )
+        else:
+            res = self.rc.fs.read_dir_aggregates(id_=path_id, max_entries=PLAN_FANOUT)
+        children = []
+        for f in res["files"]:
+            if f["type"] != "FS_FILE_TYPE_DIRECTORY":
+                continue
+            path = self.paths[path_id] + f["name"] + "/"
+            if self.pruner is not None and self.pruner.active:
+                entry = {
+                    "id": f["id"],
+                    "name": f["name"],
+                    "path": path,
+                    "type": f["type"],
+                }
+                if not self.pruner.descend(entry):
+                    continue
+            self.paths[f["id"]] = path
+            children.append((int(f["num_files"]) + int(f["num_directories"]), f["id"]))
+        return children
+
+    def plan(
+        self, root_id: str, total: int, root_path: str = "/"
+    ) -> List[Dict[str, Any]]:
+        start = time.time()
+        self.paths = {root_id: root_path.rstrip("/") + "/"}
+        target = total / self.pieces
+        # max-heap of (-cost, path_id) for subtrees that could still be split
+        heap: List[Tuple[int, str]] = [(-total, root_id)]
+        done: List[Tuple[int, Dict[str, Any]]] = []
+        requests = 0
+        while heap and -heap[0][0] > target and requests < self.requests:
+            neg_cost, path_id = heapq.heappop(heap)
+            requests += 1
+            try:
+                children = self.children(path_id)
+            except Exception as e:  # pylint: disable=broad-except
+                log_it("Planning- can't split %s: %s" % (path_id, e))
+                children = []
+            item: Dict[str, Any] = {
+                "type": "list_dir",
+                "path_id": path_id,
+                "snapshot": self.snapshot,
+            }
+            if children:
+                item["skip"] = [child_id for _cost, child_id in children]
+                for cost, child_id in children:
+                    heapq.heappush(heap, (-cost, child_id))
+            own = -neg_cost - sum(cost for cost, _child_id in children)
+            done.append((max(own, 0), item))
+        for neg_cost, path_id in heap:
+            done.append(
+                (
+                    -neg_cost,
+                    {"type": "list_dir", "path_id": path_id, "snapshot": self.snapshot},
+                )
+            )
+        # Biggest first, so a huge subtree doesn't start near the end of the walk
+        done.sort(key=lambda piece: -piece[0])
+        log_it(
+            "Planning- %9s pieces|%10s largest|%10s target|%5s requests|%5.1fs"
+            % (len(done), done[0][0], int(target), requests, time.time() - start)
+        )
+        if DEBUG:
+            for cost, item in done:
+                log_it("Planning- %10s inod|%s" % (cost, item["path_id"]))
+        return [item for _cost, item in done]
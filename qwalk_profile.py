@@ -0,0 +1,105 @@
+import contextlib
+import cProfile
+import glob
+import io
+import os
+import pstats
+
+from typing import Dict, Iterator, List, Optional
+
+from qwalk_log import log_it
+
+# Functions per phase in the text report
+PROFILE_TOP = 40
+
+_QPROFILETOP = os.getenv("QPROFILETOP")
+if _QPROFILETOP:
+    PROFILE_TOP = int(_QPROFILETOP)
+
+# Phases of the walk, in the order of the report
+PHASES = ("main", "list_dir", "every_batch")
+
+
+class PhaseProfiler:
+    """
+    cProfile for every process of the walk, with a separate profile per phase:
+    main for the main process, list_dir and every_batch in the workers. Only one
+    phase is profiled at a time, a batch run inline while listing a directory
+    pauses the list_dir profile. Every process writes its profiles to the
+    directory when it's done, merge() adds them up into one pstats file per
+    phase, one for everything and a text report.
+
+    Without a directory nothing is profiled.
+    """
+
+    def __init__(self, directory: Optional[str]):
+        self.directory = directory
+        self.slot = "main"
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self.current: Optional[str] = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def set_slot(self, slot: int) -> None:
+        self.slot = "%03d" % slot
+        self.profiles = {}
+        self.current = None
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        if self.directory is None or name == self.current:
+            yield
+            return
+        previous = self.current
+        if previous is not None:
+            self.profiles[previous].disable()
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        self.current = name
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.current = previous
+            if previous is not None:
+                self.profiles[previous].enable()
+
+    def dump(self) -> None:
+        if self.directory is None:
+            return
+        for name, profile in self.profiles.items():
+            profile.dump_stats(
+                os.path.join(self.directory, "%s.%s.prof" % (name, self.slot))
+            )
+        self.profiles = {}
+
+    def merge(self) -> None:
+        if self.directory is None:
+            return
+        report = io.StringIO()
+        merged: List[str] = []
+        for name in PHASES:
+            files = sorted(
+                glob.glob(os.path.join(glob.escape(self.directory), name + ".*.prof"))
+            )
+            if not files:
+                continue
+            stats = pstats.Stats(*files, stream=report)
+            merged.append(os.path.join(self.directory, name + ".prof"))
+            stats.dump_stats(merged[-1])
+            report.write("=" * 80 + "\n%s, %s processes\n" % (name, len(files)))
+            stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+            for f in files:
+                os.remove(f)
+        if not merged:
+            return
+        pstats.Stats(*merged).dump_stats(os.path.join(self.directory, "all.prof"))
+        with open(os.path.join(self.directory, "profile.txt"), "w") as fw:
+            fw.write(report.getvalue())
+        log_it(
+            "Profile - report in %s, pstats in %s"
+            % (
+                os.path.join(self.directory, "profile.txt"),
+                ", ".join(merged + [os.path.join(self.directory, "all.prof")]),
+            )
+        )
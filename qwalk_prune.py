@@ -0,0 +1,68 @@
+import fnmatch
+import re
+
+from typing import Any, Callable, Dict, List, Optional, Pattern, Sequence
+
+
+def compile_globs(globs: Sequence[str]) -> Optional[Pattern[str]]:
+    if not globs:
+        return None
+    return re.compile("|".join("(?:%s)" % fnmatch.translate(g) for g in globs))
+
+
+class DirPruner:
+    """
+    Decides which directories get listed, before they're queued, so a pruned
+    subtree costs no API calls at all. A directory is pruned when
+
+    - it matches an exclude glob: globs with a "/" match the directory's path,
+      others its name. Excluded directories aren't passed to the task either.
+    - it's more than max_depth levels below the start directory, 0 only lists
+      the start directory. These are still passed to the task.
+    - the task has a should_descend(entry) method that returns False for it.
+      The entry has at least id, name, path and type, with --plan it's all
+      the planner knows about it.
+    """
+
+    def __init__(
+        self,
+        start_path: str,
+        excludes: Sequence[str] = (),
+        max_depth: Optional[int] = None,
+        should_descend: Optional[Callable[[Any], bool]] = None,
+    ):
+        self.start_depth = self.depth(start_path)
+        self.path_globs = compile_globs([g.rstrip("/") for g in excludes if "/" in g])
+        self.name_globs = compile_globs([g for g in excludes if "/" not in g])
+        self.max_depth = max_depth
+        self.should_descend = should_descend
+        self.active = bool(excludes) or max_depth is not None or bool(should_descend)
+
+    @staticmethod
+    def depth(path: str) -> int:
+        return len([part for part in path.split("/") if part])
+
+    def excluded(self, dd: Dict[str, Any]) -> bool:
+        if dd["type"] != "FS_FILE_TYPE_DIRECTORY":
+            return False
+        if self.name_globs is not None and self.name_globs.match(dd["name"]):
+            return True
+        return self.path_globs is not None and bool(
+            self.path_globs.match(dd["path"].rstrip("/"))
+        )
+
+    def descend(self, dd: Dict[str, Any]) -> bool:
+        if self.excluded(dd):
+            return False
+        if (
+            self.max_depth is not None
+            and self.depth(dd["path"]) - self.start_depth > self.max_depth
+        ):
+            return False
+        return self.should_descend is None or bool(self.should_descend(dd))
+
+    def visible(self, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # The entries the task gets, without the excluded directories
+        if self.path_globs is None and self.name_globs is None:
+            return entries
+        return [dd for dd in entries if not self.excluded(dd)]
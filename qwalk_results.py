@@ -0,0 +1,127 @@
+import glob
+import gzip
+import io
+import os
+import shutil
+
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compress result files with gzip or zstd, None for plain text
+RESULT_COMPRESSION: Optional[str] = None
+# Write buffer of every result shard
+RESULT_BUFFER = 1024 * 1024
+
+_QRESULTCOMPRESSION = os.getenv("QRESULTCOMPRESSION")
+if _QRESULTCOMPRESSION:
+    RESULT_COMPRESSION = _QRESULTCOMPRESSION
+_QRESULTBUFFER = os.getenv("QRESULTBUFFER")
+if _QRESULTBUFFER:
+    RESULT_BUFFER = int(_QRESULTBUFFER)
+
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+class ResultWriter:
+    """
+    Result lines go to a shard file per process, kept open with a big buffer,
+    instead of every batch taking a lock to reopen and append to the one result
+    file. The shards are merged into the result file in slot order at the end
+    of the walk.
+
+    With compression every shard is a series of gzip members or zstd frames,
+    which concatenate into a valid file, so merging is a plain copy. close()
+    ends the current member, the checkpoint only ever sees shards that end on
+    one.
+    """
+
+    def __init__(self, compression: Optional[str] = RESULT_COMPRESSION):
+        if compression is not None and compression not in EXTENSIONS:
+            raise ValueError(
+                "QRESULTCOMPRESSION must be one of: %s" % ", ".join(EXTENSIONS)
+            )
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("QRESULTCOMPRESSION=zstd needs the zstandard package")
+        self.compression = compression
+        self.slot = "main"
+        self.files: Dict[str, Any] = {}
+        self.raw: Dict[str, Any] = {}
+
+    def set_slot(self, slot: int) -> None:
+        self.slot = "%03d" % slot
+        self.files = {}
+        self.raw = {}
+
+    def path(self, name: str) -> str:
+        return name + EXTENSIONS.get(self.compression or "", "")
+
+    def shards(self, name: str) -> List[str]:
+        return sorted(glob.glob(glob.escape(self.path(name)) + ".shard-*"))
+
+    def open(self, name: str) -> Any:
+        raw = open(  # pylint: disable=consider-using-with
+            "%s.shard-%s" % (self.path(name), self.slot), "ab", buffering=RESULT_BUFFER
+        )
+        self.raw[name] = raw
+        if self.compression == "gzip":
+            return gzip.GzipFile(fileobj=raw, mode="ab", compresslevel=6)
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+        return raw
+
+    def write(self, name: str, lines: Sequence[str]) -> None:
+        f = self.files.get(name)
+        if f is None:
+            f = self.files[name] = self.open(name)
+        f.write("".join(line + "\n" for line in lines).encode("utf8"))
+
+    def close(self) -> None:
+        for name, f in self.files.items():
+            if f is not self.raw[name]:
+                f.close()
+            self.raw[name].close()
+        self.files = {}
+        self.raw = {}
+
+    def merge(self, names: Sequence[str]) -> None:
+        for name in names:
+            shards = self.shards(name)
+            if not shards:
+                continue
+            with open(self.path(name), "ab") as fw:
+                for shard in shards:
+                    with open(shard, "rb") as fr:
+                        shutil.copyfileobj(fr, fw, RESULT_BUFFER)
+                    os.remove(shard)
+
+    def read(self, name: str) -> Iterator[str]:
+        path = self.path(name)
+        if self.compression == "gzip":
+            with gzip.open(path, "rt", encoding="utf8") as f:
+                yield from f
+        elif self.compression == "zstd":
+            with open(path, "rb") as fr:
+                reader = zstandard.ZstdDecompressor().stream_reader(
+                    fr, read_across_frames=True
+                )
+                yield from io.TextIOWrapper(reader, encoding="utf8")
+        else:
+            with io.open(path, "r", encoding="utf8") as f:
+                yield from f
+
+    def remove(self, name: str) -> None:
+        if os.path.exists(self.path(name)):
+            os.remove(self.path(name))
+
+    def reset(self, names: Sequence[str]) -> None:
+        # Shards left over from a walk that didn't finish. The tasks remove their
+        # plain result files themselves.
+        for name in names:
+            for shard in self.shards(name):
+                os.remove(shard)
+            if self.compression is not None:
+                self.remove(name)
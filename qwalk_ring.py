@@ -0,0 +1,119 @@
+import marshal
+import multiprocessing
+import os
+import struct
+
+from multiprocessing import RawValue
+from typing import Any, cast, List, Optional, Tuple
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python 3.7
+    shared_memory = None  # type: ignore
+
+from qwalk_log import log_it
+
+# Size of the shared memory ring for batches, 0 sends them through the queue
+RING_BYTES = 32 * 1024 * 1024
+
+_QRINGBYTES = os.getenv("QRINGBYTES")
+if _QRINGBYTES:
+    RING_BYTES = int(_QRINGBYTES)
+
+# Every record starts with the payload length and whether it's still in use
+HEADER = struct.Struct("<II")
+FREE = 0
+USED = 1
+
+
+def record_size(length: int) -> int:
+    return (HEADER.size + length + 7) & ~7
+
+
+class BatchRing:
+    """
+    Batches of entries in a ring buffer in shared memory, so only a small
+    (offset, length) reference goes through the work queue. A producer encodes
+    the batch with marshal and copies it into the ring once, the consumer
+    decodes it straight from the shared memory and frees the record.
+
+    Records are reserved at the head under a lock and the payload is copied in
+    after the lock is released. Consumers finish in any order, the tail moves
+    past freed records only, so space is reused once everything older is done.
+    A record that would run past the end of the buffer starts at the beginning
+    instead, behind a free padding record. When the ring is full put() returns
+    None and the batch goes through the queue as before.
+    """
+
+    def __init__(self, size: int):
+        self.size = size & ~7
+        self.shm = shared_memory.SharedMemory(create=True, size=self.size)
+        self.buf = cast(memoryview, self.shm.buf)
+        # total bytes ever reserved and released, the positions are these mod size
+        self.head = RawValue("q", 0)
+        self.tail = RawValue("q", 0)
+        self.lock = multiprocessing.Lock()
+
+    @staticmethod
+    def create(size: int) -> Optional["BatchRing"]:
+        if size <= 0 or shared_memory is None:
+            return None
+        try:
+            return BatchRing(size)
+        except OSError as e:
+            log_it("Can't create the shared memory ring, using the queue: %s" % e)
+            return None
+
+    def reserve(self, length: int) -> Optional[int]:
+        needed = record_size(length)
+        if needed > self.size:
+            return None
+        with self.lock:
+            head: int = self.head.value
+            pos = head % self.size
+            pad = self.size - pos if pos + needed > self.size else 0
+            if head + pad + needed - self.tail.value > self.size:
+                return None
+            if pad:
+                HEADER.pack_into(self.buf, pos, pad - HEADER.size, FREE)
+                pos = 0
+            HEADER.pack_into(self.buf, pos, length, USED)
+            self.head.value = head + pad + needed
+        return pos
+
+    def put(self, rows: List[Any]) -> Optional[Tuple[int, int]]:
+        try:
+            data = marshal.dumps(rows)
+        except ValueError:
+            # something marshal can't encode
+            return None
+        pos = self.reserve(len(data))
+        if pos is None:
+            return None
+        start = pos + HEADER.size
+        self.buf[start : start + len(data)] = data
+        return (pos, len(data))
+
+    def get(self, ref: Tuple[int, int]) -> List[Any]:
+        pos, length = ref
+        start = pos + HEADER.size
+        rows: List[Any] = marshal.loads(self.buf[start : start + length])
+        return rows
+
+    def free(self, ref: Tuple[int, int]) -> None:
+        with self.lock:
+            HEADER.pack_into(self.buf, ref[0], ref[1], FREE)
+            tail = self.tail.value
+            while tail < self.head.value:
+                length, state = HEADER.unpack_from(self.buf, tail % self.size)
+                if state != FREE:
+                    break
+                tail += record_size(length)
+            self.tail.value = tail
+
+    def used(self) -> int:
+        return int(self.head.value - self.tail.value)
+
+    def close(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,283 @@
+import http.client
+import os
+import random
+import threading
+import time
+
+from multiprocessing import RawArray
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from qumulo.lib.request import RequestError
+from qumulo.rest_client import RestClient
+from qwalk_log import log_it
+from qwalk_metrics import Metrics
+from qwalk_session import SessionManager
+
+# Weight of the newest sample in a node's latency average
+LATENCY_WEIGHT = 0.2
+# Send this share of requests to a random healthy node so every node's latency
+# stays current
+EXPLORE = 0.05
+# A failing node sits out this long, doubling with every failure in a row
+NODE_DOWN_SECONDS = 5.0
+NODE_DOWN_MAX_SECONDS = 300.0
+# How long a process reuses its view of the other processes' node stats
+STATS_SECONDS = 0.25
+# Only calls that don't change anything are retried on another node
+RETRY_PREFIXES = ("get_", "list_", "read_dir")
+
+_QNODEDOWNSECONDS = os.getenv("QNODEDOWNSECONDS")
+if _QNODEDOWNSECONDS:
+    NODE_DOWN_SECONDS = float(_QNODEDOWNSECONDS)
+
+
+class NodeRouter:  # pylint: disable=too-many-instance-attributes
+    """
+    Tracks latency, errors and requests in flight for every cluster node and picks
+    the node for each REST request: the one with the lowest latency times load,
+    skipping nodes that failed recently. Nodes without any samples are tried
+    first.
+
+    The stats are kept per slot (a worker, or the main process in the last slot)
+    and only written by the slot's own process, like the scheduler's counters.
+    A thread lock covers the threads of one process. That includes the failures
+    in a row and the time a node sits out: each process backs off on its own,
+    and pick() skips a node while any process has it out.
+    """
+
+    def __init__(self, ips: Sequence[str], slots: int):
+        self.ips = list(ips)
+        self.slot = slots
+        nodes = len(self.ips)
+        self.latency = RawArray("d", (slots + 1) * nodes)
+        self.requests = RawArray("q", (slots + 1) * nodes)
+        self.errors = RawArray("q", (slots + 1) * nodes)
+        self.in_flight = RawArray("i", (slots + 1) * nodes)
+        self.down_until = RawArray("d", (slots + 1) * nodes)
+        self.failures = RawArray("i", (slots + 1) * nodes)
+        self.lock = threading.Lock()
+        self.stats_time = 0.0
+        self.other_latency: List[float] = [0.0] * nodes
+        self.other_load: List[int] = [0] * nodes
+        self.other_down: List[float] = [0.0] * nodes
+
+    def set_slot(self, slot: int) -> None:
+        self.slot = slot
+        self.lock = threading.Lock()
+        self.stats_time = 0.0
+
+    def index(self, node: int, slot: Optional[int] = None) -> int:
+        return (self.slot if slot is None else slot) * len(self.ips) + node
+
+    def refresh_stats(self) -> None:
+        nodes = len(self.ips)
+        slots = len(self.requests) // nodes
+        for node in range(nodes):
+            latency = 0.0
+            sampled = 0
+            load = 0
+            down = 0.0
+            for slot in range(slots):
+                if slot == self.slot:
+                    continue
+                i = slot * nodes + node
+                if self.requests[i] > 0:
+                    latency += self.latency[i]
+                    sampled += 1
+                load += self.in_flight[i]
+                down = max(down, self.down_until[i])
+            self.other_latency[node] = latency / sampled if sampled else 0.0
+            self.other_load[node] = load
+            self.other_down[node] = down
+        self.stats_time = time.time()
+
+    def score(self, node: int) -> float:
+        i = self.index(node)
+        latency = self.other_latency[node]
+        if self.requests[i] > 0:
+            latency = (
+                self.latency[i] if latency == 0 else (latency + self.latency[i]) / 2
+            )
+        if latency == 0:
+            return 0.0
+        return float(latency * (1 + self.other_load[node] + self.in_flight[i]))
+
+    def pick(self, exclude: Sequence[int] = ()) -> int:
+        now = time.time()
+        if now - self.stats_time > STATS_SECONDS:
+            self.refresh_stats()
+        nodes = [n for n in range(len(self.ips)) if n not in exclude] or list(
+            range(len(self.ips))
+        )
+        healthy = [n for n in nodes if self.down_until_any(n) <= now] or nodes
+        if random.random() < EXPLORE:
+            return random.choice(healthy)
+        scores = {n: self.score(n) for n in healthy}
+        best = min(scores.values())
+        return random.choice([n for n, s in scores.items() if s == best])
+
+    def down_until_any(self, node: int) -> float:
+        # until when this process or any other one has the node out
+        return float(max(self.down_until[self.index(node)], self.other_down[node]))
+
+    def start(self, node: int) -> None:
+        with self.lock:
+            self.in_flight[self.index(node)] += 1
+
+    def finish(self, node: int, seconds: float, ok: bool) -> None:
+        with self.lock:
+            i = self.index(node)
+            self.in_flight[i] -= 1
+            self.requests[i] += 1
+            if not ok:
+                self.errors[i] += 1
+                self.failures[i] += 1
+                down = min(
+                    NODE_DOWN_SECONDS * 2 ** (self.failures[i] - 1),
+                    NODE_DOWN_MAX_SECONDS,
+                )
+                if self.down_until_any(node) <= time.time():
+                    log_it(
+                        "Node    - %s failing, out for %.0fs" % (self.ips[node], down)
+                    )
+                self.down_until[i] = time.time() + down
+                return
+            self.failures[i] = 0
+            if self.requests[i] == 1 or self.latency[i] == 0:
+                self.latency[i] = seconds
+            else:
+                self.latency[i] += LATENCY_WEIGHT * (seconds - self.latency[i])
+
+    def summary(self) -> str:
+        nodes = len(self.ips)
+        slots = len(self.requests) // nodes
+        parts = []
+        for node, ip in enumerate(self.ips):
+            indexes = [s * nodes + node for s in range(slots)]
+            requests = sum(self.requests[i] for i in indexes)
+            errors = sum(self.errors[i] for i in indexes)
+            latencies = [self.latency[i] for i in indexes if self.latency[i] > 0]
+            latency = sum(latencies) / len(latencies) if latencies else 0.0
+            parts.append(
+                "%s %d req %d err %.0fms" % (ip, requests, errors, latency * 1000)
+            )
+        return ", ".join(parts)
+
+
+class RoutedSection:  # pylint: disable=too-few-public-methods
+    def __init__(self, client: "RoutedClient", name: str):
+        self.client = client
+        self.name = name
+
+    def __getattr__(self, func: str) -> Callable[..., Any]:
+        def call(*args: Any, **kwargs: Any) -> Any:
+            return self.client.call(
+                lambda rc: getattr(getattr(rc, self.name), func)(*args, **kwargs),
+                func.startswith(RETRY_PREFIXES),
+            )
+
+        return call
+
+
+class RoutedClient:
+    """
+    Stands in for a RestClient and sends every call to the node the router picks.
+    Keeps one RestClient per node, all using the bearer token of the shared
+    session. A read-only call that fails with a connection error or a 5xx is
+    retried on the next best node, a call turned away with a 401 is retried
+    once after the session logged in again, anything else is raised as before.
+    Every attempt, retry and login again is counted in the metrics.
+    """
+
+    def __init__(
+        self,
+        router: NodeRouter,
+        session: SessionManager,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.router = router
+        self.session = session
+        self.metrics = metrics
+        self.clients: Dict[int, RestClient] = {}
+
+    @property
+    def credentials(self) -> Any:
+        return self.session.credentials()
+
+    def client(self, node: int) -> RestClient:
+        credentials = self.session.credentials()
+        rc = self.clients.get(node)
+        if rc is None:
+            rc = self.session.client(self.router.ips[node])
+            self.clients[node] = rc
+        elif rc.credentials is not credentials:
+            rc.credentials = credentials
+        return rc
+
+    def finish(self, node: int, start: float, ok: bool) -> None:
+        seconds = time.time() - start
+        self.router.finish(node, seconds, ok)
+        if self.metrics is not None:
+            self.metrics.observe("rest_seconds", seconds, node)
+        if not ok:
+            self.count("rest_errors")
+
+    def count(self, name: str) -> None:
+        if self.metrics is not None:
+            self.metrics.add(name)
+
+    def call(self, func: Callable[[RestClient], Any], retry: bool) -> Any:
+        tried: List[int] = []
+        reauthed = False
+        while True:
+            node = self.router.pick(tried)
+            tried.append(node)
+            self.router.start(node)
+            start = time.time()
+            generation = self.session.generation.value
+            try:
+                res = func(self.client(node))
+            except RequestError as e:
+                if e.status_code == 401 and not reauthed:
+                    # expired or revoked token, nothing was done with the request
+                    self.finish(node, start, True)
+                    self.session.login(generation, self.router.ips[node])
+                    self.count("rest_logins")
+                    reauthed = True
+                    tried.pop()
+                    continue
+                failed = e.status_code is not None and e.status_code >= 500
+                self.finish(node, start, not failed)
+                if failed and retry and len(tried) < len(self.router.ips):
+                    self.count("rest_retries")
+                    continue
+                raise
+            except (OSError, http.client.HTTPException):
+                self.finish(node, start, False)
+                self.clients.pop(node, None)
+                if retry and len(tried) < len(self.router.ips):
+                    self.count("rest_retries")
+                    continue
+                raise
+            except BaseException:
+                self.finish(node, start, True)
+                raise
+            self.finish(node, start, True)
+            return res
+
+    def request(self, method: str, uri: str, *args: Any, **kwargs: Any) -> Any:
+        return self.call(
+            lambda rc: rc.request(method, uri, *args, **kwargs), method == "GET"
+        )
+
+    def close(self) -> None:
+        for rc in self.clients.values():
+            rc.close()
+
+    @property
+    def conninfo(self) -> Any:
+        # for tasks that call qumulo.rest functions directly
+        return self.client(self.router.pick()).conninfo
+
+    def __getattr__(self, name: str) -> RoutedSection:
+        return RoutedSection(self, name)
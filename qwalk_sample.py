@@ -0,0 +1,194 @@
+import hashlib
+import lzma
+import math
+import os
+import threading
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, cast, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from qwalk_sketch import fingerprint
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Range reads a worker has in flight at the same time
+SAMPLE_THREADS = 8
+
+_QSAMPLETHREADS = os.getenv("QSAMPLETHREADS")
+if _QSAMPLETHREADS:
+    SAMPLE_THREADS = int(_QSAMPLETHREADS)
+
+
+def codec(spec: str) -> Callable[[Any], int]:
+    # "zlib:4", "lzma:6" or "zstd:3" to a function that returns the
+    # compressed length of a buffer
+    name, _, level_text = spec.partition(":")
+    if name == "zlib":
+        level = int(level_text or 6)
+        return lambda data: len(zlib.compress(data, level))
+    if name == "lzma":
+        preset = int(level_text or 6)
+        return lambda data: len(lzma.compress(data, preset=preset))
+    if name == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd needs the zstandard package")
+        level = int(level_text or 3)
+        local = threading.local()
+
+        def compress(data: Any) -> int:
+            # a ZstdCompressor is only good for one thread at a time
+            compressor = getattr(local, "compressor", None)
+            if compressor is None:
+                compressor = local.compressor = zstandard.ZstdCompressor(level=level)
+            return len(compressor.compress(data))
+
+        return compress
+    raise ValueError("unknown codec %s" % name)
+
+
+class SampleBuffer:
+    """
+    A file-like object that read_file writes a sample into, reused for every
+    sample a thread reads so nothing is allocated per read.
+    """
+
+    def __init__(self, size: int):
+        self.data = bytearray(size)
+        self.length = 0
+
+    def reset(self) -> None:
+        self.length = 0
+
+    def write(self, chunk: bytes) -> int:
+        end = self.length + len(chunk)
+        if end > len(self.data):
+            self.data.extend(bytes(end - len(self.data)))
+        self.data[self.length : end] = chunk
+        self.length = end
+        return len(chunk)
+
+    def view(self) -> memoryview:
+        return memoryview(self.data)[: self.length]
+
+
+class FileSample:  # pylint: disable=too-few-public-methods
+    def __init__(self, count: int, codecs: int):
+        # per offset, None where the file is too small to sample there
+        self.read: List[Optional[int]] = [None] * count
+        self.md5: List[Optional[bytes]] = [None] * count
+        # per codec, the compressed length of every sample read
+        self.compressed: List[List[Optional[int]]] = [
+            [None] * count for _ in range(codecs)
+        ]
+        # a fingerprint of every block of every sample
+        self.blocks: List[int] = []
+
+    @property
+    def sampled(self) -> int:
+        return sum(n for n in self.read if n is not None)
+
+
+class RangeSampler:
+    """
+    Reads small ranges of many files and compresses them with several codecs
+    at once. Every file's samples are read one after another on one of
+    SAMPLE_THREADS threads, so that many reads are in flight at a time, each
+    thread with its own client, from the function given to run, and a buffer
+    it reuses for all its samples.
+
+    Offsets are fractions of the file size, 0 the first sample_size bytes and
+    1 the last ones, in the order they're sampled: the first is always read,
+    the nth only from files bigger than n samples. Every sample gets its own
+    md5, and a fingerprint of each block_size bytes of it for estimating
+    deduplication.
+    """
+
+    def __init__(
+        self,
+        sample_size: int,
+        offsets: Sequence[float],
+        codecs: Sequence[str],
+        block_size: int = 4096,
+        threads: int = SAMPLE_THREADS,
+    ):
+        self.sample_size = sample_size
+        self.block_size = block_size
+        self.offsets = list(offsets)
+        self.codec_specs = list(codecs)
+        self.codecs = [codec(spec) for spec in codecs]
+        self.threads = threads
+        self.local = threading.local()
+        self.pool: Optional[ThreadPoolExecutor] = None
+        self.pid = 0
+        # a client for the calling thread
+        self.client: Optional[Callable[[], Any]] = None
+
+    def positions(self, size: int) -> List[Optional[int]]:
+        # where every sample of a file of this size starts
+        found: List[Optional[int]] = []
+        for n, fraction in enumerate(self.offsets):
+            if n > 0 and size <= self.sample_size * (n + 1):
+                found.append(None)
+            elif fraction >= 1:
+                found.append(max(0, size - self.sample_size))
+            else:
+                found.append(
+                    int(math.floor(size * fraction / self.sample_size))
+                    * self.sample_size
+                )
+        return found
+
+    def sample(self, file_info: Tuple[str, int]) -> Optional[FileSample]:
+        # None if a read failed
+        file_id, size = file_info
+        rc = cast(Callable[[], Any], self.client)()
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            buffer = self.local.buffer = SampleBuffer(self.sample_size)
+        result = FileSample(len(self.offsets), len(self.codecs))
+        for n, offset in enumerate(self.positions(size)):
+            if offset is None:
+                continue
+            buffer.reset()
+            try:
+                rc.fs.read_file(
+                    file_=buffer, id_=file_id, offset=offset, length=self.sample_size
+                )
+            except Exception:  # pylint: disable=broad-except
+                return None
+            # released however the codecs end, the buffer can't grow while
+            # a view of it is held
+            with buffer.view() as data:
+                result.read[n] = len(data)
+                result.md5[n] = hashlib.md5(data).digest()
+                for compressed, compress in zip(result.compressed, self.codecs):
+                    compressed[n] = compress(data)
+                for start in range(0, len(data), self.block_size):
+                    block = data[start : start + self.block_size]
+                    result.blocks.append(fingerprint(block))
+        return result
+
+    def run(
+        self, files: Sequence[Tuple[str, int]], client: Callable[[], Any]
+    ) -> Iterator[Tuple[Tuple[str, int], Optional[FileSample]]]:
+        # The samples of (id, size) files, in the same order
+        self.client = client
+        if self.pool is None or self.pid != os.getpid():
+            # the threads are started in the worker process that uses them
+            self.pool = ThreadPoolExecutor(self.threads)
+            self.pid = os.getpid()
+        return zip(files, self.pool.map(self.sample, files))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state.update(local=None, pool=None, pid=0, codecs=None, client=None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.local = threading.local()
+        self.codecs = [codec(spec) for spec in self.codec_specs]
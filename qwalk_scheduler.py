@@ -0,0 +1,238 @@
+import multiprocessing
+import os
+import queue
+import random
+import time
+
+from collections import deque
+from typing import Any, Deque, List, Optional
+
+# Keep up to this many items in a worker's private deque, the rest are shared.
+LOCAL_LIMIT = 16
+# How long an idle worker blocks on its own queue between steal attempts
+STEAL_WAIT = 0.05
+
+_QLOCALLIMIT = os.getenv("QLOCALLIMIT")
+if _QLOCALLIMIT:
+    LOCAL_LIMIT = int(_QLOCALLIMIT)
+
+
+class WorkScheduler:
+    """
+    Work-stealing scheduler for the walk.
+
+    Every worker keeps a private deque of work items and a shared queue that other
+    workers can steal from. New work goes onto the private deque (newest first, so
+    the walk stays depth-first) and the oldest items are moved to the shared queue
+    when the deque grows past LOCAL_LIMIT or when other workers are idle. An idle
+    worker takes from its own shared queue first and then steals from the others.
+
+    Pending work is tracked with per-slot produced/consumed counters that are only
+    ever written by the process that owns the slot, so nothing here takes a lock.
+    Slot worker_count belongs to the main process and the one after it to the
+    broker handing work to remote hosts, which runs on threads of the main
+    process and takes its own lock.
+
+    For checkpoints the main process can pause the workers. Each worker stops
+    between work items, moves its private deque to its shared queue and waits,
+    which leaves every pending item in the shared queues where the main process
+    can drain, save and requeue them.
+    """
+
+    def __init__(self, worker_count: int):
+        self.worker_count = worker_count
+        self.queues: List["multiprocessing.Queue[Any]"] = [
+            multiprocessing.Queue() for _ in range(worker_count)
+        ]
+        self.produced = multiprocessing.Array("q", worker_count + 2, lock=False)
+        self.consumed = multiprocessing.Array("q", worker_count + 2, lock=False)
+        self.idle = multiprocessing.Array("b", worker_count, lock=False)
+        self.alive = multiprocessing.Array("b", worker_count, lock=False)
+        # from taking a work item until asking for the next one
+        self.working = multiprocessing.Array("b", worker_count, lock=False)
+        self.next_slot = multiprocessing.Value("i", 0)
+        self.pause_epoch = multiprocessing.RawValue("i", 0)
+        self.pause_active = multiprocessing.RawValue("b", 0)
+        self.paused = multiprocessing.RawArray("i", worker_count)
+        self.slot = worker_count
+        self.broker_slot = worker_count + 1
+        self.local: Deque[Any] = deque()
+        self.next_queue = 0
+
+    def register(self) -> int:
+        with self.next_slot.get_lock():
+            self.slot = self.next_slot.value
+            self.next_slot.value += 1
+        assert self.slot < self.worker_count, self.slot
+        self.local = deque()
+        self.alive[self.slot] = 1
+        return self.slot
+
+    def unregister(self) -> None:
+        self.idle[self.slot] = 0
+        self.working[self.slot] = 0
+        self.alive[self.slot] = 0
+
+    def is_worker(self) -> bool:
+        return self.slot < self.worker_count
+
+    def put(self, item: Any) -> None:
+        self.produced[self.slot] += 1
+        if not self.is_worker():
+            # The main process spreads its work over all of the shared queues
+            self.queues[self.next_queue].put(item)
+            self.next_queue = (self.next_queue + 1) % self.worker_count
+            return
+        self.local.append(item)
+        if len(self.local) > LOCAL_LIMIT or (
+            len(self.local) > 1 and self.idle_count() > 0
+        ):
+            self.share()
+
+    def share(self) -> None:
+        # The oldest items are the shallowest directories, the best ones to give away
+        count = len(self.local) - LOCAL_LIMIT
+        idle = self.idle_count()
+        if idle > 0:
+            count = max(count, min(idle, len(self.local) // 2))
+        for _ in range(count):
+            self.queues[self.slot].put(self.local.popleft())
+
+    def park(self) -> None:
+        # Hand everything to the other workers while this one sits out
+        self.idle[self.slot] = 0
+        self.working[self.slot] = 0
+        while self.local:
+            self.queues[self.slot].put(self.local.popleft())
+
+    def take(self) -> Optional[Any]:
+        if self.local:
+            if len(self.local) > 1 and self.idle_count() > 0:
+                self.share()
+            return self.local.pop()
+        victims = [self.slot] + random.sample(
+            [i for i in range(self.worker_count) if i != self.slot],
+            self.worker_count - 1,
+        )
+        for victim in victims:
+            try:
+                return self.queues[victim].get_nowait()
+            except queue.Empty:
+                continue
+        return None
+
+    def get(self, timeout: float) -> Optional[Any]:
+        deadline = time.time() + timeout
+        self.working[self.slot] = 0
+        while True:
+            if self.pause_requested():
+                self.idle[self.slot] = 0
+                return None
+            item = self.take()
+            if item is None and time.time() < deadline:
+                self.idle[self.slot] = 1
+                try:
+                    item = self.queues[self.slot].get(True, STEAL_WAIT)
+                except queue.Empty:
+                    continue
+            self.idle[self.slot] = 0
+            self.working[self.slot] = int(item is not None)
+            return item
+
+    def done(self, count: int = 1, slot: Optional[int] = None) -> None:
+        self.consumed[self.slot if slot is None else slot] += count
+
+    def hold(self, count: int = 1, slot: Optional[int] = None) -> None:
+        # Count outside work (like a listing running in the main process or
+        # directories spilled to disk) as pending so that idle workers don't
+        # exit. Release it with done().
+        self.produced[self.slot if slot is None else slot] += count
+
+    def pending(self) -> int:
+        # Read consumed before produced: an item is always produced before it
+        # is consumed, so this can over-count but never reports a false zero.
+        consumed = int(sum(self.consumed))
+        return int(sum(self.produced)) - consumed
+
+    def request_pause(self) -> None:
+        self.pause_epoch.value += 1
+        self.pause_active.value = 1
+
+    def pause_requested(self) -> bool:
+        return bool(self.pause_active.value) and (
+            self.paused[self.slot] != self.pause_epoch.value
+        )
+
+    def pause(self) -> None:
+        # Called by a worker between work items, returns once resumed
+        epoch = self.pause_epoch.value
+        self.park()
+        self.paused[self.slot] = epoch
+        while self.pause_active.value and self.pause_epoch.value == epoch:
+            time.sleep(STEAL_WAIT)
+
+    def wait_paused(self, timeout: float) -> bool:
+        deadline = time.time() + timeout
+        epoch = self.pause_epoch.value
+        while time.time() < deadline:
+            running = [
+                i
+                for i in range(self.worker_count)
+                if self.alive[i] and self.paused[i] != epoch
+            ]
+            if not running:
+                return True
+            time.sleep(STEAL_WAIT)
+        return False
+
+    def resume(self) -> None:
+        self.pause_active.value = 0
+
+    def drain(self, expected: int, timeout: float) -> List[Any]:
+        # Take the items out of the shared queues without counting them as
+        # consumed. Items can still be in flight to a queue right after a put,
+        # so keep going until we have as many as the counters say are pending.
+        items: List[Any] = []
+        deadline = time.time() + timeout
+        while len(items) < expected and time.time() < deadline:
+            for q in self.queues:
+                try:
+                    while True:
+                        items.append(q.get_nowait())
+                except queue.Empty:
+                    continue
+            if len(items) < expected:
+                time.sleep(STEAL_WAIT)
+        return items
+
+    def take_shared(self, max_items: int) -> List[Any]:
+        # Take items from the shared queues without counting them as consumed,
+        # for handing them to another host
+        items: List[Any] = []
+        for q in random.sample(self.queues, self.worker_count):
+            try:
+                while len(items) < max_items:
+                    items.append(q.get_nowait())
+            except queue.Empty:
+                continue
+        return items
+
+    def requeue(self, items: List[Any]) -> None:
+        # Put drained items back, they're still counted as pending
+        for item in items:
+            self.queues[self.next_queue].put(item)
+            self.next_queue = (self.next_queue + 1) % self.worker_count
+
+    def idle_count(self) -> int:
+        return int(sum(self.idle))
+
+    def active(self) -> int:
+        return int(sum(self.alive))
+
+    def busy(self) -> int:
+        return int(sum(self.working))
+
+    def close(self) -> None:
+        for q in self.queues:
+            q.close()
+            q.join_thread()
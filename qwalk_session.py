@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+import time
+
+from multiprocessing import RawArray, RawValue
+from typing import Optional
+
+from qumulo.lib.auth import Credentials
+from qumulo.rest_client import RestClient
+from qwalk_log import log_it
+
+# Bearer tokens are good for 10 hours, get a new one well before that
+SESSION_REFRESH_SECONDS = 8 * 60 * 60
+# Room for the bearer token in shared memory
+TOKEN_BYTES = 4096
+
+_QSESSIONREFRESHSECONDS = os.getenv("QSESSIONREFRESHSECONDS")
+if _QSESSIONREFRESHSECONDS:
+    SESSION_REFRESH_SECONDS = int(_QSESSIONREFRESHSECONDS)
+
+
+class SessionManager:
+    """
+    One login shared by every process of the walk. The main process logs in and
+    keeps the bearer token in shared memory, workers use it from there instead
+    of logging in themselves. The token is replaced before it expires, and after
+    an auth error the first process to notice logs in again while the others
+    wait on the lock and then use its token. The generation goes up with every
+    login so a process can tell someone else already did it.
+    """
+
+    def __init__(self, host: str, port: int, username: str, password: str):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.token = RawArray("c", TOKEN_BYTES)
+        self.generation = RawValue("i", 0)
+        self.login_time = RawValue("d", 0.0)
+        self.lock = multiprocessing.Lock()
+        self.local_generation = 0
+        self.local_credentials: Optional[Credentials] = None
+
+    def login(self, seen: Optional[int] = None, address: Optional[str] = None) -> None:
+        with self.lock:
+            if seen is not None and self.generation.value != seen:
+                # somebody else logged in since
+                return
+            rc = RestClient(address or self.host, self.port)
+            token = rc.login(self.username, self.password).bearer_token.encode("utf8")
+            rc.close()
+            if len(token) >= TOKEN_BYTES:
+                raise ValueError("bearer token is %s bytes" % len(token))
+            if self.generation.value > 0:
+                log_it(
+                    "Session - logged in again, the token was %.0f minutes old"
+                    % ((time.time() - self.login_time.value) / 60)
+                )
+            self.token.value = token
+            self.login_time.value = time.time()
+            self.generation.value += 1
+
+    def credentials(self) -> Credentials:
+        generation = self.generation.value
+        if time.time() - self.login_time.value > SESSION_REFRESH_SECONDS:
+            self.login(generation)
+        if self.local_credentials is None or (
+            self.local_generation != self.generation.value
+        ):
+            with self.lock:
+                self.local_credentials = Credentials(self.token.value.decode("utf8"))
+                self.local_generation = self.generation.value
+        return self.local_credentials
+
+    def client(self, address: Optional[str] = None) -> RestClient:
+        return RestClient(address or self.host, self.port, self.credentials())
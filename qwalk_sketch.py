@@ -0,0 +1,69 @@
+import base64
+import hashlib
+import math
+import os
+
+from typing import Any
+
+# 2**precision registers of a byte each, the estimate is within about
+# 1.04 / sqrt(2**precision) of the real count
+HLL_PRECISION = 14
+
+_QHLLPRECISION = os.getenv("QHLLPRECISION")
+if _QHLLPRECISION:
+    HLL_PRECISION = int(_QHLLPRECISION)
+
+
+def fingerprint(data: Any) -> int:
+    # 64 bits of a block's hash
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    Estimates how many distinct values it has seen in a fixed 2**precision
+    bytes, however many values there are. Sketches of the same precision
+    merge into the sketch of all their values, so every worker keeps its own
+    and they're merged at the end.
+    """
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: int) -> None:
+        # value is a 64 bit hash: the first bits pick the register, which
+        # keeps the longest run of leading zeros of the rest
+        bits = 64 - self.precision
+        index = value >> bits
+        rank = bits - (value & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.precision != self.precision:
+            raise ValueError("can't merge sketches of different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> float:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # few values, counting empty registers is closer
+            return m * math.log(m / zeros)
+        return estimate
+
+    def dumps(self) -> str:
+        return "%d:%s" % (
+            self.precision,
+            base64.b64encode(bytes(self.registers)).decode("ascii"),
+        )
+
+    @classmethod
+    def loads(cls, text: str) -> "HyperLogLog":
+        precision, _, registers = text.partition(":")
+        sketch = cls(int(precision))
+        sketch.registers = bytearray(base64.b64decode(registers))
+        return sketch
@@ -0,0 +1,187 @@
+import multiprocessing
+import os
+import time
+
+from typing import List, Optional
+
+from qwalk_log import log_it
+
+PAGE_SIZE_LIMITS = (100, 1000)
+BATCH_SIZE_LIMITS = (10, 10000)
+MAX_QUEUE_LENGTH_CAP = 1000000
+# Aim for every_batch calls in this range so IPC overhead stays small without
+# hurting how evenly the work is spread across workers.
+BATCH_SECONDS_TARGET = (0.05, 2.0)
+# Ask for bigger pages while requests come back faster than this
+FAST_REQUEST_SECONDS = 0.05
+SLOW_REQUEST_SECONDS = 0.5
+# Client CPU utilization (0.0-1.0) bounds for growing and shrinking the pool
+CPU_LOW = 0.7
+CPU_HIGH = 0.9
+
+_QMAXLENCAP = os.getenv("QMAXLENCAP")
+if _QMAXLENCAP:
+    MAX_QUEUE_LENGTH_CAP = int(_QMAXLENCAP)
+
+
+class Autotuner:  # pylint: disable=too-many-instance-attributes
+    """
+    Holds the walk settings that can change while the walk runs (page size, batch
+    size, max queue length and the number of active workers) and, when enabled,
+    adjusts them every interval from what the workers measure: REST request
+    latency, every_batch time, client CPU and queue depth.
+
+    The settings are only written by the main process and the samples only by
+    the process owning the slot, so nobody takes a lock. The last slot belongs
+    to the main process. Every decision is logged.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        enabled: bool,
+        pool_size: int,
+        worker_limit: int,
+        page_size: int,
+        batch_size: int,
+        max_queue_length: int,
+        interval: float,
+    ):
+        self.enabled = enabled
+        self.pool_size = pool_size
+        self.interval = interval
+        self._page_size = multiprocessing.RawValue("i", page_size)
+        self._batch_size = multiprocessing.RawValue("i", batch_size)
+        self._max_queue_length = multiprocessing.RawValue("i", max_queue_length)
+        self._worker_limit = multiprocessing.RawValue("i", worker_limit)
+        slots = pool_size + 1
+        self.request_seconds = multiprocessing.RawArray("d", slots)
+        self.request_count = multiprocessing.RawArray("q", slots)
+        self.batch_seconds = multiprocessing.RawArray("d", slots)
+        self.batch_count = multiprocessing.RawArray("q", slots)
+        self.cpu_seconds = multiprocessing.RawArray("d", slots)
+        self.last_time = time.time()
+        self.last_samples: List[float] = [0.0] * 5
+        self.last_entries = 0
+        self.last_throughput: Optional[float] = None
+        self.last_worker_change = 0
+
+    @property
+    def page_size(self) -> int:
+        return int(self._page_size.value)
+
+    @property
+    def batch_size(self) -> int:
+        return int(self._batch_size.value)
+
+    @property
+    def max_queue_length(self) -> int:
+        return int(self._max_queue_length.value)
+
+    @property
+    def worker_limit(self) -> int:
+        return int(self._worker_limit.value)
+
+    def record_request(self, slot: int, seconds: float) -> None:
+        self.request_seconds[slot] += seconds
+        self.request_count[slot] += 1
+
+    def record_batch(self, slot: int, seconds: float) -> None:
+        self.batch_seconds[slot] += seconds
+        self.batch_count[slot] += 1
+
+    def record_cpu(self, slot: int) -> None:
+        self.cpu_seconds[slot] = time.process_time()
+
+    def samples(self) -> List[float]:
+        return [
+            sum(self.request_seconds),
+            sum(self.request_count),
+            sum(self.batch_seconds),
+            sum(self.batch_count),
+            sum(self.cpu_seconds) + time.process_time(),
+        ]
+
+    def change(self, name: str, old: int, new: int, reason: str) -> int:
+        if new != old:
+            log_it("Autotune- %s %s -> %s (%s)" % (name, old, new, reason))
+        return new
+
+    def tune(self, entries: int, pending: int, idle: int) -> None:
+        now = time.time()
+        elapsed = now - self.last_time
+        if not self.enabled or elapsed < self.interval:
+            return
+        samples = self.samples()
+        delta = [new - old for new, old in zip(samples, self.last_samples)]
+        throughput = (entries - self.last_entries) / elapsed
+        cpu = delta[4] / (elapsed * (os.cpu_count() or 1))
+        self.last_time = now
+        self.last_samples = samples
+        self.last_entries = entries
+
+        if delta[1] > 0:
+            self.tune_page_size(delta[0] / delta[1])
+        if delta[3] > 0:
+            self.tune_batch_size(delta[2] / delta[3])
+        self.tune_max_queue_length(pending, idle)
+        self.tune_workers(throughput, cpu, pending, idle)
+        self.last_throughput = throughput
+
+    def tune_page_size(self, latency: float) -> None:
+        old = self.page_size
+        new = old
+        if latency < FAST_REQUEST_SECONDS:
+            new = min(old * 2, PAGE_SIZE_LIMITS[1])
+        elif latency > SLOW_REQUEST_SECONDS:
+            new = max(old // 2, PAGE_SIZE_LIMITS[0])
+        reason = "request latency %.3fs" % latency
+        self._page_size.value = self.change("page size", old, new, reason)
+
+    def tune_batch_size(self, batch_seconds: float) -> None:
+        old = self.batch_size
+        new = old
+        if batch_seconds < BATCH_SECONDS_TARGET[0]:
+            new = min(old * 2, BATCH_SIZE_LIMITS[1])
+        elif batch_seconds > BATCH_SECONDS_TARGET[1]:
+            new = max(old // 2, BATCH_SIZE_LIMITS[0])
+        reason = "every_batch %.3fs" % batch_seconds
+        self._batch_size.value = self.change("batch size", old, new, reason)
+
+    def tune_max_queue_length(self, pending: int, idle: int) -> None:
+        # Directories past the max queue length wait on disk. Don't let that
+        # happen while workers are sitting idle.
+        old = self.max_queue_length
+        new = old
+        if pending >= old and idle > 0:
+            new = min(old * 2, MAX_QUEUE_LENGTH_CAP)
+        reason = "%s queued, %s idle workers" % (pending, idle)
+        self._max_queue_length.value = self.change("max queue", old, new, reason)
+
+    def tune_workers(
+        self, throughput: float, cpu: float, pending: int, idle: int
+    ) -> None:
+        old = self.worker_limit
+        new = old
+        step = max(1, old // 4)
+        if (
+            self.last_worker_change > 0
+            and self.last_throughput is not None
+            and throughput < self.last_throughput * 0.95
+        ):
+            # The last increase made things worse, back it out
+            new = old - self.last_worker_change
+            reason = "throughput dropped %.0f -> %.0f/s" % (
+                self.last_throughput,
+                throughput,
+            )
+        elif cpu > CPU_HIGH:
+            new = old - step
+            reason = "client cpu %.0f%%" % (cpu * 100)
+        elif cpu < CPU_LOW and idle == 0 and pending > old:
+            new = old + step
+            reason = "client cpu %.0f%%, %s queued" % (cpu * 100, pending)
+        else:
+            reason = ""
+        new = max(1, min(new, self.pool_size))
+        self.last_worker_change = new - old
+        self._worker_limit.value = self.change("workers", old, new, reason)
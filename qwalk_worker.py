@@ -1,29 +1,74 @@
 import multiprocessing
 import os
 import pickle
-import queue
 import random
 import re
 import sys
+import threading
 import time
-import traceback
 
-from typing import Callable, cast, List, Mapping, Optional, Sequence, Type, Union
+from typing import (
+    Any,
+    Callable,
+    cast,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
 from typing_extensions import Literal, TypedDict
 
-from qtasks import Task
+from qtasks import FileInfo, Task
+from qtasks.Aggregate import Aggregate
 from qtasks.ApplyAcls import ApplyAcls
 
 # Import all defined classes
 from qtasks.ChangeExtension import ChangeExtension
 from qtasks.CopyDirectory import CopyDirectory
 from qtasks.DataReductionTest import DataReductionTest
+from qtasks.Inventory import Inventory
 from qtasks.ModeBitsChecker import ModeBitsChecker
 from qtasks.Search import Search
 from qtasks.SummarizeOwners import SummarizeOwners
 from qumulo.lib.request import RequestError
 from qumulo.rest_client import RestClient
+from qwalk_async import AsyncDirLister
+from qwalk_batcher import BATCH_BACKLOG, Batcher
+from qwalk_checkpoint import (
+    CHECKPOINT_DIR,
+    CHECKPOINT_SECONDS,
+    CheckpointStore,
+    PAUSE_TIMEOUT,
+)
+from qwalk_diff import DEFAULT_CHANGES, SnapshotDiff
+from qwalk_diskqueue import QUEUE_DIR, SegmentedQueue
+from qwalk_distributed import (
+    authkey,
+    parse_address,
+    REMOTE_TIMEOUT,
+    RemoteWorker,
+    serve,
+    WorkBroker,
+)
+from qwalk_exporter import MetricsExporter
+from qwalk_identity import IdentityResolver
+from qwalk_log import log_exception, log_it
+from qwalk_metrics import Metrics, METRICS_LOG
+from qwalk_planner import PLAN_PIECES_PER_WORKER, PLAN_REQUESTS, TreePlanner
+from qwalk_profile import PhaseProfiler
+from qwalk_prune import DirPruner
+from qwalk_results import ResultWriter
+from qwalk_ring import BatchRing, RING_BYTES
+from qwalk_router import NodeRouter, RoutedClient
+from qwalk_scheduler import WorkScheduler
+from qwalk_session import SessionManager
+from qwalk_tuner import Autotuner
 
 QTASKS: Mapping[str, Type[Task]] = {
     "ChangeExtension": ChangeExtension,
@@ -33,6 +78,8 @@ QTASKS: Mapping[str, Type[Task]] = {
     "SummarizeOwners": SummarizeOwners,
     "ApplyAcls": ApplyAcls,
     "CopyDirectory": CopyDirectory,
+    "Inventory": Inventory,
+    "Aggregate": Aggregate,
 }
 
 
@@ -43,7 +90,9 @@ BATCH_SIZE = 100
 MAX_WORKER_COUNT = 10
 WAIT_SECONDS = 10
 OVERRIDE_IPS = None
-DEBUG = False
+ASYNC_CONCURRENCY = 256
+AUTOTUNE_MAX_WORKERS = 4 * (os.cpu_count() or 1)
+ENGINES = ("pool", "async")
 
 _QBATCHSIZE = os.getenv("QBATCHSIZE")
 if _QBATCHSIZE:
@@ -62,27 +111,12 @@ if _QMAXLEN:
 _QOVERRIDEIPS = os.getenv("QOVERRIDEIPS")
 if _QOVERRIDEIPS:
     OVERRIDE_IPS = _QOVERRIDEIPS
-if os.getenv("QDEBUG"):
-    DEBUG = True
-
-
-LOG_LOCK = multiprocessing.Lock()
-
-
-def log_it(msg: str) -> None:
-    print("%s: %s" % (time.strftime("%Y-%m-%d %H:%M:%S"), msg))
-    sys.stdout.flush()
-
-
-def log_exception(msg: str) -> None:
-    global LOG_LOCK  # pylint: disable=global-statement
-    if DEBUG:
-        with LOG_LOCK:
-            log_it(msg.replace("\n", ""))
-            log_it(str(sys.exc_info()[0]).replace("\n", ""))
-            s = traceback.format_exc()
-            for line in s.split("\n"):
-                log_it(line)
+_QASYNCCONCURRENCY = os.getenv("QASYNCCONCURRENCY")
+if _QASYNCCONCURRENCY:
+    ASYNC_CONCURRENCY = int(_QASYNCCONCURRENCY)
+_QMAXWORKERS = os.getenv("QMAXWORKERS")
+if _QMAXWORKERS:
+    AUTOTUNE_MAX_WORKERS = int(_QMAXWORKERS)
 
 
 class Creds(TypedDict):
@@ -103,17 +137,33 @@ class Counters(TypedDict):
     file_count: int
 
 
-class ProcessListArgs(TypedDict):
+class _ProcessListArgs(TypedDict):
     type: Literal["process_list"]
     list: Union[str, List[str]]
 
 
-class ListDirArgs(TypedDict):
+class ProcessListArgs(_ProcessListArgs, total=False):
+    # (offset, length) of the batch in the shared memory ring
+    ring: Tuple[int, int]
+
+
+class _ListDirArgs(TypedDict):
     type: Literal["list_dir"]
     path_id: str
     snapshot: Optional[str]
 
 
+class ListDirArgs(_ListDirArgs, total=False):
+    # subdirectories that the planner scheduled on their own
+    skip: List[str]
+
+
+class DiffListArgs(TypedDict):
+    type: Literal["diff_list"]
+    # {"op": ..., "path": ...} for every change, see qwalk_diff.py
+    entries: List[Dict[str, str]]
+
+
 class QWalkWorker:  # pylint: disable=too-many-instance-attributes
     # The class has gotten a bit too circular/interdependant with qtasks.py
     def get_counters(self) -> Counters:
@@ -121,11 +171,11 @@ class QWalkWorker:  # pylint: disable=too-many-instance-attributes
             "o_start_time": self.o_start_time,
             "dir_counter": self.dir_counter,
             "file_counter": self.file_counter,
-            "queue_len": self.queue_len.value,
-            "action_count": self.action_count.value,
-            "active_workers": self.active_workers.value,
-            "dir_count": self.dir_count.value,
-            "file_count": self.file_count.value,
+            "queue_len": self.queue_length(),
+            "action_count": self.metrics.value("actions"),
+            "active_workers": self.scheduler.active(),
+            "dir_count": self.metrics.value("dirs"),
+            "file_count": self.metrics.value("files"),
         }
 
     def __init__(  # pylint: disable=too-many-arguments
@@ -137,68 +187,168 @@ class QWalkWorker:  # pylint: disable=too-many-instance-attributes
         make_changes: bool,
         log_file: str,
         counters: Optional[Counters] = None,
+        engine: str = "pool",
+        autotune: bool = False,
+        resume_state: Optional[Dict[str, Any]] = None,
+        plan: bool = False,
+        serve_address: Optional[str] = None,
+        connect_address: Optional[str] = None,
+        metrics_address: Optional[str] = None,
+        metrics_file: Optional[str] = None,
+        profile_dir: Optional[str] = None,
+        diff_older: Optional[str] = None,
+        excludes: Sequence[str] = (),
+        max_depth: Optional[int] = None,
     ):
         self.snap = snap
+        self.diff_older = diff_older
+        self.engine = engine
+        self.plan = plan
+        self.serve_address = serve_address
+        self.connect_address = connect_address
+        self.broker: Optional[WorkBroker] = None
+        self.metrics_address = metrics_address
+        self.metrics_file = metrics_file
+        self.profiler = PhaseProfiler(profile_dir)
         self.o_start_time = time.time()
         self.dir_counter = 0
         self.file_counter = 0
-        self.queue_len = multiprocessing.Value("i", 0)
-        self.action_count = multiprocessing.Value("i", 0)
-        self.active_workers = multiprocessing.Value("i", 0)
-        self.dir_count = multiprocessing.Value("i", 0)
-        self.file_count = multiprocessing.Value("i", 0)
-
-        if counters:
-            self.o_start_time = counters["o_start_time"]
-            self.dir_counter = counters["dir_counter"]
-            self.file_counter = counters["file_counter"]
-            self.queue_len.value = counters["queue_len"]
-            self.action_count.value = counters["action_count"]
-            self.active_workers.value = counters["active_workers"]
-            self.dir_count.value = counters["dir_count"]
-            self.file_count.value = counters["file_count"]
 
         self.creds = creds
         self.run_task = run_task
+        # Entry fields the task reads, None for all of them
+        self.fields: Optional[Sequence[str]] = getattr(run_task, "FIELDS", None)
+        # Changes the task gets in a --diff walk
+        self.changes: Sequence[str] = getattr(run_task, "CHANGES", DEFAULT_CHANGES)
         self.worker_id: Optional[int] = None
         self.MAKE_CHANGES = make_changes
         self.LOG_FILE_NAME = log_file
         self.start_path = "/" if start_path == "/" else re.sub("/$", "", start_path)
+        self.pruner = DirPruner(
+            self.start_path,
+            excludes,
+            max_depth,
+            getattr(run_task, "should_descend", None),
+        )
 
-        self.queue: multiprocessing.Queue[  # pylint: disable=unsubscriptable-object
-            Union[ProcessListArgs, ListDirArgs]
-        ] = multiprocessing.Queue()
-        self.queue_lock = multiprocessing.Lock()
-        self.maximum_queue_length = max(MAX_QUEUE_LENGTH, run_task.minimum_queue_length())
+        # With autotune the pool starts at its upper bound and the tuner decides
+        # how many of the workers are allowed to take work.
+        self.pool_size = MAX_WORKER_COUNT
+        if autotune:
+            self.pool_size = max(MAX_WORKER_COUNT, AUTOTUNE_MAX_WORKERS)
+        self.tuner = Autotuner(
+            autotune,
+            self.pool_size,
+            MAX_WORKER_COUNT,
+            100,
+            BATCH_SIZE,
+            max(MAX_QUEUE_LENGTH, run_task.minimum_queue_length()),
+            WAIT_SECONDS,
+        )
+        self.scheduler = WorkScheduler(self.pool_size)
+        # Directories beyond the max queue length wait here instead of in memory
+        self.disk_queue = SegmentedQueue(QUEUE_DIR, self.pool_size)
+        self.disk_queue.reset()
+        # set up in every process that lists directories
+        self.batcher: Optional[Batcher] = None
+        self.checkpoints = CheckpointStore(CHECKPOINT_DIR)
+        self.last_checkpoint = time.time()
+        self.resume_state = resume_state
 
-        self.count_lock = multiprocessing.Lock()
-        self.write_file_lock = multiprocessing.Lock()
-        self.result_file_lock = multiprocessing.Lock()
+        self.results = ResultWriter()
         self.start_time = time.time()
         self.rc: RestClient = None
+        # set up in the worker processes by thread_client
+        self.thread_clients: Optional[threading.local] = None
+        # the one login for the walk, workers share its bearer token
+        self.session = SessionManager(
+            self.creds["QHOST"],
+            self.creds.get("QPORT", REST_PORT),
+            self.creds["QUSER"],
+            self.creds["QPASS"],
+        )
+        self.session.login()
         if OVERRIDE_IPS is None:
-            self.ips = self.rc_get_ips(self.creds)
+            self.ips = self.rc_get_ips(self.session)
         else:
             self.ips = re.split(r"[ ,]+", OVERRIDE_IPS)
         log_it("Using the following Qumulo IPS: %s" % ",".join(self.ips))
-        self.pool = multiprocessing.Pool(  # pylint: disable=consider-using-with
-            MAX_WORKER_COUNT, QWalkWorker.worker_main, (QWalkWorker.list_dir, self)
+        self.router = NodeRouter(self.ips, self.pool_size)
+        # a slot per worker and the main process in the last one
+        self.metrics = Metrics(self.pool_size + 1, self.ips)
+        # owner and group names for the tasks, cached in every process
+        self.identities = IdentityResolver(self.router, self.session, self.metrics)
+        if counters:
+            self.o_start_time = counters["o_start_time"]
+            self.dir_counter = counters["dir_counter"]
+            self.file_counter = counters["file_counter"]
+            self.metrics.add("actions", counters["action_count"])
+            self.metrics.add("dirs", counters["dir_count"])
+            self.metrics.add("files", counters["file_count"])
+        self.exporter = MetricsExporter(
+            self.metrics,
+            self.gauges,
+            {
+                "task": type(run_task).__name__,
+                "engine": engine,
+                "start_path": self.start_path,
+            },
         )
+        # Shared memory outlives the process unless it's unlinked, so the ring
+        # is the last thing set up and run() unlinks it however the walk ends
+        self.ring = BatchRing.create(RING_BYTES)
+        try:
+            self.pool = multiprocessing.Pool(  # pylint: disable=consider-using-with
+                self.pool_size, QWalkWorker.worker_main, (QWalkWorker.list_dir, self)
+            )
+        except BaseException:
+            if self.ring is not None:
+                self.ring.close()
+            raise
+
+    @property
+    def maximum_queue_length(self) -> int:
+        return self.tuner.max_queue_length
 
     @staticmethod
-    def rc_get_ips(creds: Creds) -> Sequence[str]:
-        rc = RestClient(creds["QHOST"], creds.get("QPORT", REST_PORT))
-        rc.login(creds["QUSER"], creds["QPASS"])
+    def rc_get_ips(session: SessionManager) -> Sequence[str]:
+        rc = session.client()
         ips = []
         for d in rc.network.list_network_status_v2(1):
             ips.append(d["network_statuses"][0]["address"])
         return ips
 
     def run(self) -> None:
-        if not os.path.exists("old-queue.txt"):
-            self.run_task.work_start(self)
-            rc = RestClient(self.creds["QHOST"], self.creds.get("QPORT", REST_PORT))
-            rc.login(self.creds["QUSER"], self.creds["QPASS"])
+        if self.metrics_address is not None:
+            self.exporter.serve(parse_address(self.metrics_address, "127.0.0.1"))
+        try:
+            if self.connect_address is not None:
+                self.run_remote()
+            else:
+                self.run_walk()
+        finally:
+            self.exporter.stop()
+            if self.ring is not None:
+                self.ring.close()
+
+    def run_walk(self) -> None:
+        # The workers are already waiting: until the first directories are
+        # queued they'd see an empty queue and exit after a few seconds, like
+        # at the end of the walk, which planning a big tree easily takes
+        self.scheduler.hold()
+        held = True
+        try:
+            if self.resume_state is None:
+                self.run_task.work_start(self)
+                self.results.reset(self.result_files())
+            server = None
+            if self.serve_address is not None:
+                self.broker, server = serve(
+                    self,
+                    parse_address(self.serve_address, "0.0.0.0"),
+                    authkey(self.creds["QPASS"]),
+                )
+            rc = self.session.client()
             if self.snap:
                 d_attr = rc.fs.read_dir_aggregates(
                     path=self.start_path, snapshot=self.snap, max_entries=0
@@ -212,87 +362,357 @@ class QWalkWorker:  # pylint: disable=too-many-instance-attributes
             log_it(
                 "Walking - %(total_directories)9s dir|%(total_inodes)10s inod" % d_attr
             )
-            self.add_to_queue(
+            items: List[ListDirArgs] = [
                 {"type": "list_dir", "path_id": d_attr["id"], "snapshot": self.snap}
-            )
-            self.wait_for_complete()
-        else:
-            with open("old-queue.txt", "r") as fr:
-                last_time = time.time()
-                for line in fr:
-                    # back off because we have a lot of directories now
-                    while self.queue_len.value > self.maximum_queue_length:
-                        if time.time() - last_time >= WAIT_SECONDS:
-                            self.print_status()
-                            last_time = time.time()
-                        time.sleep(1)
-                    self.add_to_queue(
-                        {
-                            "type": "list_dir",
-                            "path_id": line.strip(),
-                            "snapshot": self.snap,
-                        }
-                    )
-                    if time.time() - last_time >= WAIT_SECONDS:
-                        self.print_status()
-                        last_time = time.time()
-            os.remove("old-queue.txt")
-            self.wait_for_complete()
+            ]
+            if self.resume_state is not None:
+                items = self.resume()
+            elif self.plan:
+                planner = TreePlanner(
+                    rc,
+                    self.snap,
+                    PLAN_PIECES_PER_WORKER * self.pool_size,
+                    PLAN_REQUESTS,
+                    self.pruner,
+                )
+                items = cast(
+                    List[ListDirArgs],
+                    planner.plan(d_attr["id"], d_attr["total_inodes"], self.start_path),
+                )
+            if self.diff_older is not None:
+                rc = RoutedClient(self.router, self.session, self.metrics)
+                SnapshotDiff(self, rc, str(self.snap), self.diff_older).start()
+            elif self.engine == "async":
+                # The lister takes over the hold and releases it when it's
+                # done, a second one would keep every checkpoint from finding
+                # the queued items
+                lister = self.async_lister()
+                held = False
+                lister.run(iter(items), held=True)
+            else:
+                for item in items:
+                    self.add_to_queue(item)
+        finally:
+            if held:
+                self.scheduler.done()
+        self.wait_for_complete()
+        if self.broker is not None and server is not None:
+            self.broker.finish(REMOTE_TIMEOUT)
+            server.stop_event.set()
         self.pool.close()
         self.pool.join()
-        self.queue.close()
-        self.queue.join_thread()
+        self.results.merge(self.result_files())
+        self.scheduler.close()
+        self.disk_queue.remove()
+        self.checkpoints.remove()
         if self.rc:
             rc.close()
             del rc
         del self.pool
-        del self.queue
+
+    def run_remote(self) -> None:
+        # Work for a coordinator started with --serve on another host
+        self.run_task.work_start(self)
+        self.results.reset(self.result_files())
+        RemoteWorker(
+            self,
+            parse_address(cast(str, self.connect_address), "localhost"),
+            authkey(self.creds["QPASS"]),
+            WAIT_SECONDS,
+        ).run()
+        self.wait_for_complete()
+        self.pool.close()
+        self.pool.join()
+        self.results.merge(self.result_files())
+        self.scheduler.close()
+        self.disk_queue.remove()
+
+    def result_files(self) -> List[str]:
+        files = [self.LOG_FILE_NAME]
+        task_file = getattr(self.run_task, "FILE_NAME", None)
+        if task_file:
+            files.append(task_file)
+        files += getattr(self.run_task, "FILE_NAMES", ())
+        return files
+
+    def result_paths(self) -> List[str]:
+        # Result files and shards on disk
+        paths = []
+        for name in self.result_files():
+            if os.path.exists(self.results.path(name)):
+                paths.append(self.results.path(name))
+            paths += self.results.shards(name)
+        return paths
+
+    def write_results(self, name: str, lines: Sequence[str]) -> None:
+        if lines:
+            self.results.write(name, lines)
+
+    def read_results(self, name: str) -> Iterator[str]:
+        return self.results.read(name)
+
+    def remove_results(self, name: str) -> None:
+        self.results.remove(name)
+
+    def thread_client(self) -> RestClient:
+        # A client of its own for a thread the task starts, RestClients can't
+        # be shared between threads
+        if self.thread_clients is None:
+            self.thread_clients = threading.local()
+        rc = getattr(self.thread_clients, "rc", None)
+        if rc is None:
+            rc = RoutedClient(self.router, self.session, self.metrics)
+            self.thread_clients.rc = rc
+        return cast(RestClient, rc)
+
+    def flush_task(self) -> None:
+        # what the task holds in this worker process, before a checkpoint and
+        # when the worker is done
+        worker_flush = getattr(self.run_task, "worker_flush", None)
+        if worker_flush is not None:
+            worker_flush(self)
+
+    def checkpoint_due(self) -> bool:
+        return (
+            CHECKPOINT_SECONDS > 0
+            and time.time() - self.last_checkpoint >= CHECKPOINT_SECONDS
+            and self.queue_length() > 0
+            and self.connect_address is None
+            and self.diff_older is None
+        )
+
+    def checkpoint(self, extra: Optional[List[Any]] = None, held: int = 0) -> None:
+        # Pause the workers between work items so every pending item is either in
+        # the shared queues or on disk, save all of it and let the workers go on.
+        # held is work the caller counts as pending but isn't in a queue.
+        start = time.time()
+        if self.broker is not None and self.broker.remote_pending() > 0:
+            # we can't save work that is out on other hosts
+            log_it(
+                "Checkpoint- skipped, %s work items on remote hosts"
+                % self.broker.remote_pending()
+            )
+            self.last_checkpoint = time.time()
+            return
+        self.scheduler.request_pause()
+        try:
+            if not self.scheduler.wait_paused(PAUSE_TIMEOUT):
+                log_it("Checkpoint- skipped, workers did not pause")
+                return
+            self.disk_queue.seal()
+            expected = self.memory_queue_length() - held
+            items = self.scheduler.drain(expected, PAUSE_TIMEOUT)
+            try:
+                if len(items) != expected:
+                    log_it(
+                        "Checkpoint- skipped, found %s of %s queued items"
+                        % (len(items), expected)
+                    )
+                    return
+                items += extra or []
+                # batches in the ring are saved as lists, they stay in the ring
+                saved = [
+                    (
+                        {
+                            "type": "process_list",
+                            "list": self.batch_list(item, keep=True),
+                        }
+                        if "ring" in item
+                        else item
+                    )
+                    for item in items
+                ]
+                result_sizes = {
+                    path: os.path.getsize(path) for path in self.result_paths()
+                }
+                state = {
+                    "task": type(self.run_task).__name__,
+                    "start_path": self.start_path,
+                    "snapshot": self.snap,
+                    "counters": self.get_counters(),
+                    "items": saved,
+                    "result_sizes": result_sizes,
+                }
+                batch_files = [
+                    item["list"]
+                    for item in saved
+                    if item["type"] == "process_list" and isinstance(item["list"], str)
+                ]
+                segments = self.disk_queue.ready_segments()
+                path = self.checkpoints.save(state, segments, batch_files)
+            finally:
+                self.scheduler.requeue(items[:expected])
+            log_it(
+                "Checkpoint- %9s items|%8s disk|%5.1fs|%s"
+                % (len(items), self.disk_queue.backlog(), time.time() - start, path)
+            )
+        finally:
+            self.scheduler.resume()
+            self.last_checkpoint = time.time()
+
+    def resume(self) -> List[ListDirArgs]:
+        # Put the work saved in the checkpoint back on the queues. Returns the
+        # directories still to be listed.
+        state = cast(Dict[str, Any], self.resume_state)
+        for path in self.result_paths():
+            # Anything written after the checkpoint will be written again
+            size = state["result_sizes"].get(path, 0)
+            if os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        on_disk = self.disk_queue.restore(state["segments"])
+        self.scheduler.hold(on_disk)
+        list_dirs = []
+        for item in state["items"]:
+            if item["type"] == "list_dir":
+                list_dirs.append(item)
+            else:
+                self.add_to_queue(item)
+        log_it(
+            "Resuming- %9s dir|%10s inod|%8s q|%8s disk|%s"
+            % (
+                self.metrics.value("dirs"),
+                self.metrics.value("files"),
+                len(state["items"]),
+                on_disk,
+                state["path"],
+            )
+        )
+        return list_dirs
+
+    def async_lister(self) -> AsyncDirLister:
+        return AsyncDirLister(self, ASYNC_CONCURRENCY, WAIT_SECONDS)
+
+    def add_actions(self, count: int) -> None:
+        self.metrics.add("actions", count)
+
+    def gauges(self) -> Dict[str, float]:
+        return {
+            "queue": self.queue_length(),
+            "disk_queue": self.disk_queue.backlog(),
+            "active_workers": self.scheduler.busy(),
+            "worker_limit": self.tuner.worker_limit,
+            "elapsed_seconds": round(time.time() - self.o_start_time, 1),
+        }
 
     def print_status(self) -> None:
+        dir_count = self.metrics.value("dirs")
+        file_count = self.metrics.value("files")
         log_it(
-            "Update  - %9s dir|%10s inod|%10s actn|%4s dir/s|%6s fil/s|%8s q"
+            "Update  - %9s dir|%10s inod|%10s actn|%4s dir/s|%6s fil/s|%8s q|%8s disk"
             % (
-                self.dir_count.value,
-                self.file_count.value,
-                self.action_count.value,
-                int(
-                    (self.dir_count.value - self.dir_counter)
-                    / (time.time() - self.start_time)
-                ),
-                int(
-                    (self.file_count.value - self.file_counter)
-                    / (time.time() - self.start_time)
-                ),
-                self.queue_len.value,
+                dir_count,
+                file_count,
+                self.metrics.value("actions"),
+                int((dir_count - self.dir_counter) / (time.time() - self.start_time)),
+                int((file_count - self.file_counter) / (time.time() - self.start_time)),
+                self.queue_length(),
+                self.disk_queue.backlog(),
             )
+            + self.pruned_status()
         )
-        self.dir_counter = self.dir_count.value
-        self.file_counter = self.file_count.value
+        if METRICS_LOG:
+            rest = self.metrics.histograms["rest_seconds"]
+            batch = self.metrics.histograms["batch_seconds"]
+            log_it(
+                "Metrics - rest p50 %.3fs p99 %.3fs|batch p50 %.3fs p99 %.3fs|%6s errors"
+                % (
+                    rest.quantile(0.5),
+                    rest.quantile(0.99),
+                    batch.quantile(0.5),
+                    batch.quantile(0.99),
+                    self.metrics.value("rest_errors"),
+                )
+            )
+        if self.metrics_file is not None:
+            self.exporter.write(self.metrics_file)
+        self.dir_counter = dir_count
+        self.file_counter = file_count
         self.start_time = time.time()
+        self.tuner.tune(
+            dir_count + file_count,
+            self.memory_queue_length(),
+            self.scheduler.idle_count(),
+        )
+
+    def pruned_status(self) -> str:
+        if not self.pruner.active:
+            return ""
+        return "|%8s prun" % self.metrics.value("pruned")
+
+    def project(self, entries: List[Dict[str, Any]]) -> List[Any]:
+        # Only the fields the task reads go through the queue, as plain tuples
+        if self.fields is None:
+            return entries
+        fields = self.fields
+        return [tuple(map(dd.get, fields)) for dd in entries]
+
+    def expand(self, rows: Sequence[Any]) -> Sequence[FileInfo]:
+        if self.fields is None:
+            return rows
+        fields = self.fields
+        # fields missing from the listing stay missing, like before
+        return [
+            (
+                cast(FileInfo, {f: v for f, v in zip(fields, row) if v is not None})
+                if isinstance(row, tuple)
+                else row
+            )
+            for row in rows
+        ]
+
+    def add_to_queue(
+        self, d: Union[ProcessListArgs, ListDirArgs, DiffListArgs]
+    ) -> None:
+        self.scheduler.put(d)
+
+    def queue_length(self) -> int:
+        return self.scheduler.pending()
+
+    def memory_queue_length(self) -> int:
+        return self.queue_length() - self.disk_queue.backlog()
+
+    def spill(self, path_ids: List[str]) -> None:
+        # Spilled directories stay pending until they're read back by refill()
+        self.disk_queue.spill(path_ids)
+        self.scheduler.hold(len(path_ids))
 
-    def add_to_queue(self, d: Union[ProcessListArgs, ListDirArgs]) -> None:
-        with self.queue_lock:
-            self.queue_len.value += 1
-            self.queue.put(d)
+    def refill(self) -> None:
+        path_ids = self.disk_queue.claim()
+        for path_id in path_ids:
+            self.add_to_queue(
+                {"type": "list_dir", "path_id": path_id, "snapshot": self.snap}
+            )
+        self.scheduler.done(len(path_ids))
 
     def wait_for_complete(self) -> None:
         time.sleep(0.5)  # allow all worker processes to start.
         while True:
             self.print_status()
             time.sleep(WAIT_SECONDS)
-            if self.queue_len.value <= 0 and self.active_workers.value <= 0:
+            if self.queue_length() <= 0 and self.scheduler.active() <= 0:
                 break
+            if self.broker is not None:
+                self.broker.expire()
+            if self.checkpoint_due():
+                self.checkpoint()
 
+        dir_count = self.metrics.value("dirs")
+        file_count = self.metrics.value("files")
         log_it(
             "Donestep- %9s dir|%10s inod|%10s actn|%4s dir/s|%6s fil/s"
             % (
-                self.dir_count.value,
-                self.file_count.value,
-                self.action_count.value,
-                int(self.dir_count.value / (time.time() - self.o_start_time)),
-                int(self.file_count.value / (time.time() - self.o_start_time)),
+                dir_count,
+                file_count,
+                self.metrics.value("actions"),
+                int(dir_count / (time.time() - self.o_start_time)),
+                int(file_count / (time.time() - self.o_start_time)),
             )
+            + self.pruned_status()
         )
+        log_it("Nodes   - %s" % self.router.summary())
+        if self.metrics_file is not None:
+            self.exporter.write(self.metrics_file)
 
     @staticmethod
     def run_all(  # pylint: disable=too-many-arguments
@@ -305,9 +725,38 @@ class QWalkWorker:  # pylint: disable=too-many-instance-attributes
         run_class_name: str,
         snapshot_id: Optional[str],
         other_args: Sequence[str],
+        engine: str = "pool",
+        autotune: bool = False,
+        resume: bool = False,
+        plan: bool = False,
+        serve_address: Optional[str] = None,
+        connect_address: Optional[str] = None,
+        metrics_address: Optional[str] = None,
+        metrics_file: Optional[str] = None,
+        profile_dir: Optional[str] = None,
+        diff_older: Optional[str] = None,
+        excludes: Sequence[str] = (),
+        max_depth: Optional[int] = None,
     ) -> None:
         run_class = QTASKS[run_class_name]
         run_task = run_class(other_args)
+        resume_state = None
+        if resume:
+            resume_state = CheckpointStore(CHECKPOINT_DIR).load()
+            if resume_state is None:
+                log_it("No checkpoint in %s, starting a new walk" % CHECKPOINT_DIR)
+            else:
+                start_path = "/" if start_dir == "/" else re.sub("/$", "", start_dir)
+                saved = (
+                    resume_state["task"],
+                    resume_state["start_path"],
+                    resume_state["snapshot"],
+                )
+                if saved != (run_class_name, start_path, snapshot_id):
+                    sys.exit(
+                        "Checkpoint in %s is for -c %s -d %s --snap %s"
+                        % ((CHECKPOINT_DIR,) + saved)
+                    )
         w = QWalkWorker(
             {"QHOST": hostname, "QUSER": username, "QPASS": password},
             run_task,
@@ -315,157 +764,243 @@ class QWalkWorker:  # pylint: disable=too-many-instance-attributes
             snapshot_id,
             make_changes,
             log_file,
-            None,
+            resume_state["counters"] if resume_state else None,
+            engine,
+            autotune,
+            resume_state,
+            plan,
+            serve_address,
+            connect_address,
+            metrics_address,
+            metrics_file,
+            profile_dir,
+            diff_older,
+            excludes,
+            max_depth,
         )
-        w.run()
-        while os.path.exists("new-queue.txt"):
-            os.rename("new-queue.txt", "old-queue.txt")
-            counters = w.get_counters()
-            del w
-            w = QWalkWorker(
-                {"QHOST": hostname, "QUSER": username, "QPASS": password},
-                run_task,
-                start_dir,
-                snapshot_id,
-                make_changes,
-                log_file,
-                counters,
-            )
+        with w.profiler.phase("main"):
             w.run()
-        w.run_task.work_done(w)
+            w.run_task.work_done(w)
+        w.identities.close()
+        # the workers have written their profiles when the pool is joined
+        w.profiler.dump()
+        w.profiler.merge()
+        if w.broker is not None and w.broker.lost_items() > 0:
+            sys.exit(
+                "Walk incomplete, %s work items of remote hosts that timed out "
+                "were lost" % w.broker.lost_items()
+            )
+
+    def diff_list(self, d: DiffListArgs) -> None:
+        rows = SnapshotDiff.resolve(self, d["entries"], self.changes)
+        dirs = sum(1 for dd in rows if dd["type"] == "FS_FILE_TYPE_DIRECTORY")
+        cast(Batcher, self.batcher).add(self.project(rows))
+        self.metrics.add("dirs", dirs)
+        self.metrics.add("files", len(rows))
 
     def queue_files(self, process_list: List[str]) -> List[str]:
         if len(process_list) > 0:
-            if USE_PICKLE:
-                filename_1 = "%s-%s.pkl" % (
-                    time.time(),
-                    random.random(),
-                )
-                with open(filename_1, "wb") as fw:
-                    pickle.dump(process_list, fw)
-                the_list_1: Union[str, List[str]] = filename_1
-            else:
-                the_list_1 = process_list
-            self.add_to_queue(
-                {"type": "process_list", "list": the_list_1}
-            )
+            self.add_to_queue(self.batch_item(process_list))
         return []
 
+    def batch_item(self, process_list: List[str]) -> ProcessListArgs:
+        # The batch goes into the shared memory ring if there's room, otherwise
+        # pickled to a file with QUSEPICKLE or through the queue itself
+        ref = self.ring.put(process_list) if self.ring is not None else None
+        if ref is not None:
+            return {"type": "process_list", "list": [], "ring": ref}
+        if USE_PICKLE:
+            filename_1 = "%s-%s.pkl" % (
+                time.time(),
+                random.random(),
+            )
+            with open(filename_1, "wb") as fw:
+                pickle.dump(process_list, fw)
+            return {"type": "process_list", "list": filename_1}
+        return {"type": "process_list", "list": process_list}
+
+    def batch_list(self, d: ProcessListArgs, keep: bool = False) -> List[Any]:
+        # The entries of a batch, removing it from the ring or disk unless kept
+        rows: List[Any]
+        if "ring" in d:
+            ring = cast(BatchRing, self.ring)
+            rows = ring.get(d["ring"])
+            if not keep:
+                ring.free(d["ring"])
+            return rows
+        if isinstance(d["list"], str):
+            with open(d["list"], "rb") as fr:
+                rows = pickle.load(fr)
+            if not keep:
+                os.remove(d["list"])
+            return rows
+        return d["list"]
+
+    def emit_batch(self, rows: List[Any]) -> None:
+        # Back-pressure: with too many batches waiting for the workers, a worker
+        # that is listing runs the batch itself instead of listing more
+        if (
+            self.memory_queue_length()
+            > self.maximum_queue_length + BATCH_BACKLOG * self.pool_size
+            and not self.scheduler.pause_requested()
+        ):
+            self.run_batch(rows)
+        else:
+            self.queue_files(rows)
+
+    def run_batch(self, rows: List[Any]) -> None:
+        batch_start = time.time()
+        with self.profiler.phase("every_batch"):
+            self.run_task.every_batch(self.expand(rows), self)
+        seconds = time.time() - batch_start
+        self.tuner.record_batch(cast(int, self.worker_id), seconds)
+        self.metrics.add("batches")
+        self.metrics.observe("batch_seconds", seconds)
+        self.metrics.observe("batch_entries", len(rows))
+
+    def portable(self, items: List[Any]) -> List[Any]:
+        # Work items that can leave this process, for other hosts
+        return [
+            (
+                {"type": "process_list", "list": self.batch_list(item)}
+                if item["type"] == "process_list"
+                else item
+            )
+            for item in items
+        ]
+
     @staticmethod
     def worker_main(  # pylint: disable=too-many-nested-blocks
-        func: Callable[[ListDirArgs, "QWalkWorker"], Sequence[str]], ww: "QWalkWorker"
+        func: Callable[[ListDirArgs, "QWalkWorker"], None], ww: "QWalkWorker"
     ) -> None:
-        p_name = multiprocessing.current_process().name
-        match = re.match(r".*?-([0-9])+", p_name)
-        assert match, p_name
-        ww.worker_id = int(match.group(1)) - 1
-        rc = RestClient(random.choice(ww.ips), ww.creds.get("QPORT", REST_PORT))
-        rc.login(ww.creds["QUSER"], ww.creds["QPASS"])
-        client_start = time.time()
-        ww.rc = rc
-        file_list: List[str] = []
-        with ww.queue_lock:
-            ww.active_workers.value += 1
-        process_list = []
+        ww.worker_id = ww.scheduler.register()
+        ww.disk_queue.set_slot(ww.worker_id)
+        ww.results.set_slot(ww.worker_id)
+        ww.router.set_slot(ww.worker_id)
+        ww.metrics.set_slot(ww.worker_id)
+        ww.profiler.set_slot(ww.worker_id)
+        rc = RoutedClient(ww.router, ww.session, ww.metrics)
+        # The routed client stands in for a RestClient for the tasks
+        ww.rc = cast(RestClient, rc)
+        ww.batcher = Batcher(ww.emit_batch, lambda: ww.tuner.batch_size)
         while True:
-            if time.time() - client_start > 60 * 60:
-                # re-initialize rest client every hour
-                ww.rc.login(ww.creds["QUSER"], ww.creds["QPASS"])
-                # log_it("re-initialized Qumulo rest client for worker")
-            try:
-                data = ww.queue.get(True, timeout=5)
-                if data["type"] == "list_dir":
-                    file_list += func(data, ww)
-                    while len(file_list) > 0:
-                        process_list.append(file_list.pop(0))
-                        if len(process_list) >= BATCH_SIZE:
-                            process_list = ww.queue_files(process_list)
-
-                    # Queue a partial batch if we have it
-                    process_list = ww.queue_files(process_list)
-
-                elif data["type"] == "process_list":
-                    if USE_PICKLE:
-                        # TODO: instead of USE_PICKLE, infer from list type?
-                        filename_2 = cast(str, data["list"])
-                        with open(filename_2, "rb") as fr:
-                            the_list_2 = pickle.load(fr)
-                        os.remove(filename_2)
-                    else:
-                        the_list_2 = data["list"]
-                    ww.run_task.every_batch(the_list_2, ww)
-                    # the_list_2 = None
-                with ww.queue_lock:
-                    ww.queue_len.value -= 1
-            except queue.Empty:
+            if ww.scheduler.pause_requested():
+                # checkpoint in progress, hand over everything we hold
+                ww.disk_queue.seal()
+                ww.batcher.flush()
+                ww.flush_task()
+                ww.results.close()
+                ww.scheduler.pause()
+                continue
+            if ww.worker_id >= ww.tuner.worker_limit:
+                # parked by the autotuner
+                ww.batcher.flush()
+                ww.scheduler.park()
+                if ww.queue_length() <= 0:
+                    break
+                time.sleep(0.5)
+                continue
+            ww.disk_queue.seal_if_old()
+            if (
+                ww.engine == "pool"
+                and ww.disk_queue.backlog() > 0
+                and ww.memory_queue_length() < ww.maximum_queue_length // 2
+            ):
+                ww.refill()
+            ww.batcher.flush_if_old()
+            data = ww.scheduler.get(timeout=ww.batcher.wait_time(5))
+            if data is None and ww.scheduler.pause_requested():
+                continue
+            if data is None:
+                ww.disk_queue.seal()
                 try:
-                    if len(process_list) > 0:
+                    if len(ww.batcher) > 0:
                         # log_exception("Queue empty, process_list > 0")
-                        if USE_PICKLE:
-                            filename_3 = "%s-%s.pkl" % (time.time(), random.random())
-                            with open(filename_3, "wb") as fw:
-                                pickle.dump(process_list, fw)
-                            the_list_3: Union[str, List[str]] = filename_3
-                        else:
-                            the_list_3 = process_list
-                        ww.add_to_queue({"type": "process_list", "list": the_list_3})
-                        process_list = []
-                        # the_list_3 = None
-                    elif ww.queue_len.value > 0:
-                        # log_exception("Queue empty exception, but queue length = %s." % (ww.queue_len.value))
-                        pass
+                        ww.batcher.flush()
+                    elif ww.queue_length() > 0:
+                        # log_exception("Queue empty, but queue length = %s." % (ww.queue_length()))
+                        if ww.engine == "pool":
+                            ww.refill()
                     else:
                         # log_exception("Queue empty, process_list empty. No more work.")
                         break
                 except:
                     log_exception("Queue empty process_list exception")
                     break
+                continue
+            try:
+                if data["type"] == "list_dir":
+                    with ww.profiler.phase("list_dir"):
+                        func(data, ww)
+                elif data["type"] == "process_list":
+                    ww.run_batch(ww.batch_list(data))
+                elif data["type"] == "diff_list":
+                    with ww.profiler.phase("list_dir"):
+                        ww.diff_list(data)
             except:
                 # this is not expected
                 log_exception("Exception in worker process")
-        with ww.queue_lock:
-            ww.active_workers.value -= 1
+            finally:
+                ww.scheduler.done()
+                ww.tuner.record_cpu(ww.worker_id)
+        ww.flush_task()
+        ww.results.close()
+        ww.profiler.dump()
+        ww.scheduler.unregister()
 
     @staticmethod
-    def list_dir(d: ListDirArgs, ww: "QWalkWorker") -> Sequence[str]:
+    def list_dir(d: ListDirArgs, ww: "QWalkWorker") -> None:
         file_count = 0
         next_uri = "first"
+        skip = set(d.get("skip", []))
+        batcher = cast(Batcher, ww.batcher)
+        pruner = ww.pruner
         leftovers = []
-        file_list = []
+        api_errors = 0
+        pruned = 0
         while True:
             try:
+                request_start = time.time()
                 if next_uri == "first":
                     if d["snapshot"] is not None:
                         res = ww.rc.fs.read_directory(
-                            id_=d["path_id"], snapshot=d["snapshot"], page_size=100
+                            id_=d["path_id"],
+                            snapshot=d["snapshot"],
+                            page_size=ww.tuner.page_size,
                         )
                     else:
-                        res = ww.rc.fs.read_directory(id_=d["path_id"], page_size=100)
+                        res = ww.rc.fs.read_directory(
+                            id_=d["path_id"], page_size=ww.tuner.page_size
+                        )
                 elif next_uri == "directory_deleted":
                     break
                 elif next_uri != "":
                     res = ww.rc.request("GET", next_uri)
                 else:
                     break
+                ww.tuner.record_request(ww.scheduler.slot, time.time() - request_start)
             except RequestError as e:
-                # handle API errors, usually it's the 10 hour expiration or directory deleted.
+                # expired tokens are handled by the client, usually it's directory deleted.
                 if "404" in str(e):
                     next_uri = "directory_deleted"
                 else:
-                    time.sleep(5)
                     log_it("HTTP API error: %s" % re.sub(r"[\r\n]+", " ", str(e))[:100])
                     log_it("id: %s - next_uri: %s" % (d["path_id"], next_uri))
-                    ww.rc.login(ww.creds["QUSER"], ww.creds["QPASS"])
+                    api_errors += 1
+                    time.sleep(min(5, 0.1 * 2 ** api_errors))
                 continue
             except:
                 log_exception("UNHANDLED EXCEPTION! - Stop reading directory")
                 break
             try:
                 dd = None
+                queue_length = ww.memory_queue_length()
                 for dd in res["files"]:
                     dd["dir_id"] = d["path_id"]
-                    if dd["type"] == "FS_FILE_TYPE_DIRECTORY":
-                        if ww.queue_len.value > ww.maximum_queue_length:
+                    if dd["type"] == "FS_FILE_TYPE_DIRECTORY" and dd["id"] not in skip:
+                        if pruner.active and not pruner.descend(dd):
+                            pruned += 1
+                        elif queue_length > ww.maximum_queue_length:
                             leftovers.append(dd["id"])
                         else:
                             ww.add_to_queue(
@@ -475,50 +1010,26 @@ class QWalkWorker:  # pylint: disable=too-many-instance-attributes
                                     "snapshot": d["snapshot"],
                                 }
                             )
-                    file_count += 1
-                file_list += res["files"]
-            except:
-                log_exception("UNHANDLED EXCEPTION reading directory entries")
-
-            # handle very large directories dynamically
-            try:
-                if len(file_list) >= BATCH_SIZE:
-                    process_list = []
-                    while len(file_list) > 0:
-                        process_list.append(file_list.pop(0))
-                        if len(process_list) >= BATCH_SIZE or len(file_list) == 0:
-                            if USE_PICKLE:
-                                filename = "%s-%s.pkl" % (time.time(), random.random())
-                                with open(filename, "wb") as fw:
-                                    pickle.dump(process_list, fw)
-                                the_list: Union[str, List[str]] = filename
-                            else:
-                                the_list = process_list
-                            ww.add_to_queue({"type": "process_list", "list": the_list})
-                            process_list = []
-                            # the_list = None
-
-                    with ww.count_lock:
-                        ww.file_count.value += file_count
+                # excluded directories aren't processed, so they aren't counted
+                visible = pruner.visible(res["files"])
+                file_count += len(visible)
+                # very large directories stream out a batch at a time
+                batcher.add(ww.project(visible))
+                if file_count >= ww.tuner.batch_size:
+                    ww.metrics.add("files", file_count)
                     file_count = 0
-                    file_list = []
             except:
-                log_exception(
-                    "UNHANDLED EXCEPTION while working with a large directory"
-                )
+                log_exception("UNHANDLED EXCEPTION reading directory entries")
 
             try:
                 next_uri = res["paging"]["next"]
                 if len(leftovers) > 0:
-                    with ww.write_file_lock:
-                        with open("new-queue.txt", "a") as f:
-                            f.write("\n".join(leftovers))
-                            f.write("\n")
-                        leftovers = []
+                    ww.spill(leftovers)
+                    leftovers = []
             except:
                 log_exception("UNHANDLED EXCEPTION handling leftover directory entries")
 
-        with ww.count_lock:
-            ww.dir_count.value += 1
-            ww.file_count.value += file_count
-        return file_list
+        ww.metrics.add("dirs")
+        ww.metrics.add("files", file_count)
+        if pruned:
+            ww.metrics.add("pruned", pruned)
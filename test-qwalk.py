@@ -20,7 +20,8 @@ from qtasks.ModeBitsChecker import ModeBitsChecker
 from qtasks.Search import Search
 from qtasks.SummarizeOwners import SummarizeOwners
 from qumulo.rest_client import RestClient
-from qwalk_worker import Creds, log_it, QWalkWorker, REST_PORT, BATCH_SIZE
+from qwalk_log import log_it
+from qwalk_worker import Creds, QWalkWorker, REST_PORT, BATCH_SIZE
 
 LOG_FILE_NAME = "test-qwalk-log-file.txt"
 
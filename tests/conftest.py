@@ -0,0 +1,190 @@
+"""
+Fixtures for the tests: a mock-qumulo.py server on a free port and a function
+that runs qwalk.py against it in a scratch directory, like bench-walk.py does.
+"""
+
+import json
+import os
+import re
+import signal
+import socket
+import ssl
+import subprocess
+import sys
+import time
+import urllib.request
+
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pytest
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+# mock-qumulo.py arguments of the tree most tests walk: 40 directories and
+# 400 files
+SMALL_TREE = ["--fanout", "3", "--depth", "3", "--files", "10"]
+# qwalk.py takes no port, it's set here before qwalk.py runs
+LAUNCHER = (
+    "import sys, qwalk, qwalk_worker; "
+    "qwalk_worker.REST_PORT = int(sys.argv.pop(1)); "
+    "qwalk.main()"
+)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return int(s.getsockname()[1])
+
+
+def wait_for_port(port: int, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("mock-qumulo.py didn't start on port %s" % port)
+
+
+class Walk:  # pylint: disable=too-few-public-methods
+    def __init__(self, returncode: int, output: str):
+        self.returncode = returncode
+        self.output = output
+        walking = re.search(r"Walking -\s+(\d+) dir\|\s+(\d+) inod", output)
+        done = re.search(r"Donestep-\s+(\d+) dir\|\s+(\d+) inod", output)
+        # what the directory aggregates say is there, and what was walked
+        self.total = (int(walking.group(1)), int(walking.group(2))) if walking else None
+        self.dirs = int(done.group(1)) if done else None
+        self.inodes = int(done.group(2)) if done else None
+
+
+class Mock:
+    def __init__(self, args: List[str]):
+        self.port = free_port()
+        self.proc = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, os.path.join(HERE, "mock-qumulo.py")]
+            + ["--port", str(self.port)]
+            + args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        wait_for_port(self.port, 30)
+
+    def command(self, task: str, args: List[str]) -> List[str]:
+        qwalk = ["-s", "127.0.0.1", "-d", "/", "-c", task]
+        return [sys.executable, "-c", LAUNCHER, str(self.port)] + qwalk + args
+
+    def start(
+        self, workdir: str, task: str, *args: str, env: Optional[Dict[str, str]] = None
+    ) -> "subprocess.Popen[Any]":
+        # qwalk.py and its workers in their own process group, see kill
+        log = open(os.path.join(workdir, "qwalk.log"), "w")
+        with log:
+            return subprocess.Popen(
+                self.command(task, list(args)),
+                cwd=workdir,
+                env=walk_env(env),
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+
+    def walk(
+        self,
+        workdir: str,
+        task: str,
+        *args: str,
+        env: Optional[Dict[str, str]] = None,
+        timeout: float = 120,
+    ) -> Walk:
+        proc = self.start(workdir, task, *args, env=env)
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            kill(proc)
+            raise AssertionError(
+                "qwalk.py didn't finish in %s seconds:\n%s"
+                % (timeout, read_log(workdir)[-2000:])
+            )
+        return Walk(proc.returncode, read_log(workdir))
+
+    def stats(self) -> Dict[str, int]:
+        # requests served, by kind
+        url = "https://127.0.0.1:%s/mock/stats" % self.port
+        context = ssl._create_unverified_context()  # pylint: disable=protected-access
+        with urllib.request.urlopen(url, context=context) as response:
+            return dict(json.load(response))
+
+    def stop(self) -> None:
+        self.proc.terminate()
+        self.proc.wait()
+
+
+def walk_env(env: Optional[Dict[str, str]]) -> Dict[str, str]:
+    result = dict(
+        os.environ,
+        PYTHONPATH=HERE,
+        QOVERRIDEIPS="127.0.0.1",
+        QWAITSECONDS="1",
+        QWORKERS="2",
+    )
+    result.update(env or {})
+    return result
+
+
+def read_log(workdir: str) -> str:
+    with open(os.path.join(workdir, "qwalk.log")) as f:
+        return f.read()
+
+
+def kill(proc: "subprocess.Popen[Any]") -> None:
+    # qwalk.py and all its workers at once
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+
+def kill_after_checkpoint(proc: "subprocess.Popen[Any]", workdir: str) -> None:
+    # Kill the walk a bit after its first checkpoint, while it's still going
+    checkpoint = os.path.join(workdir, "qwalk-checkpoint")
+    deadline = time.time() + 60
+    while not os.path.exists(checkpoint) and proc.poll() is None:
+        assert time.time() < deadline, read_log(workdir)
+        time.sleep(0.1)
+    time.sleep(1.5)
+    assert proc.poll() is None, "the walk finished before it was killed"
+    kill(proc)
+
+
+# Checkpoints every second, and no shared memory a killed walk would leave behind
+RESUME_ENV = {"QCHECKPOINTSECONDS": "1", "QRINGBYTES": "0"}
+
+
+@pytest.fixture
+def start_mock() -> Iterator[Callable[..., Mock]]:
+    mocks: List[Mock] = []
+
+    def start(*args: str) -> Mock:
+        mocks.append(Mock(list(args)))
+        return mocks[-1]
+
+    yield start
+    for mock in mocks:
+        mock.stop()
+
+
+@pytest.fixture(scope="module")
+def small_mock() -> Iterator[Mock]:
+    mock = Mock(SMALL_TREE)
+    yield mock
+    mock.stop()
+
+
+@pytest.fixture
+def workdir(tmp_path: Any) -> str:
+    return str(tmp_path)
@@ -0,0 +1,137 @@
+import collections
+import re
+
+from typing import Any, cast, Dict, Iterator, List, Mapping, Sequence, Tuple
+
+import pytest
+
+from conftest import Mock
+
+from qtasks import Aggregate as aggregate_module
+from qtasks import FileInfo, Worker
+from qtasks.Aggregate import Aggregate
+
+
+class FakeIdentities:
+    def resolve(self, ids: Sequence[Tuple[str, Mapping[str, str]]]) -> Dict[str, str]:
+        return {auth_id: "user%s" % details["id_value"] for auth_id, details in ids}
+
+
+class FakeWorker:
+    """Keeps the result files in memory."""
+
+    def __init__(self, start_path: str = "/"):
+        self.start_path = start_path
+        self.results: Dict[str, List[str]] = collections.defaultdict(list)
+        self.identities = FakeIdentities()
+        self.actions = 0
+
+    def write_results(self, name: str, lines: Sequence[str]) -> None:
+        self.results[name] += lines
+
+    def read_results(self, name: str) -> Iterator[str]:
+        return iter(self.results[name])
+
+    def remove_results(self, name: str) -> None:
+        del self.results[name]
+
+    def add_actions(self, count: int) -> None:
+        self.actions += count
+
+
+def entry(
+    path: str, size: int, owner: str = "500", kind: str = "FS_FILE_TYPE_FILE"
+) -> FileInfo:
+    return cast(
+        FileInfo,
+        {
+            "path": path,
+            "name": path.rstrip("/").rsplit("/", 1)[-1],
+            "type": kind,
+            "size": str(size),
+            "datablocks": str(size // 4096),
+            "owner": owner,
+            "owner_details": {"id_type": "NFS_UID", "id_value": owner},
+            "modification_time": "2000-01-01T00:00:00.000000000Z",
+        },
+    )
+
+
+ENTRIES = [
+    entry("/home/a/x.TXT", 8192),
+    entry("/home/a/y.txt", 4096, owner="501"),
+    entry("/home/b/", 0, kind="FS_FILE_TYPE_DIRECTORY"),
+    entry("/home/z.jpg", 100000),
+]
+
+
+def walk(
+    args: List[str], batches: List[List[FileInfo]], start_path: str = "/"
+) -> Tuple[Aggregate, FakeWorker, Dict[Tuple[Any, ...], List[int]]]:
+    task = Aggregate(args)
+    worker = FakeWorker(start_path)
+    # every worker process has its own copy of the task
+    for batch in batches:
+        copy = Aggregate(args)
+        copy.every_batch(batch, cast(Worker, worker))
+        copy.worker_flush(cast(Worker, worker))
+    return task, worker, task.merge(cast(Worker, worker))
+
+
+def test_sums_of_every_worker_are_merged() -> None:
+    task, worker, totals = walk(
+        ["--by", "owner,extension"], [ENTRIES[:2], ENTRIES[2:], ENTRIES[:1]]
+    )
+    assert totals == {
+        (("500", "NFS_UID", "500"), ".txt"): [2, 16384, 4],
+        (("501", "NFS_UID", "501"), ".txt"): [1, 4096, 1],
+        (("500", "NFS_UID", "500"), ""): [1, 0, 0],
+        (("500", "NFS_UID", "500"), ".jpg"): [1, 100000, 24],
+    }
+    assert worker.actions == 3
+    assert "aggregate.txt" not in worker.results
+    task.resolve(totals, cast(Worker, worker))
+    assert task.label("owner", ("501", "NFS_UID", "501")) == "user501 (NFS_UID/501)"
+
+
+def test_top_depth_and_buckets() -> None:
+    _task, _worker, totals = walk(["--by", "top,depth,size,mtime"], [ENTRIES], "/home")
+    # 4096 bytes are already in the <64KiB bucket
+    assert totals == {
+        ("", 1, 3, 7): [1, 100000, 24],
+        ("a", 2, 2, 7): [2, 12288, 3],
+        ("b", 1, 0, 7): [1, 0, 0],
+    }
+
+
+def test_too_many_groups_are_written_out(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(aggregate_module, "MAX_GROUPS", 2)
+    task = Aggregate(["--by", "extension"])
+    worker = FakeWorker()
+    task.every_batch(ENTRIES, cast(Worker, worker))
+    assert len(worker.results["aggregate.txt"]) == 3
+    assert task.groups == {}
+
+
+def test_report(capsys: pytest.CaptureFixture[str]) -> None:
+    task, _worker, totals = walk(["--by", "type", "--top", "1"], [ENTRIES])
+    task.report(totals)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1:3] == ["type|count|size|datablocks", "FS_FILE_TYPE_FILE|3|112288|27"]
+    assert len(lines) == 4
+
+
+def test_unknown_dimension() -> None:
+    with pytest.raises(SystemExit):
+        Aggregate(["--by", "color"])
+
+
+def test_summarize_owners_walk(small_mock: Mock, workdir: str) -> None:
+    walk = small_mock.walk(workdir, "SummarizeOwners")
+    assert walk.returncode == 0, walk.output
+    owners = {
+        m.group(1): int(m.group(2))
+        for m in re.finditer(r"^ +(\d+) user\d+ .*\): +(\d+) /", walk.output, re.M)
+    }
+    # user500 owns the directories too, the start directory isn't counted
+    assert owners == {"500": 160 + 39, "501": 120, "502": 120}
@@ -0,0 +1,62 @@
+import time
+
+from typing import Any, List, Tuple
+
+from qwalk_batcher import Batcher
+
+
+def batcher(size: int = 4, **kwargs: Any) -> Tuple[Batcher, List[List[Any]]]:
+    batches: List[List[Any]] = []
+    return Batcher(batches.append, lambda: size, **kwargs), batches
+
+
+def test_small_directories_share_a_batch() -> None:
+    batches_of, batches = batcher()
+    batches_of.add([1, 2])
+    batches_of.add([])
+    batches_of.add([3])
+    assert batches == []
+    assert len(batches_of) == 3
+    batches_of.add([4, 5])
+    assert batches == [[1, 2, 3, 4]]
+    batches_of.flush()
+    batches_of.flush()
+    assert batches == [[1, 2, 3, 4], [5]]
+
+
+def test_huge_directory_streams_out() -> None:
+    batches_of, batches = batcher()
+    batches_of.add(list(range(10)))
+    assert batches == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert batches_of.rows == [8, 9]
+
+
+def test_batch_size_changes_while_walking() -> None:
+    size = [4]
+    batches: List[List[Any]] = []
+    batches_of = Batcher(batches.append, lambda: size[0])
+    batches_of.add([1, 2, 3])
+    size[0] = 2
+    batches_of.add([4])
+    assert batches == [[1, 2], [3, 4]]
+
+
+def test_big_entries_make_smaller_batches() -> None:
+    batches_of, batches = batcher(size=1000, max_bytes=100)
+    batches_of.add(["x" * 20] * 10)
+    # about 22 bytes an entry
+    assert [len(batch) for batch in batches] == [4, 4]
+    assert batches_of.limit() == 4
+
+
+def test_old_batches_go_out() -> None:
+    batches_of, batches = batcher(max_age=0.2)
+    assert batches_of.wait_time(5) == 5
+    batches_of.add([1])
+    assert 0 < batches_of.wait_time(5) <= 0.2
+    batches_of.flush_if_old()
+    assert batches == []
+    time.sleep(0.2)
+    assert batches_of.wait_time(5) == 0
+    batches_of.flush_if_old()
+    assert batches == [[1]]
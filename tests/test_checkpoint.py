@@ -0,0 +1,49 @@
+import os
+import pathlib
+
+import pytest
+
+from qwalk_checkpoint import CheckpointStore
+
+
+def write(path: str, text: str) -> None:
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_nothing_saved(tmp_path: pathlib.Path) -> None:
+    assert CheckpointStore(str(tmp_path / "checkpoint")).load() is None
+
+
+def test_save_and_load(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    write("segment-1.ready", "1\n2\n")
+    write("batch-1.pkl", "batch")
+    store = CheckpointStore("checkpoint")
+    state = {"counters": [1, 2], "items": [{"type": "list_dir"}]}
+    store.save(state, ["segment-1.ready"], ["batch-1.pkl"])
+    # consumed after the checkpoint, the checkpoint keeps them
+    os.remove("segment-1.ready")
+    os.remove("batch-1.pkl")
+
+    loaded = CheckpointStore("checkpoint").load()
+    assert loaded is not None
+    assert loaded["counters"] == [1, 2]
+    assert loaded["items"] == state["items"]
+    assert [os.path.basename(s) for s in loaded["segments"]] == ["segment-1.ready"]
+    with open(loaded["segments"][0]) as f:
+        assert f.read() == "1\n2\n"
+    with open("batch-1.pkl") as f:
+        assert f.read() == "batch"
+
+
+def test_only_the_latest_is_kept(tmp_path: pathlib.Path) -> None:
+    store = CheckpointStore(str(tmp_path / "checkpoint"))
+    first = store.save({"n": 1}, [], [])
+    second = store.save({"n": 2}, [], [])
+    assert not os.path.exists(first)
+    assert store.latest() == second
+    loaded = store.load()
+    assert loaded is not None and loaded["n"] == 2
+    store.remove()
+    assert store.load() is None
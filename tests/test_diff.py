@@ -0,0 +1,143 @@
+from typing import Any, cast, Dict, List, Optional, Sequence, Tuple
+
+import pytest
+
+import qwalk_diff
+
+from qumulo.lib.request import RequestError
+from qwalk_diff import SnapshotDiff
+
+
+class FakeClient:
+    """
+    Stands in for a RestClient: a snapshot tree diff of the given pages, and
+    file attributes of every path, 404 for the ones starting with /gone.
+    """
+
+    def __init__(self, pages: List[List[Dict[str, str]]], status: Optional[int] = None):
+        self.pages = pages
+        self.status = status
+        self.snapshot = self.fs = self
+        self.attrs: List[Tuple[str, str]] = []
+
+    def page(self, n: int) -> Dict[str, Any]:
+        next_uri = "/diff?page=%d" % (n + 1) if n + 1 < len(self.pages) else ""
+        return {"entries": self.pages[n], "paging": {"next": next_uri}}
+
+    def get_snapshot_tree_diff(
+        self, newer_snap: int, older_snap: int, limit: int
+    ) -> Dict[str, Any]:
+        assert (newer_snap, older_snap, limit) == (2, 1, 10)
+        if self.status is not None:
+            raise RequestError(self.status, "error")
+        return self.page(0)
+
+    def request(self, method: str, uri: str) -> Dict[str, Any]:
+        assert method == "GET"
+        return self.page(int(uri.rsplit("=", 1)[1]))
+
+    def get_file_attr(self, path: str, snapshot: str) -> Dict[str, str]:
+        self.attrs.append((path, snapshot))
+        if path.startswith("/gone"):
+            raise RequestError(404, "Not Found")
+        return {"id": "id-of-" + path, "path": path}
+
+
+class FakeScheduler:
+    def __init__(self) -> None:
+        self.pending = 0
+
+    def hold(self) -> None:
+        self.pending += 1
+
+    def done(self) -> None:
+        self.pending -= 1
+
+
+class FakeWalk:
+    def __init__(
+        self,
+        rc: FakeClient,
+        start_path: str = "/",
+        fields: Optional[Sequence[str]] = None,
+    ):
+        self.rc = rc
+        self.start_path = start_path
+        self.fields = fields
+        self.snap = "2"
+        self.diff_older = 1
+        self.scheduler = FakeScheduler()
+        self.maximum_queue_length = 100
+        self.queued: List[Dict[str, Any]] = []
+
+    def memory_queue_length(self) -> int:
+        return 0
+
+    def add_to_queue(self, item: Dict[str, Any]) -> None:
+        self.queued.append(item)
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(qwalk_diff, "log_it", lambda _text: None)
+
+
+def change(op: str, path: str) -> Dict[str, str]:
+    return {"op": op, "path": path}
+
+
+def run(ww: FakeWalk) -> None:
+    diff = SnapshotDiff(cast(Any, ww), ww.rc, "2", "1", page_size=10)
+    diff.start()
+    assert diff.thread is not None
+    diff.thread.join(5)
+    assert ww.scheduler.pending == 0
+
+
+def test_pages_under_the_start_path() -> None:
+    pages = [
+        [change("CREATE", "/a/1"), change("MODIFY", "/b/2")],
+        [change("DELETE", "/a/")],
+        [change("MODIFY", "/a/3")],
+    ]
+    ww = FakeWalk(FakeClient(pages), "/a")
+    run(ww)
+    assert ww.queued == [
+        {"type": "diff_list", "entries": [change("CREATE", "/a/1")]},
+        {"type": "diff_list", "entries": [change("MODIFY", "/a/3")]},
+    ]
+
+
+def test_wrong_snapshots_end_the_diff() -> None:
+    ww = FakeWalk(FakeClient([], status=404))
+    run(ww)
+    assert ww.queued == []
+
+
+def test_resolve() -> None:
+    ww = FakeWalk(FakeClient([]))
+    entries = [
+        change("CREATE", "/a/1"),
+        change("MODIFY", "/a/2"),
+        change("DELETE", "/a/3"),
+        change("CREATE", "/gone/4"),
+    ]
+    rows = SnapshotDiff.resolve(cast(Any, ww), entries, ("CREATE", "DELETE"))
+    assert [(row["path"], row["change"], row["dir_id"]) for row in rows] == [
+        ("/a/1", "CREATE", "id-of-/a/"),
+        ("/a/3", "DELETE", "id-of-/a/"),
+    ]
+    # deleted entries are in the older snapshot, every parent is looked up once
+    assert ww.rc.attrs == [
+        ("/a/1", "2"),
+        ("/a/", "2"),
+        ("/a/3", "1"),
+        ("/gone/4", "2"),
+    ]
+
+
+def test_resolve_without_dir_id() -> None:
+    ww = FakeWalk(FakeClient([]), fields=("path", "change"))
+    rows = SnapshotDiff.resolve(cast(Any, ww), [change("MODIFY", "/a/2")], ("MODIFY",))
+    assert rows == [{"id": "id-of-/a/2", "path": "/a/2", "change": "MODIFY"}]
+    assert len(ww.rc.attrs) == 1
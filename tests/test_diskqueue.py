@@ -0,0 +1,79 @@
+import copy
+import os
+import pathlib
+
+import pytest
+
+import qwalk_diskqueue
+
+from qwalk_diskqueue import SegmentedQueue
+
+
+def disk_queue(tmp_path: pathlib.Path, slots: int = 2) -> SegmentedQueue:
+    result = SegmentedQueue(str(tmp_path / "queue"), slots)
+    result.reset()
+    return result
+
+
+def test_spill_seal_and_claim(tmp_path: pathlib.Path) -> None:
+    spilled = disk_queue(tmp_path)
+    spilled.spill(["1", "2"])
+    spilled.spill([])
+    spilled.spill(["3"])
+    # nobody can claim it while it's being written
+    assert spilled.claim() == []
+    assert spilled.backlog() == 3
+    spilled.seal()
+    assert len(spilled.ready_segments()) == 1
+    assert spilled.claim(0) == ["1", "2", "3"]
+    assert spilled.claim(0) == []
+    assert spilled.backlog() == 0
+    assert os.listdir(spilled.directory) == []
+
+
+def test_full_segments_are_sealed(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(qwalk_diskqueue, "SEGMENT_SIZE", 3)
+    spilled = disk_queue(tmp_path)
+    spilled.spill(["1", "2"])
+    spilled.spill(["3", "4"])
+    spilled.spill(["5"])
+    assert len(spilled.ready_segments()) == 1
+    spilled.seal_if_old()
+    assert len(spilled.ready_segments()) == 1
+    monkeypatch.setattr(qwalk_diskqueue, "SEGMENT_MAX_AGE", 0)
+    spilled.seal_if_old()
+    assert [spilled.claim(), spilled.claim()] == [["1", "2", "3", "4"], ["5"]]
+
+
+def test_every_process_writes_its_own_segments(tmp_path: pathlib.Path) -> None:
+    main = disk_queue(tmp_path)
+    workers = [copy.copy(main) for _ in range(2)]
+    for slot, worker in enumerate(workers):
+        worker.set_slot(slot)
+        worker.spill([str(slot)])
+    for worker in workers:
+        worker.seal()
+    assert main.backlog() == 2
+    # each one claimed once, by whichever worker asks
+    claimed = workers[1].claim() + workers[1].claim() + workers[0].claim()
+    assert sorted(claimed) == ["0", "1"]
+    assert main.backlog() == 0
+
+
+def test_restore(tmp_path: pathlib.Path) -> None:
+    spilled = disk_queue(tmp_path)
+    spilled.spill(["1", "2"])
+    spilled.seal()
+    saved = str(tmp_path / "saved")
+    os.makedirs(saved)
+    for segment in spilled.ready_segments():
+        os.rename(segment, os.path.join(saved, os.path.basename(segment)))
+    resumed = disk_queue(tmp_path)
+    segments = [os.path.join(saved, name) for name in os.listdir(saved)]
+    assert resumed.restore(segments) == 2
+    assert resumed.backlog() == 2
+    assert resumed.claim(0) == ["1", "2"]
+    resumed.remove()
+    assert not os.path.exists(resumed.directory)
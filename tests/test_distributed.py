@@ -0,0 +1,144 @@
+import os
+import time
+
+from typing import Any, Callable, cast, Dict, Iterable, List, Optional
+
+import pytest
+
+from conftest import free_port, kill, Mock, read_log
+
+import qwalk_distributed
+
+from qwalk_distributed import parse_address, WorkBroker
+
+
+class FakeScheduler:
+    broker_slot = 3
+
+    def __init__(self, items: Iterable[Any]):
+        self.items = list(items)
+        self.pending = len(self.items)
+
+    def take_shared(self, count: int) -> List[Any]:
+        taken, self.items = self.items[:count], self.items[count:]
+        return taken
+
+    def hold(self, count: int, slot: Optional[int] = None) -> None:
+        self.pending += count
+
+    def done(self, count: int = 1, slot: Optional[int] = None) -> None:
+        self.pending -= count
+
+    def requeue(self, items: List[Any]) -> None:
+        self.items += items
+
+
+class FakeWalk:
+    # the parts of QWalkWorker the broker uses
+    def __init__(self, items: Iterable[Any]):
+        self.run_task = self
+        self.start_path = "/"
+        self.snap = None
+        self.scheduler = FakeScheduler(items)
+        self.disk_queue = self
+        self.metrics = self
+        self.counters: Dict[str, int] = {}
+
+    @staticmethod
+    def portable(items: List[Any]) -> List[Any]:
+        return items
+
+    @staticmethod
+    def backlog() -> int:
+        return 0
+
+    def add(self, name: str, count: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + count
+
+
+COUNTERS = {"dir_count": 1, "file_count": 2, "action_count": 3}
+NONE = {"dir_count": 0, "file_count": 0, "action_count": 0}
+
+
+def test_parse_address() -> None:
+    assert parse_address("7701", "0.0.0.0") == ("0.0.0.0", 7701)
+    assert parse_address("host:7701", "0.0.0.0") == ("host", 7701)
+    assert parse_address("host:", "0.0.0.0") == ("host", 7700)
+
+
+def test_hello_checks_the_walk() -> None:
+    broker = WorkBroker(cast(Any, FakeWalk([])))
+    assert broker.hello("h1", "FakeWalk", "/", None) == ""
+    assert "coordinator is running" in broker.hello("h2", "Search", "/", None)
+
+
+def test_remote_work_stays_pending() -> None:
+    ww = FakeWalk(range(10))
+    broker = WorkBroker(cast(Any, ww))
+    broker.hello("h1", "FakeWalk", "/", None)
+    reply = broker.steal("h1", 0, COUNTERS, 4)
+    assert reply["items"] == [0, 1, 2, 3]
+    # the 6 left here and the 4 on h1
+    assert ww.scheduler.pending == 10
+    assert broker.remote_pending() == 4
+    assert ww.counters == {"dirs": 1, "files": 2, "actions": 3}
+    # h1 has more work now than it was given
+    broker.steal("h1", 7, NONE, 0)
+    assert ww.scheduler.pending == 13
+    broker.submit("h1", ["a", "b"])
+    assert ww.scheduler.items[-2:] == ["a", "b"]
+    broker.steal("h1", 5, NONE, 0)
+    assert ww.scheduler.pending == 6 + 2 + 5
+
+
+def test_timed_out_host_is_reported_lost(monkeypatch: pytest.MonkeyPatch) -> None:
+    ww = FakeWalk(range(10))
+    broker = WorkBroker(cast(Any, ww))
+    broker.hello("h1", "FakeWalk", "/", None)
+    broker.hello("h2", "FakeWalk", "/", None)
+    broker.steal("h1", 0, NONE, 4)
+    broker.steal("h2", 0, NONE, 0)
+    monkeypatch.setattr(qwalk_distributed, "REMOTE_TIMEOUT", 0)
+    time.sleep(0.01)
+    broker.expire()
+    assert broker.remote_pending() == 0
+    assert ww.scheduler.pending == 6
+    # h2 had nothing to lose
+    assert broker.lost == {"h1": 4}
+    assert broker.lost_items() == 4
+
+    # a host that checks in again still had its work
+    broker.steal("h1", 4, NONE, 0)
+    assert broker.lost_items() == 0
+    assert ww.scheduler.pending == 10
+
+
+def test_walk_with_a_lost_host_fails(
+    start_mock: Callable[..., Mock], workdir: str
+) -> None:
+    mock = start_mock(
+        "--fanout", "4", "--depth", "4", "--files", "5", "--latency", "0.05"
+    )
+    port = str(free_port())
+    env = {"QREMOTETIMEOUT": "2", "QRINGBYTES": "0"}
+    remote_dir = os.path.join(workdir, "remote")
+    os.mkdir(remote_dir)
+    coordinator = mock.start(workdir, "ModeBitsChecker", "--serve", port, env=env)
+    try:
+        time.sleep(1)
+        remote = mock.start(
+            remote_dir, "ModeBitsChecker", "--connect", "127.0.0.1:" + port, env=env
+        )
+        deadline = time.time() + 30
+        while "connected to" not in read_log(remote_dir):
+            assert time.time() < deadline, read_log(remote_dir)
+            time.sleep(0.1)
+        time.sleep(1)
+        kill(remote)
+        coordinator.wait(120)
+    finally:
+        kill(coordinator)
+    output = read_log(workdir)
+    assert "timed out" in output, output
+    assert coordinator.returncode != 0
+    assert "Walk incomplete" in output
@@ -0,0 +1,63 @@
+import os
+import pickle
+
+from types import SimpleNamespace
+from typing import Any, cast, Dict, Optional, Sequence
+
+from conftest import Mock
+
+from qtasks.Search import Search
+from qwalk_worker import QWalkWorker
+
+ENTRY: Dict[str, Any] = {
+    "id": "12",
+    "name": "file-1.txt",
+    "path": "/dir-2/file-1.txt",
+    "type": "FS_FILE_TYPE_FILE",
+    "size": "4096",
+    "mode": "0644",
+    "owner": "500",
+    "owner_details": {"id_type": "NFS_UID", "id_value": "500"},
+}
+
+
+def worker(fields: Optional[Sequence[str]]) -> QWalkWorker:
+    # project and expand only need the task's fields
+    return cast(QWalkWorker, SimpleNamespace(fields=fields))
+
+
+def test_only_the_task_fields_are_passed() -> None:
+    fields = ("mode", "path", "symlink_target")
+    rows = QWalkWorker.project(worker(fields), [ENTRY])
+    assert rows == [("0644", "/dir-2/file-1.txt", None)]
+    assert len(pickle.dumps(rows)) < len(pickle.dumps([ENTRY])) / 3
+    # fields the listing didn't return stay missing
+    expanded: Dict[str, Any] = {"mode": "0644", "path": "/dir-2/file-1.txt"}
+    assert QWalkWorker.expand(worker(fields), rows) == [expanded]
+
+
+def test_every_field_without_fields() -> None:
+    assert QWalkWorker.project(worker(None), [ENTRY]) == [ENTRY]
+    assert QWalkWorker.expand(worker(None), [ENTRY]) == [ENTRY]
+    # entries that were already dicts, like ones from a checkpoint
+    assert QWalkWorker.expand(worker(("path",)), [ENTRY]) == [ENTRY]
+
+
+def test_search_fields_follow_the_columns() -> None:
+    assert Search(["--re", "."]).FIELDS == ["id", "link_target", "name", "path", "type"]
+    fields = Search(["--re", ".", "--cols", "path,size,owner_name"]).FIELDS
+    assert {"size", "owner", "owner_details"} <= set(fields)
+    assert "owner_name" not in fields
+
+
+def test_walk_with_columns(small_mock: Mock, workdir: str) -> None:
+    walk = small_mock.walk(
+        workdir, "Search", "--re", ".*file-1\\.", "--cols", "path,size,mode"
+    )
+    assert walk.returncode == 0, walk.output
+    with open(os.path.join(workdir, "output-walk-log.txt")) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 40
+    for line in lines:
+        path, size, mode = line.split("|")
+        assert path.endswith("/file-1.txt") and size.isdigit() and mode.isdigit()
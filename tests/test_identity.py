@@ -0,0 +1,175 @@
+import os
+import pathlib
+import pickle
+import sqlite3
+import threading
+import time
+
+from typing import Any, cast, Dict, List, Optional
+
+import pytest
+
+import qwalk_identity
+
+from qumulo.lib.request import RequestError
+from qwalk_identity import fallback_name, IdentityResolver
+
+
+class FakeClient:
+    """
+    Stands in for a RoutedClient: "user<id>" for every id, 404 for ids
+    starting with "none" and 500 for ones starting with "bad".
+    """
+
+    lookups: List[str] = []
+    lock = threading.Lock()
+
+    def __init__(self, *_args: Any):
+        self.auth = self
+
+    def find_identity(self, auth_id: str) -> Dict[str, str]:
+        with self.lock:
+            FakeClient.lookups.append(auth_id)
+        # long enough for other resolvers to come across the same id
+        time.sleep(0.01)
+        if auth_id.startswith("none"):
+            raise RequestError(404, "Not Found")
+        if auth_id.startswith("bad"):
+            raise RequestError(500, "Internal Server Error")
+        return {"name": "user%s" % auth_id}
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fake_client(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(qwalk_identity, "RoutedClient", FakeClient)
+    FakeClient.lookups = []
+
+
+def resolver(path: Optional[str] = None) -> IdentityResolver:
+    return IdentityResolver(cast(Any, None), cast(Any, None), None, cache_path=path)
+
+
+def test_fallback_name() -> None:
+    assert fallback_name("12", {"id_type": "NFS_UID", "id_value": "33"}) == "NFS_UID:33"
+    assert fallback_name("12", None) == "12"
+
+
+def test_every_id_is_looked_up_once() -> None:
+    identities = resolver()
+    ids = [(str(n % 20), None) for n in range(100)]
+    names = identities.resolve(ids)
+    assert names == {str(n): "user%s" % n for n in range(20)}
+    assert sorted(FakeClient.lookups) == sorted(str(n) for n in range(20))
+    assert identities.name("7") == "user7"
+    assert len(FakeClient.lookups) == 20
+    identities.close()
+
+
+def test_workers_share_the_temporary_cache() -> None:
+    identities = resolver()
+    path = identities.cache_path
+    identities.resolve([("1", None), ("2", None)])
+    # what a worker process gets: nothing in memory, the same file
+    worker = pickle.loads(pickle.dumps(identities))
+    assert worker.names == {}
+    assert worker.resolve([("1", None), ("2", None)]) == {"1": "user1", "2": "user2"}
+    assert len(FakeClient.lookups) == 2
+    identities.close()
+    assert not os.path.exists(path)
+
+
+def test_cache_file_is_kept(tmp_path: pathlib.Path) -> None:
+    path = str(tmp_path / "identities.db")
+    identities = resolver(path)
+    identities.name("1")
+    identities.close()
+    assert os.path.exists(path)
+    assert resolver(path).name("1") == "user1"
+    assert FakeClient.lookups == ["1"]
+
+
+def test_name_not_found() -> None:
+    identities = resolver()
+    details = {"id_type": "SMB_SID", "id_value": "S-1-5-21"}
+    assert identities.name("none1", details) == "SMB_SID:S-1-5-21"
+    assert identities.name("none1", details) == "SMB_SID:S-1-5-21"
+    assert FakeClient.lookups == ["none1"]
+    identities.close()
+
+
+def test_failures_are_retried_later(monkeypatch: pytest.MonkeyPatch) -> None:
+    identities = resolver()
+    ids = [("bad1", None), ("bad2", None), ("3", None)]
+    assert identities.resolve(ids) == {"bad1": "bad1", "bad2": "bad2", "3": "user3"}
+    # not again for a while, in this process or another one
+    identities.resolve(ids)
+    worker = pickle.loads(pickle.dumps(identities))
+    assert worker.resolve(ids)["bad1"] == "bad1"
+    assert sorted(FakeClient.lookups) == ["3", "bad1", "bad2"]
+
+    monkeypatch.setattr(qwalk_identity, "IDENTITY_RETRY_SECONDS", 0)
+    identities.resolve(ids)
+    assert sorted(FakeClient.lookups) == ["3", "bad1", "bad1", "bad2", "bad2"]
+    identities.close()
+
+
+def test_concurrent_resolvers_look_up_every_id_once() -> None:
+    identities = resolver()
+    # like workers: a copy each, every one with its own sqlite connection
+    copies = [pickle.loads(pickle.dumps(identities)) for _ in range(4)]
+    ids = [(str(n), None) for n in range(10)]
+    names: List[Dict[str, str]] = []
+    threads = [
+        threading.Thread(target=lambda c=c: names.append(c.resolve(ids)))
+        for c in copies
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert names == [{str(n): "user%s" % n for n in range(10)}] * 4
+    assert sorted(FakeClient.lookups) == sorted(str(n) for n in range(10))
+    identities.close()
+
+
+def test_claimed_id_is_waited_for() -> None:
+    identities = resolver()
+    db = sqlite3.connect(identities.cache_path)
+    identities.connect()
+    db.execute("INSERT INTO claims VALUES ('1', ?)", (time.time(),))
+    db.commit()
+
+    def another_process() -> None:
+        time.sleep(0.2)
+        other = sqlite3.connect(identities.cache_path)
+        other.execute(
+            "INSERT INTO identities VALUES ('1', 'other1', ?)", (time.time(),)
+        )
+        other.execute("DELETE FROM claims")
+        other.commit()
+        other.close()
+
+    thread = threading.Thread(target=another_process)
+    thread.start()
+    assert identities.name("1") == "other1"
+    thread.join()
+    assert FakeClient.lookups == []
+    db.close()
+    identities.close()
+
+
+def test_claim_left_behind_is_taken_over(monkeypatch: pytest.MonkeyPatch) -> None:
+    identities = resolver()
+    identities.connect()
+    db = sqlite3.connect(identities.cache_path)
+    db.execute("INSERT INTO claims VALUES ('1', ?)", (time.time() - 1,))
+    db.commit()
+    monkeypatch.setattr(qwalk_identity, "IDENTITY_CLAIM_SECONDS", 0.5)
+    assert identities.name("1") == "user1"
+    assert FakeClient.lookups == ["1"]
+    assert db.execute("SELECT * FROM claims").fetchall() == []
+    db.close()
+    identities.close()
@@ -0,0 +1,71 @@
+import glob
+import os
+
+from typing import Callable, List
+
+import pytest
+
+from conftest import kill_after_checkpoint, Mock, RESUME_ENV, SMALL_TREE
+
+pyarrow = pytest.importorskip("pyarrow")
+pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+
+from qtasks.Inventory import parse_time  # pylint: disable=wrong-import-position
+
+
+def read_ids(out: str, fmt: str) -> List[int]:
+    ids: List[int] = []
+    for path in glob.glob(os.path.join(out, "part-*")):
+        if fmt == "arrow":
+            with pyarrow.memory_map(path) as source:
+                table = pyarrow.ipc.open_file(source).read_all()
+        else:
+            table = pyarrow_parquet.read_table(path)
+        ids += table.column("id").to_pylist()
+    return ids
+
+
+def test_parse_time() -> None:
+    assert parse_time("1970-01-01T00:00:01.5Z") == 1500000000
+    assert parse_time("2020-01-01T00:00:00.123456789Z") == 1577836800123456789
+    assert parse_time("") is None
+    assert parse_time("9999-01-01T00:00:00Z") is None
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_inventory(start_mock: Callable[..., Mock], workdir: str, fmt: str) -> None:
+    mock = start_mock(*SMALL_TREE)
+    walk = mock.walk(workdir, "Inventory", "--format", fmt, "--rows-per-group", "50")
+    assert walk.returncode == 0, walk.output
+    out = os.path.join(workdir, "inventory")
+    names = os.listdir(out)
+    assert names and all(
+        name.startswith("part-") and name.endswith("." + fmt) for name in names
+    )
+    ids = read_ids(out, fmt)
+    assert len(ids) == len(set(ids)) == walk.inodes
+    assert "%s rows in %s %s shards" % (walk.inodes, len(names), fmt) in walk.output
+
+
+def test_inventory_resume_after_kill(
+    start_mock: Callable[..., Mock], workdir: str
+) -> None:
+    mock = start_mock(
+        "--fanout", "4", "--depth", "4", "--files", "5", "--latency", "0.02"
+    )
+    args = ["--rows-per-group", "20"]
+    proc = mock.start(workdir, "Inventory", *args, env=RESUME_ENV)
+    kill_after_checkpoint(proc, workdir)
+    out = os.path.join(workdir, "inventory")
+    # the killed workers' shards have no footer yet
+    assert glob.glob(os.path.join(out, "part-*.parquet.tmp"))
+
+    walk = mock.walk(workdir, "Inventory", *args, "--resume", env=RESUME_ENV)
+    assert walk.returncode == 0, walk.output
+    assert "Resuming-" in walk.output, walk.output
+    assert not glob.glob(os.path.join(out, "*.tmp"))
+    assert not os.path.exists(os.path.join(out, "_shards.txt"))
+    ids = read_ids(out, "parquet")
+    dirs = 1 + 4 + 16 + 64 + 256
+    assert sorted(ids) == sorted(set(ids))
+    assert len(ids) == dirs - 1 + 5 * dirs
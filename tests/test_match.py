@@ -0,0 +1,93 @@
+import pathlib
+import random
+import re
+
+from typing import List, Sequence, Tuple
+
+from qwalk_match import AhoCorasick, PatternSet, required_literal
+
+LITERALS = ["file-1", "dir-2/", ".txt", "ü", "e-3", "dir-13/dir-4"]
+REGEXES = [
+    r".*\.TXT$",
+    r"/dir-\d+/file-1\d\.",
+    r"/dir-1/",
+    r"(/dir-\d)+/file",
+    r".*file-[0-4]\.txt",
+    r"[^/]*/dir-3",
+    r".*(a|b)c",
+    r"/$",
+]
+
+
+def corpus() -> List[str]:
+    rnd = random.Random(1)
+    names = ["dir-%d" % n for n in range(20)] + ["Über", "abc", "ABC"]
+    paths = ["/"]
+    for _ in range(2000):
+        depth = rnd.randint(1, 4)
+        path = "/" + "/".join(rnd.choice(names) for _ in range(depth))
+        if rnd.random() < 0.7:
+            path += "/file-%d.%s" % (rnd.randint(0, 30), rnd.choice(["txt", "TXT"]))
+        else:
+            path += "/"
+        paths.append(path)
+    return paths
+
+
+def expected(
+    literals: Sequence[Tuple[int, str]], regexes: Sequence[Tuple[int, str]], path: str
+) -> List[int]:
+    # what Search finds with one pattern at a time
+    found = [key for key, text in literals if text in path]
+    found += [key for key, text in regexes if re.match(text, path, re.IGNORECASE)]
+    return sorted(found)
+
+
+def test_pattern_set_matches_like_re() -> None:
+    literals = list(enumerate(LITERALS))
+    regexes = [(len(LITERALS) + n, text) for n, text in enumerate(REGEXES)]
+    patterns = PatternSet(literals, regexes)
+    assert patterns.count == len(LITERALS) + len(REGEXES)
+    for path in corpus():
+        assert patterns.match(path) == expected(literals, regexes, path), path
+
+
+def test_pattern_set_from_file(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "patterns.txt"
+    path.write_text(
+        "# comment\nfile-1\n\nre:.*\\.txt$\nstr:# not a comment\nre:(x)\n",
+        encoding="utf8",
+    )
+    patterns = PatternSet.from_file(str(path))
+    assert patterns.count == 4
+    assert patterns.match("/dir/file-12.TXT") == [2, 4]
+    assert patterns.match("/a/# not a comment") == [5]
+    assert patterns.match("x/") == [6]
+
+
+def test_aho_corasick_overlapping_words() -> None:
+    automaton = AhoCorasick([("he", 0), ("she", 1), ("his", 2), ("hers", 3)])
+    assert len(automaton) == 9
+    assert automaton.search("ushers") == {0, 1, 3}
+    assert automaton.search("hi") == set()
+
+
+def test_required_literal() -> None:
+    assert required_literal(r".*\.TXT$") == ".txt"
+    assert required_literal(r"/dir-\d+/files") == "/files"
+    assert required_literal(r"a.b") is None
+    assert required_literal(r"(abc|abd)") is None
+
+
+def test_patterns_with_global_flags() -> None:
+    regexes = [
+        (0, r"(?x) /dir-\d \s* /"),
+        (1, r"(?s).*\n"),
+        (2, r"/.(?-i:A)"),
+        (3, r".*b"),
+        (4, r"(?a)/\w+$"),
+    ]
+    patterns = PatternSet([], regexes)
+    assert patterns.merged == [2, 3]
+    for path in corpus() + ["/a\nb", "/ba", "/bA", "/Ü"]:
+        assert patterns.match(path) == expected([], regexes, path), path
@@ -0,0 +1,148 @@
+import json
+import multiprocessing
+import pathlib
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import free_port
+
+import qwalk_exporter
+
+from qwalk_exporter import MetricsExporter
+from qwalk_metrics import Histogram, Metrics, SECONDS_BUCKETS
+
+
+def test_histogram_quantiles() -> None:
+    histogram = Histogram((1, 2, 5), slots=2)
+    for value in (0.5, 1.5, 1.5, 4):
+        histogram.observe(0, value)
+    histogram.observe(1, 1.2)
+    counts, total = histogram.totals()
+    assert counts == [1, 3, 1, 0]
+    assert total == 8.7
+    assert histogram.quantile(0.2) == 1
+    assert histogram.quantile(0.5) == 2
+    assert histogram.quantile(1.0) == 5
+    assert Histogram((1,), slots=1).quantile(0.5) == 0.0
+
+
+def test_overflow_quantile_is_the_last_bound() -> None:
+    histogram = Histogram((1, 2, 5), slots=1)
+    histogram.observe(0, 1000)
+    assert histogram.quantile(0.99) == 5
+
+
+def test_histogram_labels() -> None:
+    histogram = Histogram((1, 2), slots=2, labels=2)
+    histogram.observe(0, 0.5, label=0)
+    histogram.observe(1, 1.5, label=1)
+    histogram.observe(1, 1.5, label=1)
+    assert histogram.totals(0) == ([1, 0, 0], 0.5)
+    assert histogram.totals(1) == ([0, 2, 0], 3.0)
+    assert histogram.quantile(0.5, 1) == 2
+
+
+def test_counters_add_up_every_slot() -> None:
+    metrics = Metrics(3, ["10.0.0.1", "10.0.0.2"])
+    metrics.add("dirs", 2)
+    metrics.set_slot(0)
+    metrics.add("dirs")
+    metrics.observe("rest_seconds", 0.003, label=1)
+    assert metrics.value("dirs") == 3
+    assert metrics.label_names("rest_seconds") == ["10.0.0.1", "10.0.0.2"]
+    assert metrics.label_names("batch_seconds") == [None]
+
+
+def count_in_worker(metrics: Metrics, slot: int) -> None:
+    metrics.set_slot(slot)
+    for _ in range(1000):
+        metrics.add("files")
+    metrics.observe("batch_seconds", 0.5)
+
+
+def test_every_process_counts_in_its_own_slot() -> None:
+    metrics = Metrics(3)
+    # the workers get the shared memory when they start, like the pool's
+    workers = [
+        multiprocessing.Process(target=count_in_worker, args=(metrics, slot))
+        for slot in range(2)
+    ]
+    for worker in workers:
+        worker.start()
+    metrics.add("files", 5)
+    for worker in workers:
+        worker.join()
+    assert metrics.value("files") == 2005
+    assert list(metrics.counters["files"]) == [1000, 1000, 5]
+    assert metrics.histograms["batch_seconds"].totals()[1] == 1.0
+
+
+def test_metrics_file_line_is_json() -> None:
+    metrics = Metrics(2, ["10.0.0.1"])
+    metrics.observe("rest_seconds", 100.0)
+    metrics.observe("batch_seconds", 100.0)
+    exporter = MetricsExporter(
+        metrics, lambda: {"queue": 3, "active_workers": 1}, {"task": "Search"}
+    )
+    metrics.add("dirs", 5)
+    record = json.loads(json.dumps(exporter.record(), allow_nan=False))
+    assert record["task"] == "Search"
+    assert record["dirs"] == 5
+    assert record["queue"] == 3
+    assert record["batch_p99_seconds"] == SECONDS_BUCKETS[-1]
+    assert record["nodes"]["10.0.0.1"] == {
+        "requests": 1,
+        "p50_seconds": SECONDS_BUCKETS[-1],
+        "p99_seconds": SECONDS_BUCKETS[-1],
+    }
+
+
+def test_prometheus_text() -> None:
+    metrics = Metrics(2, ["10.0.0.1"])
+    metrics.add("files", 7)
+    metrics.observe("rest_seconds", 0.003)
+    exporter = MetricsExporter(metrics, lambda: {"active_workers": 2}, {"task": 'a"b'})
+    text = exporter.prometheus()
+    assert 'qwalk_info{task="a\\"b"} 1' in text
+    assert "qwalk_files_total 7" in text
+    assert "qwalk_active_workers 2" in text
+    assert "qwalk_queue 0" in text
+    assert 'qwalk_rest_seconds_bucket{node="10.0.0.1",le="0.005"} 1' in text
+    assert 'qwalk_rest_seconds_bucket{node="10.0.0.1",le="+Inf"} 1' in text
+    assert 'qwalk_rest_seconds_count{node="10.0.0.1"} 1' in text
+
+
+def test_metrics_endpoint(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(qwalk_exporter, "log_it", lambda _text: None)
+    metrics = Metrics(2)
+    metrics.add("dirs", 4)
+    exporter = MetricsExporter(metrics, dict, {})
+    port = free_port()
+    exporter.serve(("127.0.0.1", port))
+    try:
+        url = "http://127.0.0.1:%s" % port
+        with urllib.request.urlopen(url + "/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert "qwalk_dirs_total 4" in response.read().decode("utf8")
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + "/other")
+        assert error.value.code == 404
+    finally:
+        exporter.stop()
+
+
+def test_metrics_file_rates(tmp_path: pathlib.Path) -> None:
+    metrics = Metrics(2)
+    exporter = MetricsExporter(metrics, dict, {})
+    exporter.last_time -= 2
+    metrics.add("files", 10)
+    path = str(tmp_path / "metrics.jsonl")
+    exporter.write(path)
+    exporter.write(path)
+    with open(path) as f:
+        first, second = [json.loads(line) for line in f]
+    assert first["files"] == second["files"] == 10
+    assert first["files_per_second"] == pytest.approx(5, rel=0.1)
+    assert second["files_per_second"] == 0
@@ -0,0 +1,104 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from qwalk_planner import TreePlanner
+from qwalk_prune import DirPruner
+
+
+class FakeTree:
+    """
+    Stands in for a RestClient's read_dir_aggregates: directory "1" has
+    directories "1-0" to "1-<fanout - 1>", down to depth levels, and every
+    directory has 10 files.
+    """
+
+    def __init__(self, fanout: int, depth: int):
+        self.fs = self
+        self.fanout = fanout
+        self.depth = depth
+        self.requests: List[Tuple[str, Optional[str]]] = []
+
+    def directories(self, level: int) -> int:
+        # directories below a directory at this level
+        if level >= self.depth:
+            return 0
+        return self.fanout * (1 + self.directories(level + 1))
+
+    def inodes(self, level: int) -> int:
+        return 10 * (self.directories(level) + 1) + self.directories(level)
+
+    def read_dir_aggregates(
+        self, id_: str, max_entries: int, snapshot: Optional[str] = None
+    ) -> Dict[str, Any]:
+        self.requests.append((id_, snapshot))
+        if id_ == "broken":
+            raise OSError("can't read it")
+        level = id_.count("-")
+        files: List[Dict[str, Any]] = [
+            {"type": "FS_FILE_TYPE_FILE", "name": "f", "id": "file"}
+        ] * 10
+        if level < self.depth:
+            files += [
+                {
+                    "type": "FS_FILE_TYPE_DIRECTORY",
+                    "name": "d%d" % n,
+                    "id": "%s-%d" % (id_, n),
+                    "num_files": 10 * (self.directories(level + 1) + 1),
+                    "num_directories": self.directories(level + 1),
+                }
+                for n in range(self.fanout)
+            ]
+        return {"files": files[:max_entries]}
+
+
+def listed(items: List[Dict[str, Any]]) -> List[str]:
+    # every directory the pieces list, each exactly once
+    return sorted(item["path_id"] for item in items)
+
+
+def test_small_tree_is_one_piece() -> None:
+    tree = FakeTree(3, 2)
+    assert TreePlanner(tree, None, 1, 100).plan("1", tree.inodes(0)) == [
+        {"type": "list_dir", "path_id": "1", "snapshot": None}
+    ]
+    assert tree.requests == []
+
+
+def test_split_into_pieces() -> None:
+    tree = FakeTree(3, 3)
+    total = tree.inodes(0)
+    planner = TreePlanner(tree, "5", 9, 100)
+    items = planner.plan("1", total, "/start")
+    # the root, its 3 children and their 9 subtrees
+    assert listed(items) == sorted(
+        ["1"]
+        + ["1-%d" % a for a in range(3)]
+        + ["1-%d-%d" % (a, b) for a in range(3) for b in range(3)]
+    )
+    assert items[0]["path_id"].count("-") == 2
+    root = [item for item in items if item["path_id"] == "1"][0]
+    assert root["skip"] == ["1-0", "1-1", "1-2"]
+    assert root["snapshot"] == "5"
+    assert planner.paths["1-2-1"] == "/start/d2/d1/"
+    assert all(snapshot == "5" for _id, snapshot in tree.requests)
+
+
+def test_request_budget() -> None:
+    tree = FakeTree(3, 3)
+    items = TreePlanner(tree, None, 100, 2).plan("1", tree.inodes(0))
+    assert len(tree.requests) == 2
+    assert len(items) == 2 + 3 + 2
+
+
+def test_pruned_children_are_left_to_the_listing() -> None:
+    tree = FakeTree(3, 3)
+    pruner = DirPruner("/", excludes=["d1"])
+    items = TreePlanner(tree, None, 9, 100, pruner).plan("1", tree.inodes(0))
+    assert not any(item["path_id"].startswith("1-1") for item in items)
+    root = [item for item in items if item["path_id"] == "1"][0]
+    assert root["skip"] == ["1-0", "1-2"]
+
+
+def test_failed_split_keeps_the_subtree() -> None:
+    tree = FakeTree(3, 3)
+    items = TreePlanner(tree, None, 9, 100).plan("broken", 1000)
+    assert items == [{"type": "list_dir", "path_id": "broken", "snapshot": None}]
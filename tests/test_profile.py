@@ -0,0 +1,73 @@
+import copy
+import os
+import pathlib
+import pstats
+
+from typing import Any, Dict, List, Set, Tuple
+
+import pytest
+
+import qwalk_profile
+
+from qwalk_profile import PhaseProfiler
+
+
+def listing() -> int:
+    return sum(range(1000))
+
+
+def batch() -> List[int]:
+    return sorted(range(1000))
+
+
+def functions(path: str) -> Set[str]:
+    # Stats.stats isn't in the stubs
+    stats: Dict[Tuple[str, int, str], Any] = getattr(pstats.Stats(path), "stats")
+    return {name for _file, _line, name in stats}
+
+
+def test_nothing_without_a_directory() -> None:
+    profiler = PhaseProfiler(None)
+    with profiler.phase("main"):
+        listing()
+    profiler.dump()
+    profiler.merge()
+    assert profiler.profiles == {}
+
+
+def test_phases_are_merged(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(qwalk_profile, "log_it", lambda _text: None)
+    directory = str(tmp_path / "profile")
+    main = PhaseProfiler(directory)
+    for slot in range(2):
+        worker = copy.copy(main)
+        worker.set_slot(slot)
+        with worker.phase("list_dir"):
+            listing()
+            # a batch run inline while listing
+            with worker.phase("every_batch"):
+                batch()
+        worker.dump()
+    with main.phase("main"):
+        with main.phase("main"):
+            listing()
+    main.dump()
+    main.merge()
+
+    assert sorted(os.listdir(directory)) == [
+        "all.prof",
+        "every_batch.prof",
+        "list_dir.prof",
+        "main.prof",
+        "profile.txt",
+    ]
+    path = os.path.join(directory, "%s.prof")
+    assert "batch" in functions(path % "every_batch")
+    assert "listing" not in functions(path % "every_batch")
+    assert "listing" in functions(path % "list_dir")
+    assert "batch" not in functions(path % "list_dir")
+    assert {"listing", "batch"} <= functions(path % "all")
+    with open(os.path.join(directory, "profile.txt")) as f:
+        assert "list_dir, 2 processes" in f.read()
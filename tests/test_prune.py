@@ -0,0 +1,48 @@
+from typing import Dict
+
+from qwalk_prune import DirPruner
+
+
+def entry(path: str, kind: str = "FS_FILE_TYPE_DIRECTORY") -> Dict[str, str]:
+    name = path.rstrip("/").rsplit("/", 1)[-1]
+    return {"id": "1", "name": name, "path": path, "type": kind}
+
+
+def test_nothing_to_prune() -> None:
+    pruner = DirPruner("/")
+    assert not pruner.active
+    assert pruner.descend(entry("/a/b/c/d/"))
+    entries = [entry("/a/")]
+    assert pruner.visible(entries) is entries
+
+
+def test_excludes_by_name_and_path() -> None:
+    pruner = DirPruner("/home", excludes=[".snapshot", "tmp*", "/home/*/cache/"])
+    assert pruner.active
+    assert not pruner.descend(entry("/home/joe/.snapshot/"))
+    assert not pruner.descend(entry("/home/joe/tmp-1/"))
+    assert not pruner.descend(entry("/home/joe/cache/"))
+    # like fnmatch, * matches across slashes
+    assert not pruner.descend(entry("/home/joe/src/cache/"))
+    assert pruner.descend(entry("/home/cache/"))
+    assert pruner.descend(entry("/home/joe/"))
+    # files are never excluded
+    assert pruner.visible([entry("/home/tmp-1", "FS_FILE_TYPE_FILE")])
+    visible = pruner.visible([entry("/home/tmp-1/"), entry("/home/joe/")])
+    assert [e["path"] for e in visible] == ["/home/joe/"]
+
+
+def test_max_depth_below_the_start() -> None:
+    pruner = DirPruner("/home/", max_depth=1)
+    assert pruner.descend(entry("/home/joe/"))
+    assert not pruner.descend(entry("/home/joe/src/"))
+    # still passed to the task
+    assert len(pruner.visible([entry("/home/joe/src/")])) == 1
+    assert not DirPruner("/", max_depth=0).descend(entry("/a/"))
+
+
+def test_should_descend() -> None:
+    pruner = DirPruner("/", should_descend=lambda dd: dd["name"] != "skip")
+    assert pruner.active
+    assert not pruner.descend(entry("/a/skip/"))
+    assert pruner.descend(entry("/skip-not/"))
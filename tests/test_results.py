@@ -0,0 +1,73 @@
+import copy
+import importlib.util
+import os
+import pathlib
+
+from typing import List, Optional, Tuple
+
+import pytest
+
+from qwalk_results import ResultWriter
+
+COMPRESSIONS: List[Optional[str]] = [None, "gzip"]
+if importlib.util.find_spec("zstandard") is not None:
+    COMPRESSIONS.append("zstd")
+
+
+@pytest.fixture(autouse=True)
+def in_workdir(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+
+
+def writers(
+    compression: Optional[str], count: int
+) -> Tuple[ResultWriter, List[ResultWriter]]:
+    main = ResultWriter(compression)
+    workers = [copy.copy(main) for _ in range(count)]
+    for slot, worker in enumerate(workers):
+        worker.set_slot(slot)
+    return main, workers
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_shards_are_merged_in_slot_order(compression: Optional[str]) -> None:
+    main, workers = writers(compression, 2)
+    workers[1].write("out.txt", ["c"])
+    workers[0].write("out.txt", ["a", "ü"])
+    # a checkpoint closes the shards, the next write starts another member
+    workers[0].close()
+    workers[0].write("out.txt", ["b"])
+    for worker in workers:
+        worker.close()
+    assert len(main.shards("out.txt")) == 2
+    main.merge(["out.txt", "other.txt"])
+    assert main.shards("out.txt") == []
+    assert list(main.read("out.txt")) == ["a\n", "ü\n", "b\n", "c\n"]
+    assert os.listdir(".") == [main.path("out.txt")]
+    main.remove("out.txt")
+    assert os.listdir(".") == []
+
+
+def test_merge_appends() -> None:
+    main, (worker,) = writers(None, 1)
+    with open("out.txt", "w") as f:
+        f.write("before\n")
+    worker.write("out.txt", ["after"])
+    worker.close()
+    main.merge(["out.txt"])
+    assert list(main.read("out.txt")) == ["before\n", "after\n"]
+
+
+def test_reset_removes_what_a_walk_left() -> None:
+    main, (worker,) = writers("gzip", 1)
+    worker.write("out.txt", ["a"])
+    worker.close()
+    with open("out.txt.gz", "wb"):
+        pass
+    main.reset(["out.txt"])
+    assert os.listdir(".") == []
+
+
+def test_unknown_compression() -> None:
+    with pytest.raises(ValueError):
+        ResultWriter("bzip2")
@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+
+from typing import Any, cast, Iterator, List, Optional, Tuple
+
+import pytest
+
+from conftest import Mock
+
+import qwalk_worker
+
+from qtasks.ModeBitsChecker import ModeBitsChecker
+from qwalk_ring import BatchRing, record_size
+from qwalk_worker import Creds, QWalkWorker
+
+
+def shm_exists(ring: BatchRing) -> bool:
+    return os.path.exists("/dev/shm/" + ring.shm.name)
+
+
+def put(ring: BatchRing, rows: List[Any]) -> Tuple[int, int]:
+    ref = ring.put(rows)
+    assert ref is not None
+    return ref
+
+
+@pytest.fixture
+def ring() -> Iterator[BatchRing]:
+    ring = BatchRing.create(4096)
+    if ring is None:
+        pytest.skip("no shared memory")
+    yield ring
+    if shm_exists(ring):
+        ring.close()
+
+
+def test_put_get_free(ring: BatchRing) -> None:
+    rows = [{"name": "a", "size": "1"}, {"name": "b", "size": "2"}]
+    ref = put(ring, rows)
+    assert ring.get(ref) == rows
+    assert ring.used() == record_size(ref[1])
+    ring.free(ref)
+    assert ring.used() == 0
+
+
+def test_records_free_in_any_order(ring: BatchRing) -> None:
+    refs = [put(ring, [n] * 10) for n in range(5)]
+    used = ring.used()
+    ring.free(refs[1])
+    # the tail only moves past freed records
+    assert ring.used() == used
+    ring.free(refs[0])
+    assert ring.used() == used - 2 * record_size(refs[0][1])
+    for ref in refs[2:]:
+        ring.free(ref)
+    assert ring.used() == 0
+
+
+def test_full_ring_and_wrapping(ring: BatchRing) -> None:
+    big = ["x" * 1500]
+    refs = [put(ring, big) for _ in range(2)]
+    assert ring.put(big) is None
+    assert ring.put([object()]) is None
+    ring.free(refs[0])
+    # doesn't fit at the end, starts over at the beginning
+    ref = ring.put(big)
+    assert ref is not None and ref[0] == 0
+    assert ring.get(ref) == big
+    assert ring.put(big) is None
+    ring.free(refs[1])
+    ring.free(ref)
+    assert ring.used() == 0
+
+
+def test_ring_unlinked_when_setup_fails(
+    small_mock: Mock, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    rings: List[Optional[BatchRing]] = []
+    create = BatchRing.create
+
+    def created(size: int) -> Optional[BatchRing]:
+        rings.append(create(size))
+        return rings[-1]
+
+    def no_pool(*_args: Any) -> None:
+        raise OSError("can't start the workers")
+
+    monkeypatch.setattr(BatchRing, "create", staticmethod(created))
+    monkeypatch.setattr(qwalk_worker, "OVERRIDE_IPS", "127.0.0.1")
+    monkeypatch.setattr(multiprocessing, "Pool", no_pool)
+    creds = cast(
+        Creds, {"QHOST": "127.0.0.1", "QPORT": small_mock.port, "QUSER": "admin"}
+    )
+    creds["QPASS"] = "admin"
+    with pytest.raises(OSError):
+        QWalkWorker(creds, ModeBitsChecker([]), "/", None, False, "log.txt", None)
+    assert rings and rings[0] is not None
+    assert not shm_exists(rings[0])
@@ -0,0 +1,183 @@
+import multiprocessing
+
+from typing import Any, cast, Dict, List, Sequence, Tuple
+
+import pytest
+
+import qwalk_router
+
+from qumulo.lib.request import RequestError
+from qwalk_metrics import Metrics
+from qwalk_router import NodeRouter, RoutedClient
+
+IPS = ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+
+
+@pytest.fixture(autouse=True)
+def no_exploring(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(qwalk_router, "EXPLORE", 0)
+    monkeypatch.setattr(qwalk_router, "log_it", lambda _text: None)
+
+
+def test_nodes_without_samples_first() -> None:
+    router = NodeRouter(IPS, 2)
+    router.start(0)
+    router.finish(0, 0.01, True)
+    assert router.pick() in (1, 2)
+    assert router.pick(exclude=[1, 2]) == 0
+
+
+def test_lowest_latency_times_load() -> None:
+    router = NodeRouter(IPS, 2)
+    for node, seconds in enumerate([0.03, 0.01, 0.02]):
+        router.start(node)
+        router.finish(node, seconds, True)
+    assert router.pick() == 1
+    # another process has three requests on node 1 in flight
+    other = NodeRouter(IPS, 2)
+    other.__dict__.update(router.__dict__)
+    other.set_slot(0)
+    for _ in range(3):
+        other.start(1)
+    router.refresh_stats()
+    assert router.pick() == 2
+
+
+def test_latency_average() -> None:
+    router = NodeRouter(IPS, 1)
+    router.start(0)
+    router.finish(0, 1.0, True)
+    router.start(0)
+    router.finish(0, 2.0, True)
+    assert router.latency[router.index(0)] == pytest.approx(1.2)
+    assert router.summary().startswith("10.0.0.1 2 req 0 err 1200ms, ")
+
+
+def test_failing_node_sits_out(monkeypatch: pytest.MonkeyPatch) -> None:
+    router = NodeRouter(IPS, 1)
+    for node in range(3):
+        router.start(node)
+        router.finish(node, 0.01, True)
+    router.start(0)
+    router.finish(0, 0.01, False)
+    assert router.down_until[router.index(0)] > 0
+    assert all(router.pick() != 0 for _ in range(20))
+    # twice as long for the next failure in a row, back once it works
+    first = router.down_until[router.index(0)]
+    router.finish(0, 0.01, False)
+    assert router.down_until[router.index(0)] - first == pytest.approx(
+        qwalk_router.NODE_DOWN_SECONDS, abs=0.5
+    )
+    router.finish(0, 0.01, True)
+    assert router.failures[router.index(0)] == 0
+    # when every node is down, any of them
+    monkeypatch.setattr(qwalk_router, "NODE_DOWN_SECONDS", 1000)
+    for node in range(3):
+        router.finish(node, 0.01, False)
+    assert router.pick() in (0, 1, 2)
+
+
+def test_node_another_process_has_out() -> None:
+    router = NodeRouter(IPS, 2)
+    other = NodeRouter(IPS, 2)
+    other.__dict__.update(router.__dict__)
+    other.set_slot(0)
+    other.start(1)
+    other.finish(1, 0.01, False)
+    router.refresh_stats()
+    assert all(router.pick() != 1 for _ in range(20))
+    # a request of this process that works doesn't bring it back for the
+    # other one, and doesn't forget the other one's failures
+    router.start(1)
+    router.finish(1, 0.01, True)
+    router.refresh_stats()
+    assert all(router.pick() != 1 for _ in range(20))
+    assert other.failures[other.index(1)] == 1
+
+
+class FakeRestClient:
+    """
+    Stands in for a RestClient on one node: fs.get_file_attr fails with the
+    node's error if there's one, or returns the node's address.
+    """
+
+    errors: Dict[str, Exception] = {}
+
+    def __init__(self, address: str, credentials: str):
+        self.address = address
+        self.credentials = credentials
+        self.fs = self
+
+    def get_file_attr(self, path: str) -> Tuple[str, str]:
+        error = self.errors.get(self.address)
+        if error is not None:
+            raise error
+        return (self.address, path)
+
+    def set_file_attr(self, path: str) -> Tuple[str, str]:
+        return self.get_file_attr(path)
+
+    def close(self) -> None:
+        pass
+
+
+class FakeSession:
+    def __init__(self) -> None:
+        self.generation = multiprocessing.RawValue("i", 1)
+        self.logins: List[Tuple[int, str]] = []
+
+    def credentials(self) -> str:
+        return "token-%d" % self.generation.value
+
+    def client(self, address: str) -> FakeRestClient:
+        return FakeRestClient(address, self.credentials())
+
+    def login(self, seen: int, address: str) -> None:
+        self.logins.append((seen, address))
+        self.generation.value += 1
+        FakeRestClient.errors.pop(address, None)
+
+
+def routed(ips: Sequence[str] = IPS) -> Tuple[RoutedClient, Metrics]:
+    metrics = Metrics(1, ips)
+    session = cast(Any, FakeSession())
+    return RoutedClient(NodeRouter(ips, 1), session, metrics), metrics
+
+
+def test_reads_are_retried_on_another_node() -> None:
+    FakeRestClient.errors = {"10.0.0.1": OSError("refused")}
+    rc, metrics = routed(IPS[:2])
+    # another process has node 1 out, the failing node 0 goes first
+    rc.router.down_until[rc.router.index(1, slot=0)] = 1e12
+    assert rc.fs.get_file_attr(path="/") == ("10.0.0.2", "/")
+    assert metrics.value("rest_retries") == 1
+    assert metrics.value("rest_errors") == 1
+
+
+def test_changes_and_client_errors_are_not_retried() -> None:
+    FakeRestClient.errors = {ip: RequestError(503, "down") for ip in IPS}
+    rc, _metrics = routed()
+    with pytest.raises(RequestError):
+        rc.fs.set_file_attr(path="/")
+    FakeRestClient.errors = {ip: RequestError(404, "not found") for ip in IPS}
+    with pytest.raises(RequestError):
+        rc.fs.get_file_attr(path="/")
+    assert sum(rc.router.requests) == 2
+    assert sum(rc.router.errors) == 1
+
+
+def test_every_node_failing() -> None:
+    FakeRestClient.errors = {ip: OSError("refused") for ip in IPS}
+    rc, metrics = routed()
+    with pytest.raises(OSError):
+        rc.fs.get_file_attr(path="/")
+    assert metrics.value("rest_retries") == 2
+
+
+def test_login_again_after_401() -> None:
+    FakeRestClient.errors = {"10.0.0.1": RequestError(401, "unauthorized")}
+    rc, metrics = routed(IPS[:1])
+    assert rc.fs.get_file_attr(path="/") == ("10.0.0.1", "/")
+    assert cast(FakeSession, rc.session).logins == [(1, "10.0.0.1")]
+    assert rc.clients[0].credentials == "token-2"
+    assert metrics.value("rest_logins") == 1
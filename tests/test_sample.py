@@ -0,0 +1,116 @@
+import hashlib
+import pickle
+import zlib
+
+from typing import Any, BinaryIO, Tuple
+
+import pytest
+
+from qwalk_sample import codec, FileSample, RangeSampler, SampleBuffer
+from qwalk_sketch import fingerprint
+
+
+class FakeClient:
+    """
+    Stands in for a RestClient: file "<size>" has <size> bytes, byte n of it
+    is n % 251.
+    """
+
+    def __init__(self) -> None:
+        self.fs = self
+
+    @staticmethod
+    def content(file_id: str, offset: int, length: int) -> bytes:
+        end = min(int(file_id), offset + length)
+        return bytes(n % 251 for n in range(offset, end))
+
+    def read_file(self, file_: BinaryIO, id_: str, offset: int, length: int) -> None:
+        if id_ == "missing":
+            raise OSError("no such file")
+        # in pieces, like a download
+        data = self.content(id_, offset, length)
+        for start in range(0, len(data), 1000):
+            file_.write(data[start : start + 1000])
+
+
+def sampler(*args: Any, **kwargs: Any) -> RangeSampler:
+    result = RangeSampler(*args, **kwargs)
+    client = FakeClient()
+    result.client = lambda: client
+    return result
+
+
+def sample(ranges: RangeSampler, file_info: Tuple[str, int]) -> FileSample:
+    result = ranges.sample(file_info)
+    assert result is not None
+    return result
+
+
+def test_codec() -> None:
+    data = bytes(1000)
+    assert codec("zlib")(data) == len(zlib.compress(data, 6))
+    assert codec("zlib:1")(data) == len(zlib.compress(data, 1))
+    assert codec("lzma:0")(data) < len(data)
+    with pytest.raises(ValueError):
+        codec("rot13")
+
+
+def test_sample_buffer_grows_and_is_reused() -> None:
+    buffer = SampleBuffer(4)
+    assert buffer.write(b"abc") == 3
+    buffer.write(b"def")
+    with buffer.view() as data:
+        assert bytes(data) == b"abcdef"
+    buffer.reset()
+    buffer.write(b"x")
+    with buffer.view() as data:
+        assert bytes(data) == b"x"
+    assert len(buffer.data) == 6
+
+
+def test_positions() -> None:
+    ranges = sampler(100, [0, 0.5, 1], ["zlib"])
+    assert ranges.positions(50) == [0, None, None]
+    assert ranges.positions(1000) == [0, 500, 900]
+    assert ranges.positions(1050) == [0, 500, 950]
+    assert ranges.positions(250) == [0, 100, None]
+
+
+def test_sample() -> None:
+    ranges = sampler(3000, [0, 1], ["zlib", "lzma"], block_size=1024)
+    result = sample(ranges, ("10000", 10000))
+    assert result.read == [3000, 3000]
+    last = FakeClient.content("10000", 7000, 3000)
+    assert result.md5[1] == hashlib.md5(last).digest()
+    assert result.compressed[0][1] == len(zlib.compress(last, 6))
+    assert len(result.blocks) == 6
+    assert result.blocks[3] == fingerprint(last[:1024])
+    assert result.sampled == 6000
+    assert ranges.sample(("missing", 10000)) is None
+
+
+def test_codec_failure_releases_the_buffer() -> None:
+    ranges = sampler(100, [0], ["zlib"])
+    ranges.codecs = [lambda data: 1 // 0]
+    # the traceback keeps the frame alive, like a future with the exception
+    with pytest.raises(ZeroDivisionError) as failure:
+        ranges.sample(("50", 50))
+    assert failure.traceback
+    # the same buffer, it has to grow for this one
+    ranges.codecs = [codec("zlib")]
+    assert sample(ranges, ("5000", 5000)).read == [100]
+    ranges.sample_size = 5000
+    assert sample(ranges, ("5000", 5000)).read == [5000]
+
+
+def test_run_in_order() -> None:
+    ranges = sampler(100, [0, 1], ["zlib"], threads=4)
+    files = [(str(size), size) for size in range(50, 5000, 97)]
+    assert ranges.client is not None
+    samples = list(ranges.run(files, ranges.client))
+    assert [f for f, _ in samples] == files
+    assert [s.read[0] for _, s in samples if s is not None] == [
+        min(size, 100) for _, size in files
+    ]
+    copy = pickle.loads(pickle.dumps(ranges))
+    assert copy.pool is None and len(copy.codecs) == 1
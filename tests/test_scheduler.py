@@ -0,0 +1,125 @@
+import copy
+import threading
+import time
+
+from typing import List, Tuple
+
+import pytest
+
+import qwalk_scheduler
+
+from qwalk_scheduler import WorkScheduler
+
+
+def workers(count: int) -> Tuple[WorkScheduler, List[WorkScheduler]]:
+    # a scheduler for the main process and one for every worker: copies share
+    # the queues and counters like the pool's processes do
+    scheduler = WorkScheduler(count)
+    others = [copy.copy(scheduler) for _ in range(count)]
+    for worker in others:
+        worker.register()
+    return scheduler, others
+
+
+def test_busy_workers() -> None:
+    scheduler = WorkScheduler(2)
+    scheduler.put("a")
+    scheduler.register()
+    assert (scheduler.active(), scheduler.busy()) == (1, 0)
+    assert scheduler.get(1) == "a"
+    assert scheduler.busy() == 1
+    # asking for the next item, there's none
+    assert scheduler.get(0.1) is None
+    assert scheduler.busy() == 0
+    scheduler.unregister()
+    assert scheduler.active() == 0
+    scheduler.close()
+
+
+def test_newest_first() -> None:
+    scheduler, (worker, _) = workers(2)
+    for item in "abc":
+        worker.put(item)
+    assert [worker.get(1) for _ in range(3)] == ["c", "b", "a"]
+    worker.done(3)
+    assert scheduler.pending() == 0
+    scheduler.close()
+
+
+def test_oldest_are_shared_and_stolen(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(qwalk_scheduler, "LOCAL_LIMIT", 4)
+    scheduler, (worker, thief) = workers(2)
+    for item in range(6):
+        worker.put(item)
+    assert list(worker.local) == [2, 3, 4, 5]
+    assert [thief.get(1), thief.get(1)] == [0, 1]
+    assert thief.get(0.1) is None
+    assert scheduler.pending() == 6
+    scheduler.close()
+
+
+def test_work_is_shared_with_idle_workers() -> None:
+    scheduler, (worker, thief) = workers(2)
+    thief.idle[thief.slot] = 1
+    for item in range(4):
+        worker.put(item)
+    # every time there's more than one item, the oldest goes
+    assert list(worker.local) == [3]
+    assert [thief.get(1) for _ in range(3)] == [0, 1, 2]
+    scheduler.close()
+
+
+def test_hold_and_done() -> None:
+    scheduler, (worker,) = workers(1)
+    scheduler.put("a")
+    scheduler.hold(2)
+    assert scheduler.pending() == 3
+    assert worker.get(1) == "a"
+    worker.done()
+    scheduler.done(2)
+    assert scheduler.pending() == 0
+    scheduler.close()
+
+
+def test_pause_drain_and_requeue() -> None:
+    scheduler, (worker, idle) = workers(2)
+    for item in "abc":
+        worker.put(item)
+    scheduler.request_pause()
+    assert worker.get(1) is None
+    paused = [threading.Thread(target=w.pause) for w in (worker, idle)]
+    for thread in paused:
+        thread.start()
+    assert scheduler.wait_paused(5)
+    # the private deques went to the shared queues
+    items = scheduler.drain(scheduler.pending(), 5)
+    assert sorted(items) == ["a", "b", "c"]
+    scheduler.requeue(items)
+    scheduler.resume()
+    for thread in paused:
+        thread.join(5)
+    found = [w.get(1) for w in (worker, idle, worker)]
+    assert sorted(found, key=str) == ["a", "b", "c"]
+    scheduler.close()
+
+
+def test_wait_paused_times_out() -> None:
+    scheduler, _ = workers(1)
+    scheduler.request_pause()
+    start = time.time()
+    assert not scheduler.wait_paused(0.2)
+    assert time.time() - start >= 0.2
+    scheduler.resume()
+    scheduler.close()
+
+
+def test_take_shared() -> None:
+    scheduler, _ = workers(2)
+    for item in range(5):
+        scheduler.put(item)
+    time.sleep(0.2)
+    taken = scheduler.take_shared(3) + scheduler.take_shared(3)
+    assert sorted(taken) == list(range(5))
+    # still pending until the host that took them is done
+    assert scheduler.pending() == 5
+    scheduler.close()
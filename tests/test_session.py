@@ -0,0 +1,58 @@
+from typing import Callable
+
+import pytest
+
+from conftest import Mock
+
+import qwalk_session
+
+from qwalk_session import SessionManager
+
+
+def session(mock: Mock) -> SessionManager:
+    return SessionManager("127.0.0.1", mock.port, "admin", "admin")
+
+
+def logins(mock: Mock) -> int:
+    return mock.stats().get("login", 0)
+
+
+def test_one_login_for_every_client(start_mock: Callable[..., Mock]) -> None:
+    mock = start_mock("--fanout", "1", "--depth", "1", "--files", "1")
+    shared = session(mock)
+    shared.login()
+    credentials = shared.credentials()
+    assert credentials.bearer_token.startswith("mock-")
+    assert shared.credentials() is credentials
+    for _ in range(3):
+        rc = shared.client()
+        assert rc.fs.get_file_attr(path="/")["type"] == "FS_FILE_TYPE_DIRECTORY"
+        rc.close()
+    assert logins(mock) == 1
+
+
+def test_someone_else_logged_in_already(start_mock: Callable[..., Mock]) -> None:
+    mock = start_mock("--fanout", "1", "--depth", "1", "--files", "1")
+    shared = session(mock)
+    shared.login()
+    seen = shared.generation.value
+    shared.login(seen)
+    assert shared.generation.value == seen + 1
+    # a second process saw the same token fail, and waited for the lock
+    shared.login(seen)
+    assert shared.generation.value == seen + 1
+    assert logins(mock) == 2
+
+
+def test_token_is_replaced_before_it_expires(
+    start_mock: Callable[..., Mock], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    mock = start_mock("--fanout", "1", "--depth", "1", "--files", "1")
+    shared = session(mock)
+    shared.login()
+    first = shared.credentials()
+    monkeypatch.setattr(qwalk_session, "SESSION_REFRESH_SECONDS", -1)
+    second = shared.credentials()
+    assert second is not first
+    assert shared.generation.value == 2
+    assert logins(mock) == 2
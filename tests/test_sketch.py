@@ -0,0 +1,59 @@
+import random
+
+from typing import Iterator
+
+import pytest
+
+from qwalk_sketch import fingerprint, HyperLogLog
+
+
+def values(start: int, stop: int) -> Iterator[int]:
+    return (fingerprint(b"%d" % n) for n in range(start, stop))
+
+
+def test_fingerprint() -> None:
+    assert fingerprint(b"block") == fingerprint(memoryview(b"block"))
+    assert fingerprint(b"block") != fingerprint(b"blocks")
+    assert 0 <= fingerprint(b"") < 2 ** 64
+
+
+def test_count_is_close() -> None:
+    for count in [10, 1000, 100000]:
+        sketch = HyperLogLog(12)
+        for value in values(0, count):
+            sketch.add(value)
+        # the standard error is 1.6%
+        assert abs(sketch.count() - count) < count * 0.05
+
+
+def test_duplicates_count_once() -> None:
+    sketch = HyperLogLog(10)
+    items = list(values(0, 500)) * 4
+    random.Random(1).shuffle(items)
+    for value in items:
+        sketch.add(value)
+    assert abs(sketch.count() - 500) < 500 * 0.1
+    assert HyperLogLog(10).count() == 0
+
+
+def test_merge() -> None:
+    left, right, both = HyperLogLog(12), HyperLogLog(12), HyperLogLog(12)
+    for value in values(0, 6000):
+        left.add(value)
+        both.add(value)
+    for value in values(4000, 10000):
+        right.add(value)
+        both.add(value)
+    left.merge(right)
+    assert left.registers == both.registers
+    with pytest.raises(ValueError):
+        left.merge(HyperLogLog(10))
+
+
+def test_dumps_loads() -> None:
+    sketch = HyperLogLog(8)
+    for value in values(0, 100):
+        sketch.add(value)
+    copy = HyperLogLog.loads(sketch.dumps())
+    assert copy.precision == 8
+    assert copy.registers == sketch.registers
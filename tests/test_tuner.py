@@ -0,0 +1,85 @@
+from typing import List
+
+import pytest
+
+import qwalk_tuner
+
+from qwalk_tuner import Autotuner
+
+
+def tuner(enabled: bool = True, interval: float = 0.0) -> Autotuner:
+    return Autotuner(enabled, 8, 4, 200, 100, 1000, interval)
+
+
+def test_page_size_follows_latency() -> None:
+    tune = tuner()
+    tune.tune_page_size(0.01)
+    assert tune.page_size == 400
+    for _ in range(5):
+        tune.tune_page_size(0.01)
+    assert tune.page_size == qwalk_tuner.PAGE_SIZE_LIMITS[1]
+    tune.tune_page_size(0.2)
+    assert tune.page_size == qwalk_tuner.PAGE_SIZE_LIMITS[1]
+    for _ in range(5):
+        tune.tune_page_size(1.0)
+    assert tune.page_size == qwalk_tuner.PAGE_SIZE_LIMITS[0]
+
+
+def test_batch_size_follows_every_batch_time() -> None:
+    tune = tuner()
+    tune.tune_batch_size(0.01)
+    assert tune.batch_size == 200
+    tune.tune_batch_size(1.0)
+    assert tune.batch_size == 200
+    tune.tune_batch_size(5.0)
+    assert tune.batch_size == 100
+
+
+def test_max_queue_length_grows_only_for_idle_workers() -> None:
+    tune = tuner()
+    tune.tune_max_queue_length(5000, 0)
+    assert tune.max_queue_length == 1000
+    tune.tune_max_queue_length(1000, 2)
+    assert tune.max_queue_length == 2000
+
+
+def test_workers(monkeypatch: pytest.MonkeyPatch) -> None:
+    logged: List[str] = []
+    monkeypatch.setattr(qwalk_tuner, "log_it", logged.append)
+    tune = tuner()
+    # more work than workers and cpu to spare
+    tune.tune_workers(1000, 0.1, 100, 0)
+    assert tune.worker_limit == 5
+    # it got slower, back to where it was
+    tune.last_throughput = 1000
+    tune.tune_workers(500, 0.1, 100, 0)
+    assert tune.worker_limit == 4
+    tune.tune_workers(500, 0.95, 100, 0)
+    assert tune.worker_limit == 3
+    # never more than the pool or fewer than one
+    for _ in range(10):
+        tune.tune_workers(500, 0.99, 100, 0)
+    assert tune.worker_limit == 1
+    assert logged[0] == "Autotune- workers 4 -> 5 (client cpu 10%, 100 queued)"
+    assert len(logged) == 5
+
+
+def test_tune_every_interval() -> None:
+    tune = tuner(interval=3600)
+    tune.record_request(0, 0.001)
+    tune.tune(100, 0, 0)
+    assert tune.page_size == 200
+    tune.interval = 0
+    tune.tune(100, 0, 0)
+    assert tune.page_size == 400
+    # nothing new since then
+    tune.tune(200, 0, 0)
+    assert tune.page_size == 400
+
+
+def test_disabled() -> None:
+    tune = tuner(enabled=False)
+    tune.record_request(0, 0.001)
+    tune.record_batch(8, 0.001)
+    tune.tune(100, 5000, 4)
+    assert (tune.page_size, tune.batch_size, tune.max_queue_length) == (200, 100, 1000)
@@ -0,0 +1,189 @@
+import collections
+import os
+
+from typing import Callable, List
+
+from conftest import kill_after_checkpoint, Mock, read_log, RESUME_ENV, SMALL_TREE
+
+# The small tree, see conftest.SMALL_TREE
+DIRS = 40
+FILES = 400
+
+
+def results(workdir: str, name: str = "output-walk-log.txt") -> List[str]:
+    with open(os.path.join(workdir, name)) as f:
+        return f.read().splitlines()
+
+
+def test_pool_walk(small_mock: Mock, workdir: str) -> None:
+    walk = small_mock.walk(workdir, "Search", "--re", ".*file-")
+    assert walk.returncode == 0, walk.output
+    assert walk.total == (DIRS, DIRS + FILES)
+    # the start directory isn't an entry of any listing
+    assert (walk.dirs, walk.inodes) == (DIRS, DIRS + FILES - 1)
+    lines = results(workdir)
+    assert len(lines) == FILES
+    assert len(set(lines)) == FILES
+    assert "/dir-2/dir-6/dir-17/file-9.txt" in lines
+
+
+def test_async_engine(small_mock: Mock, workdir: str) -> None:
+    walk = small_mock.walk(workdir, "Search", "--re", ".*file-", "--engine", "async")
+    assert walk.returncode == 0, walk.output
+    assert (walk.dirs, walk.inodes) == (DIRS, DIRS + FILES - 1)
+    assert sorted(results(workdir)) == sorted(set(results(workdir)))
+    assert len(results(workdir)) == FILES
+
+
+def test_max_depth(small_mock: Mock, workdir: str) -> None:
+    walk = small_mock.walk(workdir, "Search", "--re", ".*file-", "--max-depth", "1")
+    assert walk.returncode == 0, walk.output
+    # the start directory and its 3 subdirectories, their 9 subdirectories are
+    # entries but aren't listed
+    assert (walk.dirs, walk.inodes) == (4, 3 + 4 * 10 + 9)
+    assert all(line.count("/") <= 2 for line in results(workdir))
+    assert len(results(workdir)) == 40
+
+
+def test_exclude(small_mock: Mock, workdir: str) -> None:
+    walk = small_mock.walk(
+        workdir,
+        "Search",
+        "--re",
+        ".*file-",
+        "--exclude",
+        "dir-2",
+        "--exclude",
+        "*/dir-9",
+    )
+    assert walk.returncode == 0, walk.output
+    # dir-2 and dir-3/dir-9 have 12 and 3 directories below them
+    assert walk.dirs == DIRS - 13 - 4
+    lines = results(workdir)
+    assert len(lines) == (DIRS - 17) * 10
+    # the excluded directories aren't counted as entries either
+    assert walk.inodes == walk.dirs - 1 + len(lines)
+    assert not any(line.startswith("/dir-2/") for line in lines)
+    assert not any(line.startswith("/dir-3/dir-9/") for line in lines)
+
+
+def test_diff_counts(start_mock: Callable[..., Mock], workdir: str) -> None:
+    mock = start_mock(
+        "--fanout", "3", "--depth", "3", "--files", "10", "--diff-every", "7"
+    )
+    walk = mock.walk(
+        workdir,
+        "Search",
+        "--re",
+        ".",
+        "--cols",
+        "path,change",
+        "--snap",
+        "2",
+        "--diff",
+        "1",
+    )
+    assert walk.returncode == 0, walk.output
+    # files 0, 7 modified, 1, 8 created and 2, 9 deleted in every directory
+    changes = collections.Counter(line.split("|")[1] for line in results(workdir))
+    assert changes == {"MODIFY": 2 * DIRS, "CREATE": 2 * DIRS, "DELETE": 2 * DIRS}
+    assert walk.inodes == 6 * DIRS
+
+
+def test_resume_after_kill(start_mock: Callable[..., Mock], workdir: str) -> None:
+    mock = start_mock(
+        "--fanout", "4", "--depth", "4", "--files", "5", "--latency", "0.02"
+    )
+    proc = mock.start(workdir, "Search", "--re", ".*file-", env=RESUME_ENV)
+    kill_after_checkpoint(proc, workdir)
+
+    walk = mock.walk(workdir, "Search", "--re", ".*file-", "--resume", env=RESUME_ENV)
+    assert walk.returncode == 0, walk.output
+    assert "Resuming-" in walk.output, walk.output
+    dirs = 1 + 4 + 16 + 64 + 256
+    lines = results(workdir)
+    duplicates = [line for line, n in collections.Counter(lines).items() if n > 1]
+    assert duplicates == []
+    assert len(lines) == 5 * dirs
+    assert walk.dirs == dirs
+    assert not os.path.exists(os.path.join(workdir, "qwalk-checkpoint"))
+
+
+def test_async_resume_after_kill(start_mock: Callable[..., Mock], workdir: str) -> None:
+    mock = start_mock(
+        "--fanout", "4", "--depth", "4", "--files", "5", "--latency", "0.02"
+    )
+    args = ("Search", "--re", ".*file-", "--engine", "async")
+    # few listings at once so the walk is still going after a checkpoint
+    env = dict(RESUME_ENV, QASYNCCONCURRENCY="2")
+    proc = mock.start(workdir, *args, env=env)
+    kill_after_checkpoint(proc, workdir)
+    assert "Checkpoint- skipped" not in read_log(workdir)
+
+    walk = mock.walk(workdir, *args, "--resume", env=env)
+    assert walk.returncode == 0, walk.output
+    assert "Resuming-" in walk.output, walk.output
+    dirs = 1 + 4 + 16 + 64 + 256
+    lines = results(workdir)
+    duplicates = [line for line, n in collections.Counter(lines).items() if n > 1]
+    assert duplicates == []
+    assert len(lines) == 5 * dirs
+    assert walk.dirs == dirs
+
+
+def test_plan_slower_than_idle_workers_wait(
+    start_mock: Callable[..., Mock], workdir: str
+) -> None:
+    # a piece for every directory: its 40 aggregates requests take about 10
+    # seconds, longer than idle workers wait for work before they exit
+    mock = start_mock(*SMALL_TREE, "--latency", "0.25")
+    walk = mock.walk(
+        workdir, "Search", "--re", ".*file-", "--plan", env={"QPLANPIECES": "100"}
+    )
+    assert walk.returncode == 0, walk.output
+    assert "Planning-" in walk.output
+    assert (walk.dirs, walk.inodes) == (DIRS, DIRS + FILES - 1)
+    assert len(results(workdir)) == FILES
+
+
+def test_owner_names_are_looked_up_once(
+    start_mock: Callable[..., Mock], workdir: str
+) -> None:
+    mock = start_mock(*SMALL_TREE)
+    walk = mock.walk(
+        workdir, "Search", "--re", ".*file-", "--cols", "path,owner_name,group_name"
+    )
+    assert walk.returncode == 0, walk.output
+    owners = collections.Counter(line.split("|")[1] for line in results(workdir))
+    assert owners == {"user500": 160, "user501": 120, "user502": 120}
+    # owners 500 to 502 and group 501, each looked up by whichever worker
+    # claimed it first
+    assert mock.stats()["identity"] == 3
+
+
+def test_async_engine_with_plan_and_exclude(
+    start_mock: Callable[..., Mock], workdir: str
+) -> None:
+    # dir-2 has 2500 files, more than one page
+    mock = start_mock(*SMALL_TREE, "--huge-dirs", "1", "--huge-files", "2500")
+    walk = mock.walk(
+        workdir,
+        "Search",
+        "--re",
+        ".*file-",
+        "--engine",
+        "async",
+        "--plan",
+        "--exclude",
+        "dir-9",
+        env={"QPLANPIECES": "10", "QASYNCCONCURRENCY": "4"},
+    )
+    assert walk.returncode == 0, walk.output
+    assert "Planning-" in walk.output
+    lines = results(workdir)
+    assert len(set(lines)) == len(lines)
+    assert sum(line.startswith("/dir-2/file-") for line in lines) == 2500
+    # dir-3/dir-9 and its 3 subdirectories aren't listed
+    assert walk.dirs == DIRS - 4
+    assert len(lines) == (DIRS - 5) * 10 + 2500
+    assert walk.inodes == walk.dirs - 1 + len(lines)